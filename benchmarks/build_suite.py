@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""\
+Build benchmark suite
+---------------------
+
+Generates a synthetic project laid out as described in the README
+(``site_scons/build_config.py``, ``SConstruct``, ``src`` and ``test``
+SConscripts) and measures four phases with the amd_scons tree this
+script belongs to:
+
+* ``cold``: build from scratch, including the tool detection;
+* ``noop``: build again without changes;
+* ``edit_source``: build after editing one ``.cpp`` file;
+* ``edit_header``: build after editing the header every source includes.
+
+For each phase the time SCons spends reading the SConscript files, the
+wall time, the peak memory of the SCons process, the stat/lstat/listdir
+calls it makes and the number of compiles are recorded.  By default the
+fake toolchain of ``fake_compiler.py`` is used, so the numbers show the
+cost of the build system itself and the suite runs on any Linux machine
+in a few seconds; ``--real`` uses the compilers in PATH.  Results are
+written as JSON with ``--output`` and compared with an earlier run with
+``--compare``::
+
+    python benchmarks/build_suite.py --output before.json
+    (change amd_scons)
+    python benchmarks/build_suite.py --output after.json --compare before.json
+
+The exit status is 1 if a metric got worse by more than ``--threshold``.
+The project size is set by ``--components``, ``--sources`` (C++ sources
+per component), ``--fanout`` (headers each source includes), ``--depth``
+(length of the include chain behind each header) and ``--modules``
+(Fortran modules per component, each one using the previous one, and the
+first one the last module of the previous component).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+
+from project_templates import write_file, write_project_base
+
+AMD_SCONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_VERSION = 1
+
+PHASES = ('cold', 'noop', 'edit_source', 'edit_header')
+
+# metric: (unit, absolute change below which it is not a regression)
+METRICS = dict(sconscript=('s', 0.05),
+               wall=('s', 0.2),
+               memory=('MiB', 2.0),
+               stat=('', 200),
+               compiles=('', 0))
+
+SRC_SCONSCRIPT = """\
+import os
+from build import build_lninclude, build_lib, cxx_source_files, \\
+    fortran_source_files, build_objects
+
+Import('env')
+
+target = 'bench'
+
+subdirs = %r
+
+src_include = list(build_lninclude(env))
+
+for d in subdirs:
+    SConscript(os.path.join(d, 'SConscript'), exports=['env', 'src_include'])
+
+objs_all = build_objects(env,
+                         cxx_source=cxx_source_files,
+                         fortran_source=fortran_source_files)
+
+build_lib(env,
+          target=target,
+          sources=objs_all,
+          program_inc=env['THIRDPARTY_INCS'],
+          program_libs=env['THIRDPARTY_LIBS'])
+"""
+
+COMPONENT_SCONSCRIPT = """\
+from build import add_source_files, cxx_source_files, fortran_source_files
+
+cxxfiles = %r
+fortranfiles = %r
+
+add_source_files(cxxfiles, cxx_source_files)
+add_source_files(fortranfiles, fortran_source_files)
+"""
+
+TEST_SCONSCRIPT = """\
+from build import build_app
+Import('env')
+
+env.Append(THIRDPARTY_LIBS='bench')
+env.Append(THIRDPARTY_LIBS='stdc++')
+env.Append(THIRDPARTY_LIBS='gfortran')
+
+for appfile in %r:
+    build_app(env,
+              target=appfile,
+              sources=appfile + '.cpp',
+              program_inc=env['THIRDPARTY_INCS'],
+              program_libs=env['THIRDPARTY_LIBS'],
+              linker=env['CXX_LINKER'])
+"""
+
+
+def _header(c, level):
+    return 'comp%02d_h%d.hpp' % (c, level)
+
+
+def generate_project(root, components=20, sources=10, fanout=4, depth=3,
+                     modules=3, apps=2):
+    """Write the benchmark project into root
+
+    Every component has an include chain of depth headers; each source
+    includes the first header of its own component, of component 0 and of
+    fanout - 2 further components.
+
+    Returns:
+        dict: 'source' and 'header' edited by the edit phases
+    """
+    write_project_base(root)
+
+    names = ['comp%02d' % c for c in range(components)]
+    write_file(os.path.join(root, 'src', 'SConscript'),
+               SRC_SCONSCRIPT % names)
+    depth = max(depth, 1)
+    for c, name in enumerate(names):
+        comp_dir = os.path.join(root, 'src', name)
+        for level in range(depth):
+            text = '#pragma once\n'
+            if level + 1 < depth:
+                text += '#include "%s"\n' % _header(c, level + 1)
+            text += 'inline int %s_h%d(int x) { return x + %d; }\n' % (
+                name, level, level)
+            write_file(os.path.join(comp_dir, _header(c, level)), text)
+
+        included = [c, 0] + [(c + k) % components
+                             for k in range(1, max(fanout - 1, 1))]
+        included = sorted(set(included))[:max(fanout, 1)]
+        cxx = []
+        for s in range(sources):
+            filename = '%s_s%02d.cpp' % (name, s)
+            cxx.append(filename)
+            text = ''.join('#include "%s"\n' % _header(i, 0)
+                           for i in included)
+            text += 'int %s_s%02d(int x) { return x * %d; }\n' % (name, s, s)
+            write_file(os.path.join(comp_dir, filename), text)
+
+        fortran = []
+        for m in range(modules):
+            filename = '%s_m%d.f90' % (name, m)
+            fortran.append(filename)
+            if m > 0:
+                use = '  use %s_m%d\n' % (name, m - 1)
+            elif c > 0 and modules > 0:
+                use = '  use %s_m%d\n' % (names[c - 1], modules - 1)
+            else:
+                use = ''
+            text = ('module %s_m%d\n%s  implicit none\n  integer :: v%d = %d\n'
+                    'end module %s_m%d\n' % (name, m, use, m, m, name, m))
+            write_file(os.path.join(comp_dir, filename), text)
+        write_file(os.path.join(comp_dir, 'SConscript'),
+                   COMPONENT_SCONSCRIPT % (cxx, fortran))
+
+    appnames = ['app%02d' % a for a in range(apps)]
+    write_file(os.path.join(root, 'test', 'SConscript'),
+               TEST_SCONSCRIPT % appnames)
+    for app in appnames:
+        write_file(os.path.join(root, 'test', app + '.cpp'),
+                   '#include "%s"\nint main() { return 0; }\n' % _header(0, 0))
+    return dict(source=os.path.join(root, 'src', names[0],
+                                    '%s_s00.cpp' % names[0]),
+                header=os.path.join(root, 'src', names[0],
+                                    _header(0, depth - 1)))
+
+
+def clean_project(root):
+    """Remove everything a build wrote into root"""
+    for name in ('build', 'install'):
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    for name in os.listdir(root):
+        if name.startswith('.sconsign'):
+            os.remove(os.path.join(root, name))
+
+
+def _append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def run_scons(project, args, env):
+    """Run SCons in project through scons_stats.py
+
+    Returns:
+        dict: the metrics of the run
+    """
+    stats_file = os.path.join(project, 'build', '.bench_stats.json')
+    log = os.path.join(project, 'build', '.bench_compiles.log')
+    if not os.path.isdir(os.path.dirname(stats_file)):
+        os.makedirs(os.path.dirname(stats_file))
+    for path in (stats_file, log):
+        if os.path.exists(path):
+            os.remove(path)
+    env = dict(env, AMD_BENCH_STATS=stats_file, FAKE_CC_LOG=log)
+    command = [sys.executable,
+               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'scons_stats.py'), '-Q', '--debug=time'] + args
+    start = time.time()
+    proc = subprocess.Popen(command, cwd=project, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.stdout.read().decode('utf-8', 'replace')
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    proc.returncode = status
+    if status != 0:
+        sys.stdout.write(out)
+        raise RuntimeError('scons failed in %s' % project)
+
+    match = re.search(r'Total SConscript file execution time: ([0-9.]+) '
+                      r'seconds', out)
+    try:
+        with open(stats_file) as f:
+            counts = json.load(f)
+    except (IOError, OSError, ValueError):
+        counts = {}
+    compiles = None
+    if os.path.exists(log):
+        with open(log) as f:
+            compiles = sum(1 for line in f
+                           if ' -c ' in line and ' -E' not in line)
+    return dict(sconscript=float(match.group(1)) if match else None,
+                wall=wall,
+                memory=usage.ru_maxrss / 1024.0,
+                stat=counts.get('stat', 0) + counts.get('lstat', 0),
+                listdir=counts.get('listdir', 0) + counts.get('scandir', 0),
+                compiles=compiles)
+
+
+def run_phases(project, edits, args, env):
+    """Run the four phases once
+
+    Returns:
+        dict: metrics of each phase
+    """
+    results = {}
+    clean_project(project)
+    results['cold'] = run_scons(project, args, env)
+    results['noop'] = run_scons(project, args, env)
+    _append(edits['source'], '// edited\n')
+    results['edit_source'] = run_scons(project, args, env)
+    _append(edits['header'], '// edited\n')
+    results['edit_header'] = run_scons(project, args, env)
+    return results
+
+
+def _best(runs):
+    """Fastest time and highest memory of each metric over several runs"""
+    best = {}
+    for phase in PHASES:
+        values = [r[phase] for r in runs]
+        best[phase] = {}
+        for key in values[0]:
+            data = [v[key] for v in values if v[key] is not None]
+            if not data:
+                best[phase][key] = None
+            elif key == 'memory':
+                best[phase][key] = max(data)
+            else:
+                best[phase][key] = min(data)
+    return best
+
+
+def _revision():
+    try:
+        out = subprocess.check_output(
+            ['git', '-C', AMD_SCONS_DIR, 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the changes against baseline
+
+    Returns:
+        list: (phase, metric, old, new) of the regressions
+    """
+    regressions = []
+    print('%-12s %-10s %12s %12s %8s' %
+          ('phase', 'metric', 'baseline', 'current', 'change'))
+    for phase in PHASES:
+        for metric, (unit, floor) in sorted(METRICS.items()):
+            old = baseline['phases'].get(phase, {}).get(metric)
+            new = results['phases'][phase].get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            flag = ''
+            if new - old > floor and new > old * (1.0 + threshold):
+                regressions.append((phase, metric, old, new))
+                flag = '  REGRESSION'
+            print('%-12s %-10s %12.3f %12.3f %+7.1f%%%s' %
+                  (phase, metric, old, new, 100.0 * change, flag))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--components', type=int, default=20,
+                        help='components (directories under src)')
+    parser.add_argument('--sources', type=int, default=10,
+                        help='C++ sources per component')
+    parser.add_argument('--fanout', type=int, default=4,
+                        help='headers included by each source')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='include chain behind each header')
+    parser.add_argument('--modules', type=int, default=3,
+                        help='Fortran modules per component')
+    parser.add_argument('--apps', type=int, default=2,
+                        help='applications in test')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='parallel jobs of the builds')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs of all phases, the best is reported')
+    parser.add_argument('--real', action='store_true',
+                        help='use the compilers in PATH, not the fake ones')
+    parser.add_argument('--scons-arg', action='append', default=[],
+                        help='extra scons argument, e.g. DEPFILES=1')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as regression')
+    parser.add_argument('--dir', help='project directory, kept afterwards')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='amd_scons_suite_')
+    try:
+        project = args.dir or os.path.join(tmp, 'project')
+        params = dict(components=args.components, sources=args.sources,
+                      fanout=args.fanout, depth=args.depth,
+                      modules=args.modules, apps=args.apps, jobs=args.jobs,
+                      real=args.real, scons_args=args.scons_arg)
+        env = dict(os.environ, AMD_SCONS_DIR=AMD_SCONS_DIR)
+        if not args.real:
+            from fake_compiler import install_fake_toolchain
+            bin_dir = os.path.join(tmp, 'bin')
+            install_fake_toolchain(bin_dir)
+            env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+        scons_args = ['-j%d' % args.jobs] + args.scons_arg
+
+        runs = []
+        for i in range(args.repeat):
+            shutil.rmtree(project, ignore_errors=True)
+            edits = generate_project(project, args.components, args.sources,
+                                     args.fanout, args.depth, args.modules,
+                                     args.apps)
+            runs.append(run_phases(project, edits, scons_args, env))
+        results = dict(version=RESULT_VERSION,
+                       revision=_revision(),
+                       date=time.strftime('%Y-%m-%d %H:%M:%S'),
+                       host=socket.gethostname(),
+                       python=platform.python_version(),
+                       params=params,
+                       phases=_best(runs))
+    finally:
+        shutil.rmtree(tmp)
+
+    print('%d components, %d sources, fan-out %d, depth %d, %d modules' %
+          (args.components, args.sources, args.fanout, args.depth,
+           args.modules))
+    print('%-12s %16s %10s %16s %10s %9s' %
+          ('phase', 'SConscripts (s)', 'wall (s)', 'peak RSS (MiB)',
+           'stat', 'compiles'))
+    for phase in PHASES:
+        r = results['phases'][phase]
+        print('%-12s %16.3f %10.3f %16.1f %10d %9s' %
+              (phase, r['sconscript'] or 0.0, r['wall'], r['memory'],
+               r['stat'], '-' if r['compiles'] is None else r['compiles']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print('Warning: %s was measured with other parameters' %
+                  args.compare)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
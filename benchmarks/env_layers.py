@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""\
+Environment layer benchmark
+---------------------------
+
+Generates a project with many libraries built by ``build_objects`` and
+``build_lib`` plus a few applications built by ``build_app``, and measures
+the time SCons spends reading the SConscript files and the peak memory of
+a dry run (``scons -n``).  Compare the current tree against an older
+revision of amd_scons with::
+
+    python benchmarks/env_layers.py --baseline <git revision>
+
+The project is written to a temporary directory unless ``--dir`` is
+given.  Peak memory is taken from ``wait4`` and only available on Unix.
+"""
+
+import io
+import os
+import re
+import sys
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+from project_templates import write_file, write_project_base
+
+AMD_SCONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SRC_SCONSCRIPT = """\
+Import('env')
+for name in %r:
+    SConscript(name + '/SConscript', exports=['env'])
+"""
+
+LIB_SCONSCRIPT = """\
+import os
+from build import build_objects, build_lib
+Import('env')
+
+here = Dir('.').srcnode().abspath
+objs = build_objects(
+    env,
+    cxx_source=[os.path.join(here, f) for f in %r],
+    c_source=[os.path.join(here, f) for f in %r],
+    fortran_source=[os.path.join(here, f) for f in %r])
+build_lib(env,
+          target=%r,
+          sources=objs,
+          program_inc=env['THIRDPARTY_INCS'],
+          program_libs=env['THIRDPARTY_LIBS'])
+"""
+
+TEST_SCONSCRIPT = """\
+from build import build_app
+Import('env')
+for i, libs in enumerate(%r):
+    build_app(env,
+              target='app%%02d' %% i,
+              sources='app%%02d.cpp' %% i,
+              program_inc=env['THIRDPARTY_INCS'],
+              program_libs=env['THIRDPARTY_LIBS'] + libs,
+              linker=env['CXX_LINKER'])
+"""
+
+
+def generate_project(root, nlibs, nsources, napps):
+    """Write a project with nlibs libraries of nsources sources each
+
+    Every library has C++, C and Fortran sources, so that build_objects
+    calls build_object for each of them.  The applications link all
+    libraries.
+    """
+    write_project_base(root)
+
+    libs = ['lib%02d' % i for i in range(nlibs)]
+    write_file(os.path.join(root, 'src', 'SConscript'),
+               SRC_SCONSCRIPT % libs)
+    for lib in libs:
+        lib_dir = os.path.join(root, 'src', lib)
+        cxx, c, fortran = [], [], []
+        for j in range(nsources):
+            name = '%s_%02d' % (lib, j)
+            if j % 4 == 2:
+                filename = name + '.c'
+                c.append(filename)
+                text = 'int %s(int x) { return x + %d; }\n' % (name, j)
+            elif j % 4 == 3:
+                filename = name + '.f90'
+                fortran.append(filename)
+                text = ('subroutine %s(x)\n  integer :: x\n  x = x + %d\n'
+                        'end subroutine\n' % (name, j))
+            else:
+                filename = name + '.cpp'
+                cxx.append(filename)
+                text = ('#include "%s.hpp"\nint %s(int x) '
+                        '{ return x * %d; }\n' % (lib, name, j))
+            write_file(os.path.join(lib_dir, filename), text)
+        write_file(os.path.join(lib_dir, lib + '.hpp'), '#pragma once\n')
+        write_file(os.path.join(lib_dir, 'SConscript'),
+                   LIB_SCONSCRIPT % (cxx, c, fortran, lib))
+
+    write_file(os.path.join(root, 'test', 'SConscript'),
+               TEST_SCONSCRIPT % ([libs] * napps))
+    for i in range(napps):
+        write_file(os.path.join(root, 'test', 'app%02d.cpp' % i),
+                   'int main() { return 0; }\n')
+
+
+def export_revision(revision, dest):
+    """Extract the amd_scons files of a git revision into dest"""
+    data = subprocess.check_output(
+        ['git', '-C', AMD_SCONS_DIR, 'archive', '--format=tar', revision])
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        tar.extractall(dest)
+
+
+def measure(project, amd_scons_dir):
+    """Run a dry build of project with the amd_scons modules of a directory
+
+    Returns:
+        dict: SConscript reading time, total time in seconds and peak
+            resident memory in MiB
+    """
+    build = os.path.join(project, 'build')
+    if os.path.isdir(build):
+        shutil.rmtree(build)
+    sconsign = os.path.join(project, '.sconsign.dblite')
+    if os.path.exists(sconsign):
+        os.remove(sconsign)
+
+    env = dict(os.environ, AMD_SCONS_DIR=amd_scons_dir)
+    command = [os.environ.get('SCONS', 'scons'), '-Q', '-n',
+               '--debug=time']
+    proc = subprocess.Popen(command, cwd=project, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.stdout.read().decode('utf-8', 'replace')
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    if status != 0:
+        sys.stdout.write(out)
+        raise RuntimeError('scons failed in %s' % project)
+
+    def seconds(label):
+        match = re.search(r'%s: ([0-9.]+) seconds' % label, out)
+        return float(match.group(1)) if match else float('nan')
+
+    return dict(sconscript=seconds('Total SConscript file execution time'),
+                total=seconds('Total build time'),
+                memory=usage.ru_maxrss / 1024.0)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--libs', type=int, default=50,
+                        help='number of libraries (default 50)')
+    parser.add_argument('--sources', type=int, default=8,
+                        help='sources per library (default 8)')
+    parser.add_argument('--apps', type=int, default=5,
+                        help='applications linking all libraries')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per tree, the fastest is reported')
+    parser.add_argument('--baseline',
+                        help='git revision of amd_scons to compare with')
+    parser.add_argument('--dir', help='project directory, kept afterwards')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='amd_scons_bench_')
+    try:
+        project = args.dir or os.path.join(tmp, 'project')
+        generate_project(project, args.libs, args.sources, args.apps)
+        trees = []
+        if args.baseline:
+            baseline = os.path.join(tmp, 'baseline')
+            export_revision(args.baseline, baseline)
+            trees.append((args.baseline, baseline))
+        trees.append(('current', AMD_SCONS_DIR))
+
+        print('%d libraries, %d sources each, %d applications' %
+              (args.libs, args.sources, args.apps))
+        print('%-12s %16s %10s %16s' %
+              ('tree', 'SConscripts (s)', 'total (s)', 'peak RSS (MiB)'))
+        for name, path in trees:
+            runs = [measure(project, path) for i in range(args.repeat)]
+            print('%-12s %16.3f %10.3f %16.1f' %
+                  (name, min(r['sconscript'] for r in runs),
+                   min(r['total'] for r in runs),
+                   max(r['memory'] for r in runs)))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
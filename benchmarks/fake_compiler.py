@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""\
+Fake toolchain
+--------------
+
+Stands in for gcc, g++, gfortran, ar and ranlib in the benchmark projects
+of ``build_suite.py``, so that the build system can be measured on any
+machine without the real compilers.  ``install_fake_toolchain`` writes
+small executables of these names into a directory that is put first in
+PATH.  The fake tools understand what amd_scons passes them:
+
+* ``-c`` writes an object whose content is a hash of the flags and the
+  preprocessed source, so edits change the object as with a real
+  compiler;
+* ``-E`` writes the source with its ``#include`` files expanded;
+* Fortran compiles write ``<module>.mod`` into the ``-J`` directory;
+* ``-MMD -MF file`` writes a make-style dependency file;
+* links, ``ar`` and ``ranlib`` write or keep a hash of their inputs;
+* ``--version`` reports gcc, so the gcc flag table is used.
+
+``FAKE_CC_DELAY`` (seconds) makes every compile sleep, ``FAKE_CC_LOG``
+names a file every invocation is appended to.
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+
+TOOLS = ('gcc', 'g++', 'gfortran', 'ar', 'ranlib')
+
+_include_re = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.M)
+_module_re = re.compile(r'^\s*module\s+(\w+)\s*$', re.M | re.I)
+_fortran_suffixes = ('.f', '.F', '.f90', '.F90', '.f95', '.F95', '.f03',
+                     '.F03', '.f08', '.F08')
+_source_suffixes = ('.c', '.cc', '.cpp', '.cxx', '.C') + _fortran_suffixes
+
+LAUNCHER = """\
+#!%(python)s
+import sys
+sys.path.insert(0, %(dir)r)
+from fake_compiler import main
+sys.exit(main(%(tool)r, sys.argv[1:]))
+"""
+
+
+def install_fake_toolchain(bin_dir):
+    """Write the fake tool executables into bin_dir"""
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as f:
+            f.write(LAUNCHER % dict(python=sys.executable, dir=here,
+                                    tool=tool))
+        os.chmod(path, 0o755)
+
+
+def _expand(path, include_dirs, seen, deps):
+    """Text of path with its quoted includes expanded once each"""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except (IOError, OSError):
+        return ''
+    here = os.path.dirname(path)
+
+    def include(m):
+        for d in [here] + include_dirs:
+            candidate = os.path.normpath(os.path.join(d, m.group(1)))
+            if os.path.isfile(candidate):
+                if candidate in seen:
+                    return ''
+                seen.add(candidate)
+                deps.append(candidate)
+                return _expand(candidate, include_dirs, seen, deps)
+        return m.group(0)
+
+    return _include_re.sub(include, text)
+
+
+def _parse(args):
+    options = dict(output=None, compile=False, preprocess=False,
+                   module_dir='.', depfile=None, includes=[], inputs=[],
+                   flags=[])
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a in ('-o', '-MF', '-J', '-I') and i + 1 < len(args):
+            value = args[i + 1]
+            i += 2
+        elif a[:2] in ('-o', '-J', '-I') and len(a) > 2:
+            a, value = a[:2], a[2:]
+            i += 1
+        else:
+            value = None
+            i += 1
+        if a == '-o':
+            options['output'] = value
+        elif a == '-MF':
+            options['depfile'] = value
+        elif a == '-J':
+            options['module_dir'] = value
+        elif a == '-I':
+            options['includes'].append(value)
+        elif a == '-c':
+            options['compile'] = True
+        elif a == '-E':
+            options['preprocess'] = True
+        elif not a.startswith('-'):
+            options['inputs'].append(a)
+        else:
+            options['flags'].append(a)
+    return options
+
+
+def _write(path, text):
+    tmp = '%s.fake.%d' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _digest(parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode('utf-8', 'replace'))
+    return h.hexdigest()
+
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return ''
+
+
+def _archive(args):
+    # ar <flags> <archive> <members...>
+    if len(args) < 2:
+        return 1
+    _write(args[1], 'fake archive %s\n' %
+           _digest(_file_digest(m) for m in args[2:]))
+    return 0
+
+
+def _compile(tool, options):
+    source = options['inputs'][0]
+    deps = []
+    text = _expand(source, options['includes'], set(), deps)
+    if options['preprocess']:
+        sys.stdout.write(text)
+        return 0
+    delay = float(os.environ.get('FAKE_CC_DELAY') or 0)
+    if delay:
+        time.sleep(delay)
+    output = options['output'] or \
+        os.path.splitext(os.path.basename(source))[0] + '.o'
+    if source.endswith(_fortran_suffixes):
+        for name in _module_re.findall(text):
+            if name.lower() == 'procedure':
+                continue
+            # the interface of the fake modules is their whole source
+            _write(os.path.join(options['module_dir'], name.lower() + '.mod'),
+                   'fake module %s %s\n' % (name.lower(), _digest([text])))
+    _write(output, 'fake object %s\n' %
+           _digest([tool, ' '.join(options['flags']), text]))
+    if options['depfile']:
+        _write(options['depfile'], '%s: %s\n' %
+               (output, ' \\\n '.join([source] + deps)))
+    return 0
+
+
+def main(tool, args):
+    """Run the fake tool with the command line arguments args"""
+    log = os.environ.get('FAKE_CC_LOG')
+    if log:
+        with open(log, 'a') as f:
+            f.write('%s %s\n' % (tool, ' '.join(args)))
+    if '--version' in args:
+        print('%s (GCC) 12.2.0 fake\nCopyright (C) Free Software Foundation'
+              % tool)
+        return 0
+    if tool == 'ar':
+        return _archive(args)
+    if tool == 'ranlib':
+        return 0
+
+    options = _parse(args)
+    sources = [a for a in options['inputs'] if a.endswith(_source_suffixes)]
+    if options['compile'] or options['preprocess']:
+        if len(sources) != 1:
+            sys.stderr.write('%s: expected one source\n' % tool)
+            return 1
+        options['inputs'] = sources
+        return _compile(tool, options)
+    if not options['inputs'] or options['output'] is None:
+        sys.stderr.write('%s: no input files\n' % tool)
+        return 1
+    # link
+    _write(options['output'], 'fake executable %s\n' %
+           _digest(_file_digest(i) for i in options['inputs']))
+    os.chmod(options['output'], 0o755)
+    return 0
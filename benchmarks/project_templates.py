@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""\
+Benchmark project templates
+---------------------------
+
+``SConstruct`` and ``site_scons/build_config.py`` of the projects
+generated by ``build_suite.py`` and ``env_layers.py``, laid out as
+described in the README.  The SConstruct imports the amd_scons modules
+from ``AMD_SCONS_DIR`` and falls back to a plain ``Environment`` and a
+single configuration for older revisions without ``config_cache.py`` or
+``multi_config.py``, so the same project can be built by the tree of
+``env_layers.py --baseline``.
+"""
+
+import os
+
+SCONSTRUCT = """\
+import os
+import sys
+### 添加scons公共配置
+sys.path.insert(0, os.environ['AMD_SCONS_DIR'])
+from variables import program_vars, init_dependent_vars, ostype
+from compiler import update_compiler_settings
+try:
+    from config_cache import configure_environment
+except ImportError:
+    def configure_environment(variables, **kw):
+        return Environment(variables=variables, **kw)
+try:
+    from multi_config import build_configurations
+except ImportError:
+    def build_configurations(env):
+        return [env]
+
+tools = ['default']
+if ostype == 'windows':
+    tools += ['mingw']
+
+base_env = configure_environment(program_vars, tools=tools, ENV=os.environ)
+current_dir = os.getcwd()
+
+program_src = ['src', 'test']
+
+for env in build_configurations(base_env):
+    init_dependent_vars(env, current_dir)
+    update_compiler_settings(env)
+
+    build_dir = os.path.join(Dir("#").abspath, "build", env['BUILD_OPTION'])
+
+    for d in program_src:
+        SConscript('%s/SConscript' % d,
+                   exports=['env'],
+                   src_dir=Dir("#").srcnode().abspath,
+                   variant_dir=build_dir)
+
+    Clean(".", build_dir)
+"""
+
+# formatted with the MPI include and library directories
+BUILD_CONFIG = """\
+PLATFORM = 'linux'
+INT_TYPE = '32'
+FLOAT_TYPE = '64'
+LIB_TYPE = 'static'
+VERBOSE = 'True'
+CC = 'gcc'
+CXX = 'g++'
+F90 = 'gfortran'
+CXX_LINKER = 'g++'
+F_LINKER = 'gfortran'
+MPI_LIB_NAME = 'mpi'
+MPI_INC_PATH = %r
+MPI_LIB_PATH = %r
+"""
+
+
+def write_file(path, text):
+    """Write text to path, creating its directory"""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def write_project_base(root):
+    """Write the SConstruct, build_config.py and empty MPI directories
+
+    The src and test SConscripts are left to the caller.
+    """
+    mpi_inc = os.path.join(root, 'mpi', 'include')
+    mpi_lib = os.path.join(root, 'mpi', 'lib')
+    for d in (mpi_inc, mpi_lib):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    write_file(os.path.join(root, 'SConstruct'), SCONSTRUCT)
+    write_file(os.path.join(root, 'site_scons', 'build_config.py'),
+               BUILD_CONFIG % (mpi_inc, mpi_lib))
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""\
+SCons with filesystem call counts
+---------------------------------
+
+Runs SCons in this process with ``os.stat``, ``os.lstat``, ``os.listdir``
+and ``os.scandir`` wrapped by counters, and writes the counts as JSON to
+the file named by ``AMD_BENCH_STATS`` at exit.  Only the calls of the
+SCons process are counted, not those of the compilers.  Used by
+``build_suite.py``::
+
+    python benchmarks/scons_stats.py -Q -j8
+"""
+
+import os
+import sys
+import json
+import atexit
+
+counts = dict(stat=0, lstat=0, listdir=0, scandir=0)
+
+
+def _counting(name, func):
+    def wrapper(*args, **kw):
+        counts[name] += 1
+        return func(*args, **kw)
+    return wrapper
+
+
+def _write_counts():
+    path = os.environ.get('AMD_BENCH_STATS')
+    if path:
+        with open(path, 'w') as f:
+            json.dump(counts, f)
+
+
+def main():
+    try:
+        import SCons.Script
+    except ImportError:
+        sys.stderr.write('SCons is not importable by %s, add the scons '
+                         'package directory to PYTHONPATH\n' % sys.executable)
+        return 2
+    for name in counts:
+        setattr(os, name, _counting(name, getattr(os, name)))
+    atexit.register(_write_counts)
+    sys.argv = ['scons'] + sys.argv[1:]
+    SCons.Script.main()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,20 @@ SCons build rules
 """
 
 import os
+import re
+import copy
+import hashlib
+from objcache import use_object_cache
+from remote_exec import use_remote_exec
+from header_index import scan_headers, INDEX_NAME
+from pch import use_precompiled_header
+from job_history import schedule_by_history
+from pgo import pgo_objects
+from depfiles import use_depfiles, track_depfiles
+from fortran_modules import is_module_file
+from multi_config import share_objects
+from perf_instrument import collector_library
+from kernel_variants import kernel_builder
 
 cxx_source_files = []
 c_source_files = []
@@ -12,6 +26,51 @@ chost_source_files = []
 cslave_source_files = []
 cxxhost_source_files = []
 
+# Sunway host and slave C compiles, SW_*_FLAGS depend on the BUILD_TYPE
+SW_HOST_CCCOM = '$CC_HOST -mhost -mieee -DLABEL_INT$INT_TYPE \
+    -DSCALAR_FLOAT$FLOAT_TYPE $SW_HOST_FLAGS $_CPPINCFLAGS \
+    -c -o $TARGET $SOURCES'
+SW_SLAVE_CCCOM = '$CC_SLAVE -mslave -mieee -DLABEL_INT$INT_TYPE \
+    -DSCALAR_FLOAT$FLOAT_TYPE $SW_SLAVE_FLAGS $_CPPINCFLAGS -fgnu89-inline \
+    -D_SW_COMPILER_VERSION -c -o $TARGET $SOURCES'
+
+# sources kept out of unity translation units (see add_source_files)
+unity_excluded_files = set()
+
+# (LIB_TYPE, objects, library nodes) of build_lib by BUILD_OPTION and name
+_libraries = {}
+
+
+def layered_env(baseenv, keys=()):
+    """Environment layer over baseenv for a single build helper
+
+    Unlike Clone(), the layer shares all construction variables, tools and
+    builders with baseenv and only records the variables it changes.  The
+    variables in keys are copied first, so that Append and Prepend on the
+    layer never modify the lists of baseenv; on other variables they do,
+    so layers are not handed out to callers (see _cloned_layer).
+
+    Args:
+        baseenv (Environment): environment the layer reads through to
+        keys (iterable): names of the construction variables to change
+
+    Returns:
+        Environment: the environment layer
+    """
+    overrides = {}
+    for key in keys:
+        overrides[key] = copy.copy(baseenv.get(key, []))
+    return baseenv.Override(overrides)
+
+
+def _cloned_layer(baseenv, layer):
+    """Clone() of baseenv with the variables changed in a layer
+
+    build_lib and build_app return it, so that callers may change any
+    variable of the returned environment without touching baseenv.
+    """
+    return baseenv.Clone(**layer.overrides)
+
 
 def build_object(baseenv,
                  sources,
@@ -19,27 +78,47 @@ def build_object(baseenv,
                  program_libs,
                  sources_type='none',
                  prepend_args=None,
-                 append_args=None):
-    libenv = baseenv.Clone()
+                 append_args=None,
+                 pch=None):
+    libenv = layered_env(baseenv, ['CPPPATH'])
     libenv.Prepend(CPPPATH=program_inc)
 
     if sources_type == 'chost':
-        libenv.Replace(OBJSUFFIX='_host.o',
-                       CCCOM='$CC_HOST -mhost -mieee -DLABEL_INT$INT_TYPE \
-                  -DSCALAR_FLOAT$FLOAT_TYPE -g -O2 $_CPPINCFLAGS \
-                  -c -o $TARGET $SOURCES')
+        libenv.Replace(OBJSUFFIX='_host.o', CCCOM=SW_HOST_CCCOM)
     elif sources_type == 'cslave':
-        libenv.Replace(
-            OBJSUFFIX='_slave.o',
-            CCCOM='$CC_SLAVE -mslave -mieee -msimd -DLABEL_INT$INT_TYPE \
-            -DSCALAR_FLOAT$FLOAT_TYPE -g -O2 $_CPPINCFLAGS -fgnu89-inline \
-            -D_SW_COMPILER_VERSION -c -o $TARGET $SOURCES')
+        libenv.Replace(OBJSUFFIX='_slave.o', CCCOM=SW_SLAVE_CCCOM)
     elif sources_type == 'cxxhost':
         libenv.Replace(CXXCOM='$CXX_HOST -mhost -mieee -DLABEL_INT$INT_TYPE \
-            -DSCALAR_FLOAT$FLOAT_TYPE -g -O2 $_CPPINCFLAGS \
-            -c -o $TARGET $SOURCES')
-
-    objs = libenv.Object(source=sources)
+            -DSCALAR_FLOAT$FLOAT_TYPE $SW_HOST_FLAGS $PCHFLAGS $_CPPINCFLAGS \
+            -c -o $TARGET $SOURCES',
+                       PCHCOM='$CXX_HOST -mhost -mieee -DLABEL_INT$INT_TYPE \
+            -DSCALAR_FLOAT$FLOAT_TYPE $SW_HOST_FLAGS $_CPPINCFLAGS \
+            $PCH_CREATE_FLAGS -o $TARGET $SOURCE')
+
+    builder = libenv['BUILDERS']['Object']
+    if libenv['DEPFILES']:
+        builder = use_depfiles(libenv)
+
+    # the cache launcher wraps the remote one, so hits never leave the node
+    if libenv.get('REMOTE_WORKERS'):
+        use_remote_exec(libenv, sources_type)
+    if libenv.get('OBJ_CACHE'):
+        use_object_cache(libenv)
+
+    if sources_type == 'cslave':
+        # tuned flags of the kernels declared with add_kernel_variants
+        builder = kernel_builder(builder)
+    if libenv['BUILD_TYPE'] == 'PGO':
+        objs = pgo_objects(libenv, builder, sources)
+    else:
+        objs = builder(libenv, source=sources)
+    # module files are side effects of the compiles, not library members
+    objs = [o for o in objs if not is_module_file(o)]
+    share_objects(libenv, objs)
+    if libenv['DEPFILES']:
+        track_depfiles(libenv, objs)
+    if pch and sources and sources_type in ('none', 'cxxhost'):
+        use_precompiled_header(libenv, objs, pch, sources_type)
     return objs
 
 
@@ -49,8 +128,10 @@ def build_objects(baseenv,
                   fortran_source=None,
                   chost_source=None,
                   cslave_source=None,
-                  cxxhost_source=None):
-    objenv = baseenv.Clone()
+                  cxxhost_source=None,
+                  pch=None):
+    # build_object layers its own changes over the shared environment
+    objenv = baseenv
     objs = []
     if c_source is None:
         c_source = []
@@ -64,6 +145,11 @@ def build_objects(baseenv,
         cslave_source = []
     if cxxhost_source is None:
         cxxhost_source = []
+    if pch is None:
+        pch = objenv.get('PCH_HEADER')
+    if objenv['UNITY_BUILD']:
+        cxx_source = unity_sources(objenv, cxx_source, '.cpp')
+        c_source = unity_sources(objenv, c_source, '.c')
     objs = objs + build_object(objenv,
                                sources=fortran_source,
                                program_inc=objenv['THIRDPARTY_INCS'],
@@ -72,7 +158,8 @@ def build_objects(baseenv,
     objs = objs + build_object(objenv,
                                sources=cxx_source,
                                program_inc=objenv['THIRDPARTY_INCS'],
-                               program_libs=objenv['THIRDPARTY_LIBS'])
+                               program_libs=objenv['THIRDPARTY_LIBS'],
+                               pch=pch)
 
     objs = objs + build_object(objenv,
                                sources=c_source,
@@ -96,10 +183,106 @@ def build_objects(baseenv,
                                        sources=cxxhost_source,
                                        program_inc=objenv['THIRDPARTY_INCS'],
                                        program_libs=objenv['THIRDPARTY_LIBS'],
-                                       sources_type='cxxhost')
+                                       sources_type='cxxhost',
+                                       pch=pch)
     return objs
 
 
+def unity_batches(files, batch_size, base_dir):
+    """Split the sorted files of a directory into batches
+
+    A batch ends after a file whose hashed path relative to base_dir is a
+    multiple of batch_size, so batches hold batch_size files on average,
+    and at the latest after 2 * batch_size files.  The hash cut points
+    only depend on the files themselves: adding or removing a file changes
+    its own batch, and when that moves a cut made by the size limit, the
+    following batches up to the next hash cut point.  The other batches
+    keep their files.
+
+    Args:
+        files (list): sorted source file paths
+        batch_size (int): average number of files per batch
+        base_dir (str): directory the hashed paths are relative to
+
+    Returns:
+        list: lists of file paths
+    """
+    batches = [[]]
+    for f in files:
+        batches[-1].append(f)
+        rel = os.path.relpath(f, base_dir).replace(os.sep, '/')
+        key = int(hashlib.md5(rel.encode()).hexdigest()[:8], 16)
+        if key % batch_size == 0 or len(batches[-1]) >= 2 * batch_size:
+            batches.append([])
+    return [batch for batch in batches if batch]
+
+
+def unity_sources(env, sources, suffix):
+    """Batch sources of the same directory into unity translation units
+
+    The batches come from unity_batches and a unity file is named after
+    the first file of its batch, so editing a file only rebuilds its own
+    batch, and adding or removing one only the batches around it.
+    Files listed in unity_excluded_files and batches of a single file are
+    returned unchanged.
+
+    Args:
+        env (Environment): program SCons build environment
+        sources (list): source file paths
+        suffix (str): suffix of the generated unity files
+
+    Returns:
+        list: unity file nodes and sources compiled on their own
+    """
+    batch_size = max(int(env['UNITY_BATCH_SIZE']), 1)
+    unity_dir = env.Dir('unity').abspath
+    base_dir = env.Dir('.').abspath
+
+    singles = []
+    by_dir = {}
+    for src in sources:
+        path = str(src)
+        if path in unity_excluded_files:
+            singles.append(src)
+        else:
+            by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    unity = []
+    for d in sorted(by_dir):
+        for batch in unity_batches(sorted(by_dir[d]), batch_size, base_dir):
+            if len(batch) < 2:
+                singles.extend(batch)
+                continue
+            first = os.path.relpath(batch[0], base_dir)
+            name = re.sub(r'\W', '_', os.path.splitext(first)[0].strip('./'))
+            target = os.path.join(unity_dir,
+                                  'unity_%s%s' % (name or 'top', suffix))
+            lines = ['/* generated unity file, do not edit */']
+            lines += ['#include "%s"' % f for f in batch] + ['']
+            unity += env.Textfile(target=target, source=lines)
+    return unity + singles
+
+
+def _layered_keys(keys, prepend_args, append_args):
+    """Variables changed by a helper and its prepend/append arguments"""
+    keys = list(keys)
+    for args in (prepend_args, append_args):
+        if args is not None:
+            keys.extend(k for k in args if k not in keys)
+    return keys
+
+
+def _install(env, install_dir, nodes):
+    """Install nodes into install_dir with the INSTALL_MODE of env
+
+    The installed files are precious, so that SCons does not remove them
+    before install_file has compared them with the new ones.
+    """
+    installed = env.Install(install_dir, nodes)
+    env.Precious(installed)
+    return installed
+
+
 def build_lib(baseenv,
               target,
               sources,
@@ -107,7 +290,11 @@ def build_lib(baseenv,
               program_libs,
               prepend_args=None,
               append_args=None):
-    """Build a shared library
+    """Build a library of the type given by LIB_TYPE
+
+    shared and static build the usual libraries, thin a static thin
+    archive that only references the objects, and object no library at
+    all: build_app links the objects of such libraries directly.
 
     Args:
         baseenv (env): program SCons build environment
@@ -118,8 +305,12 @@ def build_lib(baseenv,
 
         prepend_args (dict): Set of (key, value) pairs to be prepended
         append_args (dict): Set of (key, value) pairs to be appended
+
+    Returns:
+        Environment: a Clone() of baseenv with the library settings
     """
-    libenv = baseenv.Clone()
+    libenv = layered_env(baseenv, _layered_keys(
+        ['CPPPATH', 'LIBS', 'LIBPATH'], prepend_args, append_args))
     lib_type = libenv['LIB_TYPE']
     lib_src = libenv['LIB_SRC']
     inc_dirs = [os.path.join(lib_src, d) for d in program_inc]
@@ -131,17 +322,60 @@ def build_lib(baseenv,
         exe = libenv.SharedLibrary(target=target, source=sources)
     elif lib_type == "static":
         exe = libenv.StaticLibrary(target=target, source=sources)
+    elif lib_type == "thin":
+        # members are referenced by absolute path, so the installed copy
+        # still finds them in the build directory
+        exe = libenv.StaticLibrary(
+            target=target,
+            source=sources,
+            ARFLAGS='rcsTP',
+            ARCOM='$AR $ARFLAGS $TARGET ${SOURCES.abspath}',
+            RANLIBCOM='',
+            RANLIBCOMSTR='')
+    elif lib_type == "object":
+        # nothing to archive, build_app links the objects directly
+        exe = []
+    _libraries[(libenv['BUILD_OPTION'], target)] = (
+        lib_type, [o for o in libenv.Flatten([sources])
+                   if not is_module_file(o)], exe)
+    if libenv['JOB_HISTORY']:
+        schedule_by_history(libenv, exe, sources)
 
     install_dir = libenv['LIB_PLATFORM_INSTALL']
     libenv.Alias('install', install_dir)
-    libenv.Install(install_dir, exe)
+    _install(libenv, install_dir, exe)
 
     if prepend_args is not None:
         libenv.Prepend(**prepend_args)
     if append_args is not None:
         libenv.Append(**append_args)
 
-    return libenv
+    return _cloned_layer(baseenv, libenv)
+
+
+def library_nodes(env, target):
+    """Files built by build_lib for target, empty for LIB_TYPE=object"""
+    return _libraries.get((env['BUILD_OPTION'], target), (None, [], []))[2]
+
+
+def _project_libraries(env, program_libs):
+    """Resolve the libraries of program_libs built by build_lib
+
+    Returns:
+        tuple: libraries linked with -l, objects of LIB_TYPE=object
+            libraries linked directly, and the members of thin archives
+    """
+    libs, objects, members = [], [], []
+    for lib in env.Flatten([program_libs]):
+        lib_type, lib_objects, _ = _libraries.get(
+            (env['BUILD_OPTION'], str(lib)), (None, [], []))
+        if lib_type == 'object':
+            objects.extend(lib_objects)
+            continue
+        libs.append(lib)
+        if lib_type == 'thin':
+            members.extend(lib_objects)
+    return libs, objects, members
 
 
 def build_app(baseenv,
@@ -163,20 +397,37 @@ def build_app(baseenv,
 
         prepend_args (dict): Set of (key, value) pairs to be prepended
         append_args (dict): Set of (key, value) pairs to be appended
+
+    Returns:
+        Environment: a Clone() of baseenv with the application settings
     """
-    appenv = baseenv.Clone()
+    appenv = layered_env(baseenv, _layered_keys(
+        ['CPPPATH', 'F90PATH', 'LIBS', 'LIBPATH'], prepend_args, append_args))
 
     lib_src = appenv['LIB_SRC']
     inc_dirs = [os.path.join(lib_src, d) for d in program_inc]
     appenv.Prepend(CPPPATH=inc_dirs)
     appenv.Prepend(F90PATH=inc_dirs)
+    program_libs, lib_objects, lib_members = _project_libraries(
+        appenv, program_libs)
     appenv.Append(LIBS=program_libs)
+    if appenv['PERF_INSTRUMENT']:
+        # after the project libraries, whose objects call the hooks
+        appenv.Append(LIBS=collector_library(appenv) +
+                      appenv['PERF_INSTRUMENT_LIBS'])
     appenv.Append(LIBPATH=appenv['LIBPATH_COMMON'] + appenv['LIBPATH_APPS'])
 
-    exe = appenv.Program(target=target, source=sources)
+    exe = appenv.Program(target=target,
+                         source=appenv.Flatten([sources]) + lib_objects)
+    if appenv['JOB_HISTORY']:
+        schedule_by_history(appenv, exe, appenv.Flatten([sources]) +
+                            lib_objects)
+    # a thin archive is unchanged when a member is rebuilt with the same size
+    if lib_members:
+        appenv.Depends(exe, lib_members)
     install_dir = appenv['BIN_PLATFORM_INSTALL']
     appenv.Alias('install', install_dir)
-    appenv.Install(install_dir, exe)
+    _install(appenv, install_dir, exe)
 
     if prepend_args is not None:
         appenv.Prepend(**prepend_args)
@@ -186,7 +437,7 @@ def build_app(baseenv,
     if linker is not None:
         appenv['LINK'] = linker
 
-    return appenv
+    return _cloned_layer(baseenv, appenv)
 
 
 def build_lninclude(env):
@@ -199,33 +450,54 @@ def build_lninclude(env):
     from SCons.Script import Copy, Mkdir, Dir
 
     ostype = "windows" if env['PLATFORM'] == "windows" else "posix"
-    include_patterns = [".hpp", ".H", ".hxx", ".h", ".hh"]
 
-    inc_env = env.Clone()
+    inc_env = env
     inc_dir = inc_env['PROJECT_INC_DIR']
     Mkdir(inc_dir)
     src_dir = inc_env['LIB_SRC']
     if os.path.exists(inc_dir):
         inc_env.Alias("install", inc_dir)
 
-    for root, dlist, files in os.walk(src_dir):
-        if "lnInclude" in dlist:
-            dlist.remove("lnInclude")
+    index_file = os.path.join(os.path.dirname(inc_dir), INDEX_NAME)
+    headers, collisions, stats = scan_headers(src_dir, index_file, ostype)
+    for name in sorted(collisions):
+        print('Warning: lnInclude header %s found in several places, '
+              'using %s' % (name, collisions[name][0]))
+        for other in collisions[name][1:]:
+            print('    ignored %s' % other)
+    print('lnInclude: %d headers in %d directories (%d rescanned), '
+          '%.3f s' % (stats['headers'], stats['dirs'], stats['rescanned'],
+                      stats['seconds']))
 
-        dbase = os.path.basename(root)
-        if "OSspecific" in dbase:
-            for d in dlist:
-                if d != ostype:
-                    dlist.remove(d)
+    for src in headers:
+        yield _install(inc_env, inc_dir, src)
 
-        for f in files:
-            if any(f.endswith(pat) for pat in include_patterns):
-                src = os.path.join(root, f)
-                dest = os.path.join(inc_dir, f)
-                yield inc_env.Install(inc_dir, src)
 
+def reset_source_files():
+    """Empty the global source lists, e.g. before the next configuration"""
+    for source_list in (cxx_source_files, c_source_files,
+                        fortran_source_files, chost_source_files,
+                        cslave_source_files, cxxhost_source_files):
+        del source_list[:]
 
-def add_source_files(source_files, all_source_files):
-    for filename in source_files:
-        fullDir = os.path.join(os.getcwd(), filename)
-        all_source_files.append(fullDir)
+
+def add_source_files(source_files, all_source_files, unity=True):
+    """Add files of the current directory to a source list
+
+    While read_components reads the SConscript of a component, the files
+    are added to that component instead of the global list.
+
+    Args:
+        source_files (list): file names relative to the current directory
+        all_source_files (list): one of the *_source_files lists
+        unity (bool): False keeps the files out of unity batches, e.g. for
+            sources with clashing file-scope symbols
+    """
+    from components import add_component_sources
+
+    cwd = os.getcwd()
+    files = [os.path.join(cwd, filename) for filename in source_files]
+    if not unity:
+        unity_excluded_files.update(files)
+    if not add_component_sources(files, all_source_files):
+        all_source_files.extend(files)
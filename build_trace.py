@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""\
+Build timing trace
+------------------
+
+Records start/end time, worker slot, command and peak RSS of every
+compile, archive, link and install action.  At the end of the build the
+records are written as a Chrome trace-event file (load it in
+chrome://tracing or https://ui.perfetto.dev) and a summary with the
+slowest targets, the critical path and the parallel utilisation is
+printed.
+
+The records are also available to other modules through
+``add_listener``, which is called with the list of records at exit.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import subprocess
+
+_lock = threading.Lock()
+_local = threading.local()
+_records = []
+_slots = {}
+_listeners = []
+_state = dict(enabled=False, start=None)
+
+
+def _slot():
+    ident = threading.current_thread().ident
+    with _lock:
+        if ident not in _slots:
+            _slots[ident] = len(_slots)
+        return _slots[ident]
+
+
+def _action_kind(target):
+    name = str(target)
+    if name.endswith(('.o', '.obj')):
+        return 'compile'
+    if name.endswith(('.a', '.lib')):
+        return 'archive'
+    return 'link'
+
+
+def _record(target, kind, start, end, command, rss=0):
+    slot = _slot()
+    with _lock:
+        _records.append(dict(target=target,
+                             kind=kind,
+                             start=start,
+                             end=end,
+                             slot=slot,
+                             command=command,
+                             rss=rss))
+
+
+def _note_targets():
+    """Keep the node being built by each thread in _local.target
+
+    The executor is the one place that knows the target of an action in
+    every mode: PRINT_CMD_LINE_FUNC is not called with -s or empty
+    COMSTRs, and the actions themselves get an empty target list.
+    """
+    from SCons.Executor import Executor
+
+    call = Executor.__call__
+    if getattr(call, 'traced', False):
+        return
+
+    def traced_call(self, target, **kw):
+        previous = getattr(_local, 'target', None)
+        _local.target = target
+        try:
+            return call(self, target, **kw)
+        finally:
+            _local.target = previous
+    traced_call.traced = True
+    Executor.__call__ = traced_call
+
+
+def _traced_spawn(sh, escape, cmd, args, env):
+    """Spawn a command and record its duration and peak RSS"""
+    command = ' '.join(args)
+    # set by _note_targets while the executor runs the action
+    target = getattr(_local, 'target', None)
+    start = time.time()
+    proc = subprocess.Popen([sh, '-c', command], env=env, close_fds=True)
+    rss = 0
+    if hasattr(os, 'wait4'):
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        rss = rusage.ru_maxrss
+    else:
+        proc.wait()
+    end = time.time()
+    _record(target, _action_kind(target), start, end, command, rss)
+    return proc.returncode
+
+
+def _traced_install(install):
+    def install_func(dest, source, env):
+        start = time.time()
+        result = install(dest, source, env)
+        target = getattr(_local, 'target', None) or \
+            env.fs.Entry(str(dest), env.fs.Top)
+        _record(target, 'install', start, time.time(),
+                'install %s %s' % (source, dest))
+        return result
+    install_func.traced = True
+    return install_func
+
+
+def add_listener(func):
+    """Call func(records) at the end of the build
+
+    Args:
+        func (callable): receives the list of action records
+    """
+    _listeners.append(func)
+
+
+def enable_recording(env):
+    """Record the actions executed through env and its clones
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    if env.get('SPAWN') is not _traced_spawn and os.name != 'nt':
+        env['SPAWN'] = _traced_spawn
+    _note_targets()
+    install = env.get('INSTALL')
+    if install is None:
+        # the install tool is set up lazily on first use of Install
+        from SCons.Tool.install import copyFunc as install
+    if not getattr(install, 'traced', False):
+        env['INSTALL'] = _traced_install(install)
+    if not _state['enabled']:
+        _state['enabled'] = True
+        _state['start'] = time.time()
+        atexit.register(_finish)
+
+
+def enable_build_trace(env):
+    """Write a Chrome trace and print a timing summary for the build
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    enable_recording(env)
+    trace_file = os.path.abspath(env['BUILD_TRACE'])
+    top = int(env.get('TRACE_TOP', 10))
+    add_listener(lambda records: write_chrome_trace(records, trace_file))
+    add_listener(lambda records: print_summary(records, top))
+
+
+def _finish():
+    records = sorted(_records, key=lambda r: r['start'])
+    if not records:
+        return
+    for func in _listeners:
+        func(records)
+
+
+def write_chrome_trace(records, trace_file):
+    """Write records in Chrome trace-event JSON format"""
+    t0 = records[0]['start']
+    events = []
+    for r in records:
+        events.append(dict(name=os.path.basename(str(r['target'])),
+                           cat=r['kind'],
+                           ph='X',
+                           ts=int((r['start'] - t0) * 1e6),
+                           dur=int((r['end'] - r['start']) * 1e6),
+                           pid=0,
+                           tid=r['slot'],
+                           args=dict(target=str(r['target']),
+                                     command=r['command'],
+                                     max_rss_kb=r['rss'])))
+    trace_dir = os.path.dirname(trace_file)
+    if trace_dir and not os.path.isdir(trace_dir):
+        os.makedirs(trace_dir)
+    with open(trace_file, 'w') as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+    print('Build trace written to %s' % trace_file)
+
+
+def target_durations(records):
+    """Sum the action durations of every target
+
+    Returns:
+        dict: target node to seconds
+    """
+    durations = {}
+    for r in records:
+        if r['target'] is not None:
+            durations[r['target']] = durations.get(r['target'], 0.0) + \
+                r['end'] - r['start']
+    return durations
+
+
+def critical_path(durations):
+    """Longest chain of recorded targets through the dependency graph
+
+    Args:
+        durations (dict): target node to seconds, see target_durations
+
+    Returns:
+        (seconds, nodes): length of the path and its nodes, last one first
+    """
+    memo = {}
+
+    def longest(node, stack):
+        key = id(node)
+        if key in memo:
+            return memo[key]
+        if key in stack:
+            return 0.0, []
+        stack.add(key)
+        best = (0.0, [])
+        try:
+            children = node.children()
+        except AttributeError:
+            children = []
+        for child in children:
+            cand = longest(child, stack)
+            if cand[0] > best[0]:
+                best = cand
+        stack.discard(key)
+        own = durations.get(node, 0.0)
+        result = (best[0] + own, ([node] if own else []) + best[1])
+        memo[key] = result
+        return result
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    try:
+        best = (0.0, [])
+        for node in durations:
+            cand = longest(node, set())
+            if cand[0] > best[0]:
+                best = cand
+    finally:
+        sys.setrecursionlimit(limit)
+    return best
+
+
+def print_summary(records, top=10):
+    """Print the slowest targets, critical path and utilisation"""
+    from SCons.Script import GetOption
+
+    durations = target_durations(records)
+    wall = max(r['end'] for r in records) - min(r['start'] for r in records)
+    busy = sum(r['end'] - r['start'] for r in records)
+    jobs = GetOption('num_jobs') or 1
+
+    print('Build timing summary')
+    print('  %d actions, wall %.2f s, busy %.2f s' %
+          (len(records), wall, busy))
+    print('  average parallel utilisation %.1f%% of -j %d' %
+          (100.0 * busy / max(wall * jobs, 1e-9), jobs))
+    print('  slowest targets:')
+    slowest = sorted(durations.items(), key=lambda x: -x[1])[:top]
+    for node, seconds in slowest:
+        print('    %8.2f s  %s' % (seconds, node))
+    length, path = critical_path(durations)
+    print('  critical path %.2f s:' % length)
+    for node in reversed(path):
+        print('    %8.2f s  %s' % (durations[node], node))
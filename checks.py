@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""\
+Test runs
+---------
+
+``add_test`` in a ``test`` SConscript registers a run of an application
+built by ``build_app``::
+
+    from checks import add_test
+
+    add_test(env, 'amg_8', 'test_amg', args=['case/amg.in'], ranks=8,
+             inputs=['case/amg.in'], timeout=300)
+
+``scons check`` builds the applications and runs the tests of every
+configuration, ``scons check-<BUILD_OPTION>`` those of one.  A test needs
+``ranks * threads`` slots, ``CHECK_SLOTS`` (default: the cores of the
+machine) are shared by all running tests, so an 8-rank test and several
+1-rank tests run side by side.  Tests with the most slots and the
+longest previous run start first, smaller tests fill the remaining
+slots.
+
+``CHECK_LAUNCHER`` is the MPI launcher, e.g. ``mpirun -np {ranks}``;
+``{ranks}`` and ``{threads}`` are replaced.  Without it the tests run on
+the local machine: one process per rank, with the rank and size in the
+``PMI_RANK``/``PMI_SIZE`` and ``OMPI_COMM_WORLD_RANK``/``SIZE``
+variables.  ``OMP_NUM_THREADS`` is set to the thread count in both cases.
+
+A test that passed is skipped as long as its application, its inputs and
+its command line stay the same.  The results of each configuration go to
+``build/<BUILD_OPTION>/check``: ``results.json``, ``junit.xml`` and the
+output of each test in ``<name>.log``.
+"""
+
+import os
+import json
+import time
+import signal
+import hashlib
+import threading
+import subprocess
+
+# tests and check target of each BUILD_OPTION
+_checks = {}
+# the configurations share the slots, their tests run one after another
+_slots_lock = threading.Lock()
+
+
+def _cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def add_test(env, name, app, args=(), ranks=1, threads=1, timeout=None,
+             inputs=(), workdir=None):
+    """Register a test run by the check alias
+
+    Args:
+        env (Environment): program SCons build environment
+        name (str): test name, unique within the configuration
+        app (str): target name given to build_app
+        args (list): command line arguments of the application
+        ranks (int): MPI ranks
+        threads (int): threads per rank, sets OMP_NUM_THREADS
+        timeout (float): seconds before the test is killed, CHECK_TIMEOUT
+            by default
+        inputs (list): files read by the test, relative to the SConscript
+        workdir (str): working directory, the SConscript directory by
+            default
+
+    Returns:
+        Node: the check-<BUILD_OPTION> alias running the tests
+    """
+    from SCons.Errors import UserError
+
+    option = env['BUILD_OPTION']
+    check = _checks.get(option)
+    if check is None:
+        check = _checks[option] = dict(tests=[], names=set(), node=None)
+        check_dir = os.path.join(env.Dir('#').abspath, 'build', option,
+                                 'check')
+        # an alias, so the tests only run when check is asked for
+        node = env.Alias('check-%s' % option, [],
+                         env.Action(_run_action(check, check_dir),
+                                    'Running tests of %s' % option))
+        env.AlwaysBuild(node)
+        env.Alias('check', node)
+        check['node'] = node
+    if name in check['names']:
+        raise UserError('test %s registered twice for %s' % (name, option))
+    check['names'].add(name)
+
+    here = env.Dir('.').srcnode()
+    binary = env.File(os.path.join(env['BIN_PLATFORM_INSTALL'], app))
+    input_nodes = [here.File(i) for i in inputs]
+    env.Depends(check['node'], [binary] + input_nodes)
+    check['tests'].append(dict(
+        name=name,
+        binary=binary,
+        args=[str(a) for a in args],
+        ranks=int(ranks),
+        threads=int(threads),
+        timeout=float(timeout or env['CHECK_TIMEOUT']),
+        inputs=input_nodes,
+        workdir=os.path.join(here.abspath, workdir or ''),
+        slots=int(env['CHECK_SLOTS'] or _cpu_count()),
+        launcher=env['CHECK_LAUNCHER']))
+    return check['node']
+
+
+def _signature(test):
+    """Hash of everything a passed test result depends on"""
+    h = hashlib.md5()
+    for node in [test['binary']] + test['inputs']:
+        h.update(node.get_csig().encode())
+    h.update(json.dumps([test['args'], test['ranks'], test['threads'],
+                         test['launcher'], test['workdir']]).encode())
+    return h.hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+class _Run(object):
+    """Processes of one running test"""
+
+    def __init__(self, test, log_path):
+        self.test = test
+        self.log = open(log_path, 'w')
+        self.start = time.time()
+        env = dict(os.environ, OMP_NUM_THREADS=str(test['threads']))
+        command = [test['binary'].abspath] + test['args']
+        self.procs = []
+        if test['launcher']:
+            launcher = test['launcher'].format(ranks=test['ranks'],
+                                               threads=test['threads'])
+            self._spawn(launcher.split() + command, env)
+        else:
+            for rank in range(test['ranks']):
+                rank_env = dict(env, PMI_RANK=str(rank),
+                                PMI_SIZE=str(test['ranks']),
+                                OMPI_COMM_WORLD_RANK=str(rank),
+                                OMPI_COMM_WORLD_SIZE=str(test['ranks']))
+                self._spawn(command, rank_env)
+
+    def _spawn(self, command, env):
+        self.procs.append(subprocess.Popen(
+            command, cwd=self.test['workdir'], env=env,
+            stdin=subprocess.DEVNULL, stdout=self.log,
+            stderr=subprocess.STDOUT, start_new_session=True))
+
+    def kill(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        for proc in self.procs:
+            proc.wait()
+
+    def poll(self):
+        """Result dict when all processes ended, None while running"""
+        elapsed = time.time() - self.start
+        codes = [proc.poll() for proc in self.procs]
+        if None in codes:
+            if elapsed < self.test['timeout']:
+                return None
+            self.kill()
+            status, message = 'timeout', 'killed after %.0f s' % elapsed
+        elif any(codes):
+            status = 'failed'
+            message = 'exit code %s' % ', '.join(str(c) for c in codes if c)
+        else:
+            status, message = 'passed', ''
+        self.log.close()
+        return dict(status=status, message=message, duration=elapsed)
+
+
+def schedule(tests, slots, run, previous=None, finished=None,
+             poll_interval=0.05):
+    """Run tests on slots, largest and longest first
+
+    Args:
+        tests (list): test dicts with the slots each needs in 'need'
+        slots (int): slots available
+        run (function): starts a test and returns an object with poll()
+        previous (dict): durations of earlier runs by test name
+        finished (function): called with the name and result of each test
+
+    Returns:
+        dict: result of each test name
+    """
+    previous = previous or {}
+    pending = sorted(tests, key=lambda t: -t['need'] *
+                     max(previous.get(t['name'], 1.0), 0.01))
+    running = []
+    results = {}
+    free = slots
+    while pending or running:
+        for test in list(pending):
+            if test['need'] <= free:
+                pending.remove(test)
+                running.append((test, run(test)))
+                free -= test['need']
+        time.sleep(poll_interval)
+        for item in list(running):
+            result = item[1].poll()
+            if result is not None:
+                running.remove(item)
+                free += item[0]['need']
+                results[item[0]['name']] = result
+                if finished is not None:
+                    finished(item[0]['name'], result)
+    return results
+
+
+def _tail(path, lines=50):
+    try:
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return ''
+    return '\n'.join(text.splitlines()[-lines:])
+
+
+def write_junit(path, suite, tests, results, logs):
+    """Write the results in the JUnit XML format"""
+    import xml.etree.ElementTree as ET
+
+    root = ET.Element('testsuite', name=suite, tests=str(len(tests)))
+    counts = dict(failed=0, skipped=0)
+    total = 0.0
+    for test in tests:
+        result = results[test['name']]
+        total += result['duration']
+        case = ET.SubElement(root, 'testcase', classname=suite,
+                             name=test['name'],
+                             time='%.3f' % result['duration'])
+        if result['status'] == 'skipped':
+            counts['skipped'] += 1
+            ET.SubElement(case, 'skipped', message=result['message'])
+        elif result['status'] != 'passed':
+            counts['failed'] += 1
+            failure = ET.SubElement(case, 'failure',
+                                    message=result['message'])
+            failure.text = _tail(logs[test['name']])
+    root.set('failures', str(counts['failed']))
+    root.set('errors', '0')
+    root.set('skipped', str(counts['skipped']))
+    root.set('time', '%.3f' % total)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def _run_action(check, check_dir):
+    def run_tests(target, source, env):
+        with _slots_lock:
+            return _run_tests(env)
+
+    def _run_tests(env):
+        if not os.path.isdir(check_dir):
+            os.makedirs(check_dir)
+        tests = check['tests']
+        passed_file = os.path.join(check_dir, 'passed.json')
+        passed = _load(passed_file)
+        # run time of the last run that was not skipped
+        results_file = os.path.join(check_dir, 'results.json')
+        previous = dict((name, r.get('last_duration', r['duration']))
+                        for name, r in
+                        _load(results_file).get('tests', {}).items())
+        logs = dict((t['name'], os.path.join(check_dir, t['name'] + '.log'))
+                    for t in tests)
+
+        results, todo = {}, []
+        for test in tests:
+            test['signature'] = _signature(test)
+            test['need'] = min(test['ranks'] * test['threads'],
+                               test['slots'])
+            if passed.get(test['name']) == test['signature']:
+                results[test['name']] = dict(
+                    status='skipped', duration=0.0,
+                    last_duration=previous.get(test['name'], 0.0),
+                    message='unchanged since the last pass')
+            else:
+                todo.append(test)
+
+        def run(test):
+            print('check: %s started (%d ranks, %d threads)' %
+                  (test['name'], test['ranks'], test['threads']))
+            return _Run(test, logs[test['name']])
+
+        def finished(name, result):
+            print('check: %s %s in %.2f s%s' %
+                  (name, result['status'], result['duration'],
+                   ' (%s, see %s)' % (result['message'], logs[name])
+                   if result['status'] != 'passed' else ''))
+
+        slots = tests[0]['slots'] if tests else 1
+        results.update(schedule(todo, slots, run, previous, finished))
+
+        for test in tests:
+            if results[test['name']]['status'] == 'passed':
+                passed[test['name']] = test['signature']
+            elif results[test['name']]['status'] != 'skipped':
+                passed.pop(test['name'], None)
+        with open(passed_file, 'w') as f:
+            json.dump(passed, f, indent=1, sort_keys=True)
+        with open(results_file, 'w') as f:
+            json.dump(dict(build_option=env['BUILD_OPTION'],
+                           tests=results), f, indent=1, sort_keys=True)
+        write_junit(os.path.join(check_dir, 'junit.xml'),
+                    env['BUILD_OPTION'], tests, results, logs)
+
+        failed = sorted(name for name, r in results.items()
+                        if r['status'] not in ('passed', 'skipped'))
+        print('check: %d passed, %d skipped, %d failed%s' %
+              (sum(r['status'] == 'passed' for r in results.values()),
+               sum(r['status'] == 'skipped' for r in results.values()),
+               len(failed), ': ' + ', '.join(failed) if failed else ''))
+        return 1 if failed else 0
+
+    return run_tests
@@ -6,6 +6,16 @@ Compiler settings
 
 import os
 from simple_prints import simple_prints
+from objcache import setup_object_cache, parse_size
+from build_trace import enable_build_trace
+from job_history import enable_job_history
+from remote_exec import setup_remote_exec
+from pgo import setup_pgo
+from install_mode import install_file
+from fortran_modules import setup_fortran_modules
+from perf_instrument import setup_perf_instrument
+from fast_noop import setup_fast_noop
+from compiler_probe import compiler_info, check_flags, host_cpu_flags
 
 generalflags = dict(
     general="-fPIC -rdynamic",
@@ -13,16 +23,120 @@ generalflags = dict(
     warnings="",
     debug="-O0 -ggdb3 -DDEBUG -DTIMERS",
     prof="-O2 -pg",
-    opt="-O3 -g")
+    # optimised with call stacks for perf and the TIMERS output
+    perf="-O3 -g -fno-omit-frame-pointer -DTIMERS",
+    opt="-O3 -g",
+    # profile-guided optimisation, see pgo.py
+    pgo="-O3 -g",
+    # OpenMP compile and link flag, None if not supported
+    openmp="-fopenmp",
+    pgo_gen="-fprofile-generate=$PGO_PROFILE_DIR "
+    "-fprofile-update=prefer-atomic",
+    pgo_use="-fprofile-use=$PGO_PROFILE_DIR -fprofile-correction "
+    "-Wno-error=coverage-mismatch",
+    # gcc 9 and later, only added when the compilers accept it
+    pgo_quiet="-Wno-missing-profile",
+    pgo_raw="*.gcda",
+    pgo_data="",
+    pgo_merge="",
+    # link-time optimisation, compile and link flags of LTO=full/thin
+    lto_full_cc="-flto",
+    lto_full_link="-flto -flto-partition=one",
+    lto_thin_cc="-flto",
+    lto_thin_link="-flto=$LTO_JOBS",
+    lto_ar="gcc-ar",
+    lto_ranlib="gcc-ranlib",
+    split_dwarf="-gsplit-dwarf",
+    # gcc drops -gsplit-dwarf for LTO objects
+    lto_split_dwarf=None,
+    gdb_index="-Wl,--gdb-index",
+    # precompiled headers, gcc picks up $PCH_DIR/$PCH_NAME.gch
+    pch_suffix=".gch",
+    pch_create="-x c++-header",
+    pch_use="-include $PCH_DIR/$PCH_NAME -Winvalid-pch",
+    # make-style dependency file written next to the object
+    depfile="-MMD -MF ${TARGET}.d",
+    # peak memory of one compile job, used for the default -j
+    job_memory="2G",
+    # HOST_TUNING=native, fast adds fast_math, avx512 on AVX-512 hosts
+    native="-march=native",
+    fast_math="-ffast-math",
+    avx512="-mprefer-vector-width=512",
+    vec_report="-fopt-info-vec-optimized",
+    # hooks of the PERF_INSTRUMENT collector, not for system headers
+    instrument="-finstrument-functions "
+    "-finstrument-functions-exclude-file-list=/usr/include")
 
 gcc_flags = dict(**generalflags)
 
 intel_flags = dict(**generalflags)
 intel_flags['warnings'] = "-wd327,654,819,1125,1476,1505,1572"
+intel_flags['job_memory'] = "4G"
+intel_flags['openmp'] = "-qopenmp"
+intel_flags['pch_suffix'] = ".pchi"
+intel_flags['pch_create'] = "-x c++-header -pch-create $TARGET"
+intel_flags['pch_use'] = "-pch-use $PCH_FILE -include $PCH_DIR/$PCH_NAME"
+intel_flags['pgo_gen'] = "-prof-gen -prof-dir=$PGO_PROFILE_DIR"
+intel_flags['pgo_use'] = "-prof-use -prof-dir=$PGO_PROFILE_DIR"
+intel_flags['pgo_raw'] = "*.dyn"
+intel_flags['pgo_data'] = "pgopti.dpi"
+intel_flags['pgo_merge'] = "profmerge -prof_dir $PGO_PROFILE_DIR"
+intel_flags['pgo_quiet'] = None
+intel_flags['lto_full_cc'] = "-ipo"
+intel_flags['lto_full_link'] = "-ipo"
+intel_flags['lto_thin_cc'] = "-ipo"
+intel_flags['lto_thin_link'] = "-ipo -ipo-jobs$LTO_JOBS"
+intel_flags['lto_ar'] = "xiar"
+intel_flags['lto_ranlib'] = "xiar s"
+intel_flags['native'] = "-xHost"
+intel_flags['fast_math'] = "-fp-model fast=2"
+intel_flags['avx512'] = "-qopt-zmm-usage=high"
+intel_flags['vec_report'] = "-qopt-report=2 -qopt-report-phase=vec"
+intel_flags['instrument'] = "-finstrument-functions"
 
 clang_flags = dict(**generalflags)
+clang_flags['openmp'] = "-fopenmp=libomp"
+clang_flags['pch_suffix'] = ".pch"
+clang_flags['pch_use'] = "-include-pch $PCH_FILE"
+clang_flags['pgo_gen'] = "-fprofile-generate=$PGO_PROFILE_DIR"
+clang_flags['pgo_use'] = "-fprofile-use=$PGO_PROFILE_DIR/merged.profdata"
+clang_flags['pgo_raw'] = "*.profraw"
+clang_flags['pgo_data'] = "merged.profdata"
+clang_flags['pgo_merge'] = "llvm-profdata merge -output=$TARGET $SOURCES"
+clang_flags['pgo_quiet'] = None
+clang_flags['lto_full_cc'] = "-flto=full"
+clang_flags['lto_full_link'] = "-flto=full"
+clang_flags['lto_thin_cc'] = "-flto=thin"
+clang_flags['lto_thin_link'] = "-flto=thin -flto-jobs=$LTO_JOBS"
+clang_flags['lto_ar'] = "llvm-ar"
+clang_flags['lto_ranlib'] = "llvm-ranlib"
+clang_flags['lto_split_dwarf'] = "-gsplit-dwarf"
+clang_flags['vec_report'] = "-Rpass=loop-vectorize"
+clang_flags['instrument'] = "-finstrument-functions-after-inlining"
 
 sw_flags = dict(**generalflags)
+# the Sunway slave cores are threaded with athread
+sw_flags['openmp'] = None
+# the Sunway gcc predates -fprofile-update
+sw_flags['pgo_gen'] = "-fprofile-generate=$PGO_PROFILE_DIR"
+sw_flags['lto_full_cc'] = None
+sw_flags['lto_thin_cc'] = None
+sw_flags['native'] = None
+sw_flags['avx512'] = None
+
+# Sunway host and slave C kernels (chost/cxxhost/cslave) by BUILD_TYPE, the
+# flags of a slave kernel can be tuned with kernel_variants.py
+sw_kernel_flags = dict(
+    host=dict(Opt="-g -O2",
+              Debug="-g -O0 -DDEBUG -DTIMERS",
+              Prof="-g -O2 -pg",
+              Perf="-g -O2 -fno-omit-frame-pointer -DTIMERS",
+              PGO="-g -O2"),
+    slave=dict(Opt="-msimd -g -O2",
+               Debug="-msimd -g -O0 -DDEBUG",
+               Prof="-msimd -g -O2",
+               Perf="-msimd -g -O2",
+               PGO="-msimd -g -O2"))
 
 # clang_flags['warnings'] = "-Wall -Wextra -Wno-unused-parameter -Wold-style-cast -Wno-overloaded-virtual -Wno-unused-comparison -Wno-deprecated-register"
 
@@ -41,7 +155,15 @@ _compiler_map = {
     'icpc': 'icpc',
     'sw5gcc': 'swg++',
     'sw5g++': 'swg++',
-    'sw5gfortran': 'swg++'
+    'sw5gfortran': 'swg++',
+    # MPI wrappers whose compiler could not be probed
+    'mpicc': 'g++',
+    'mpicxx': 'g++',
+    'mpic++': 'g++',
+    'mpif90': 'g++',
+    'mpiicc': 'icpc',
+    'mpiicpc': 'icpc',
+    'mpiifort': 'icpc'
 }
 
 _compiler_flags_map = {
@@ -52,6 +174,44 @@ _compiler_flags_map = {
     'swg++': sw_flags
 }
 
+# flag table of a compiler family found by compiler_probe
+_family_map = dict(gcc='g++', clang='clang++', intel='icpc', sw='swg++')
+
+
+def _flags_by_name(prog):
+    """Flag table of a compiler name, e.g. mpicc or gcc-11
+
+    The name itself is looked up first, then the longest known name it
+    contains, so that mpicc is not taken for cc.
+    """
+    cname = os.path.basename(str(prog).split()[0])
+    if cname not in _compiler_map:
+        for k in sorted(_compiler_map, key=len, reverse=True):
+            if k in cname:
+                cname = k
+                break
+    return _compiler_flags_map[_compiler_map[cname]]
+
+
+def compiler_flags(env):
+    """Flag table of the C compiler
+
+    The compiler behind MPI wrappers and versioned names is identified
+    with compiler_probe.  If --version does not tell the family, the table
+    is chosen by the name of the compiler the wrapper calls (-show); with
+    COMPILER_PROBE=0, or if the compiler is not found, by the name of CC.
+    """
+    c_compiler = env['CC']
+    info = compiler_info(c_compiler, env) if env['COMPILER_PROBE'] else None
+    if info is not None and info['family'] in _family_map:
+        env.Replace(COMPILER_FAMILY=info['family'],
+                    COMPILER_VERSION=info['version'] or '',
+                    CC_REAL=info['real'])
+        return _compiler_flags_map[_family_map[info['family']]]
+    if info is not None:
+        return _flags_by_name(info['real'])
+    return _flags_by_name(c_compiler)
+
 
 def windows_flags(env):
     """Windows specific compiler flags"""
@@ -88,6 +248,8 @@ def sunway_flags(env):
     env.Append(LIBPATH_COMMON=[env['MPI_LIB_PATH']],
                CPPPATH=[env['MPI_INC_PATH']],
                F90PATH=[env['MPI_INC_PATH']])
+    env.Replace(SW_HOST_FLAGS=sw_kernel_flags['host'][env['BUILD_TYPE']],
+                SW_SLAVE_FLAGS=sw_kernel_flags['slave'][env['BUILD_TYPE']])
 
     # env.Prepend(LINKFLAGS = '--wrap malloc --wrap free')
 
@@ -95,6 +257,133 @@ def sunway_flags(env):
     # env.Prepend(LINKFLAGS = '-Xlinker --no-as-needed')
 
 
+def _find_tool(env, name):
+    """Look for a tool next to the C compiler first, then in PATH"""
+    prog = name.split()[0]
+    cc = env.get('CC_REAL') or env.WhereIs(env['CC'])
+    if cc is not None:
+        local = os.path.join(os.path.dirname(cc), prog)
+        if os.path.exists(local):
+            return local + name[len(prog):]
+    if env.WhereIs(prog) is not None:
+        return name
+    return None
+
+
+def lto_flags(env, cflags):
+    """Link-time optimisation flags
+
+    The LTO flags go to LINKFLAGS so that they also reach the link when
+    LINK is replaced by the CXX_LINKER MPI wrapper, and static libraries
+    are archived with the plugin-aware ar/ranlib of the compiler.
+    """
+    mode = env['LTO']
+    if mode == 'none':
+        return
+    if cflags['lto_%s_cc' % mode] is None or (
+            env['COMPILER_PROBE'] and
+            not check_flags(env, cflags['lto_%s_cc' % mode], link=True)):
+        print('Warning: LTO is not supported by %s, ignored' % env['CXX'])
+        return
+    if not env['LTO_JOBS']:
+        cpus = os.cpu_count() or 1
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = len(os.sched_getaffinity(0))
+        env['LTO_JOBS'] = str(cpus)
+    env.Append(CCFLAGS=cflags['lto_%s_cc' % mode].split())
+    # code generation moves to the link, which needs the optimisation flags
+    env.Append(LINKFLAGS=cflags['lto_%s_link' % mode].split() +
+               cflags[env['BUILD_TYPE'].lower()].split())
+
+    ar = _find_tool(env, cflags['lto_ar'])
+    ranlib = _find_tool(env, cflags['lto_ranlib'])
+    if ar is None or ranlib is None:
+        print('Warning: %s/%s not found, static libraries may lack the LTO '
+              'symbol index' % (cflags['lto_ar'], cflags['lto_ranlib']))
+    else:
+        env.Replace(AR=ar, RANLIB=ranlib)
+
+
+def threading_flags(env, cflags):
+    """Threading backend flags, OpenMP or Sunway athread
+
+    Raises:
+        UserError: if the backend is not available for the compiler
+    """
+    from SCons.Errors import UserError
+
+    athread = env['PLATFORM'] == 'sw' and env['ATHREAD']
+    if env['OMP']:
+        if athread:
+            raise UserError('OMP and ATHREAD cannot be combined, '
+                            'use ATHREAD for the Sunway slave cores')
+        if cflags['openmp'] is None or (
+                env['COMPILER_PROBE'] and
+                not check_flags(env, cflags['openmp'], link=True)):
+            raise UserError('%s does not support OpenMP, build with OMP=0' %
+                            env['CXX'])
+        env.Append(CCFLAGS=cflags['openmp'].split(),
+                   LINKFLAGS=cflags['openmp'].split())
+    if athread:
+        env.Append(CCFLAGS='-DSW_SLAVE')
+
+
+def host_flags(env, cflags):
+    """Host specific optimisation flags of HOST_TUNING and VEC_REPORT
+
+    Only flags accepted by all compilers are used.  native tunes for the
+    build host, e.g. -march=native, and uses 512 bit vectors on AVX-512
+    hosts; fast adds fast-math.  The objects only run on hosts like the
+    build host, the object cache keys them by the host CPU.
+    """
+    candidates = []
+    if env['HOST_TUNING'] != 'none':
+        candidates.append(cflags['native'])
+        if 'avx512f' in host_cpu_flags():
+            candidates.append(cflags['avx512'])
+    if env['HOST_TUNING'] == 'fast':
+        candidates.append(cflags['fast_math'])
+    if env['VEC_REPORT']:
+        candidates.append(cflags['vec_report'])
+    for flags in candidates:
+        if flags is None:
+            continue
+        if env['COMPILER_PROBE'] and not check_flags(env, flags):
+            print('Warning: %s not supported by the compilers, ignored' %
+                  flags)
+            continue
+        env.Append(CCFLAGS=flags.split())
+
+
+def linker_flags(env, cflags):
+    """Linker selection and split debug information"""
+    linker = env['LINKER']
+    if linker != 'default':
+        prog = 'mold' if linker == 'mold' else 'ld.' + linker
+        if env.WhereIs(prog) is None:
+            print('Warning: %s not found, using the default linker' % prog)
+            linker = 'default'
+        else:
+            env.Append(LINKFLAGS=['-fuse-ld=' + linker])
+
+    # Perf builds keep the debug info of the large binaries out of the link
+    if not (env['SPLIT_DWARF'] or env['BUILD_TYPE'] == 'Perf'):
+        return
+    if env['LTO'] == 'none':
+        env.Append(CCFLAGS=cflags['split_dwarf'].split())
+    elif cflags['lto_split_dwarf'] is None:
+        print('Warning: %s does not split debug info with LTO, '
+              'SPLIT_DWARF ignored' % env['CXX'])
+        return
+    else:
+        # debug info of LTO builds is emitted at the link
+        env.Append(CCFLAGS=cflags['lto_split_dwarf'].split(),
+                   LINKFLAGS=cflags['lto_split_dwarf'].split())
+    # bfd only builds the index in recent versions
+    if linker in ('gold', 'lld', 'mold'):
+        env.Append(LINKFLAGS=cflags['gdb_index'].split())
+
+
 _arch_map = dict(
     windows=windows_flags,
     linux=linux_flags,
@@ -109,18 +398,9 @@ def update_compiler_settings(env):
         env (SCons.Environment): Environment to modify
     """
     ostype = env['PLATFORM']
-    c_compiler = env['CC']
-    cxx_compiler = env['CXX']
-    fort_compiler = env['F90']
     btype = env['BUILD_TYPE']
     flist = ['general', 'warnings', btype.lower()]
-    keys = _compiler_map.keys()
-    cname = os.path.basename(c_compiler)
-    for k in keys:
-        if k in cname:
-            cname = k
-            break
-    cflags = _compiler_flags_map[_compiler_map[cname]]
+    cflags = compiler_flags(env)
     # Compiler flags
     env.Append(CCFLAGS='-DLABEL_INT' + env['INT_TYPE'])
     env.Append(CCFLAGS='-DSCALAR_FLOAT' + env['FLOAT_TYPE'])
@@ -129,10 +409,28 @@ def update_compiler_settings(env):
     env.Append(CCFLAGS='-DWM_' + env['PRECISION'])
     for k in flist:
         env.Append(CCFLAGS=cflags[k].split())
-
+    if btype == 'PGO':
+        setup_pgo(env, cflags)
+    host_flags(env, cflags)
+    lto_flags(env, cflags)
+    linker_flags(env, cflags)
+
+    # Precompiled headers, enabled per build_object call
+    env.Replace(PCH_SUFFIX=cflags['pch_suffix'],
+                PCH_CREATE_FLAGS=cflags['pch_create'],
+                PCH_USE_FLAGS=cflags['pch_use'],
+                PCHFLAGS='',
+                PCHCOM='$CXX -o $TARGET $PCH_CREATE_FLAGS $CXXFLAGS $CCFLAGS '
+                '$_CCCOMCOM $SOURCE')
+    env.Append(CXXFLAGS=['$PCHFLAGS'])
+
+    # Compiler depfiles, used by build_object with DEPFILES
+    env.Replace(DEPFLAGS=cflags['depfile'] if env['DEPFILES'] else '')
+
+    threading_flags(env, cflags)
+    if env['PERF_INSTRUMENT']:
+        setup_perf_instrument(env, cflags)
     if env['PLATFORM'] == 'sw':
-        if env['ATHREAD']:
-            env.Append(CCFLAGS='-DSW_SLAVE')
         env.Append(CCFLAGS='-mieee')
 
     # Linker flags
@@ -162,7 +460,32 @@ def update_compiler_settings(env):
     # make gfortran support preprocessor
     env.Append(F90FLAGS='-cpp -fcray-pointer')
     env.Append(FORTRANMODDIR=env['PROJECT_INC_DIR'])
+    # timestamp decider first, the module decider wraps it
+    if env['FAST_NOOP']:
+        setup_fast_noop(env)
+    # module producer/consumer dependencies, see fortran_modules.py
+    setup_fortran_modules(env)
+
+    # copies or links for the install steps, see install_mode.py
+    env['INSTALL'] = install_file
+
+    # compile object cache shared by all build options
+    if env['OBJ_CACHE']:
+        setup_object_cache(env)
+
+    # send compiles to the build nodes given in REMOTE_WORKERS
+    if env['REMOTE_WORKERS']:
+        setup_remote_exec(env)
 
     # simpler compiling message
     if not env['VERBOSE']:
         simple_prints(env)
+
+    # per-action timing trace
+    if env['BUILD_TRACE']:
+        enable_build_trace(env)
+
+    # longest-first job ordering and default -j from recorded timings
+    if env['JOB_HISTORY']:
+        job_memory = env['JOB_MEMORY'] or cflags['job_memory']
+        enable_job_history(env, parse_size(job_memory))
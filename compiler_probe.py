@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""\
+Compiler probing
+----------------
+
+Finds out which compiler is behind ``CC``, ``CXX`` and ``F90`` instead of
+guessing from the program name.  MPI wrappers (``mpicc``, ``mpiicc``,
+``mpif90``) are resolved with ``-show``/``--showme`` to the compiler they
+call, and the family (gcc, clang, intel, sw) and version are read from
+``--version``, so versioned names such as ``gcc-11`` work as well.
+
+Candidate flags (``-march=native``, OpenMP, LTO, vectorisation reports)
+are try-compiled with all three compilers before they are used.  The
+results are kept in ``build/.compiler_probe.json`` per compiler binary;
+an entry is probed again when the wrapper or the compiler behind it
+changes, so later configures only stat a few files.
+"""
+
+import os
+import re
+import json
+import shutil
+import tempfile
+import subprocess
+
+PROBE_VERSION = 1
+PROBE_FILE = os.path.join('build', '.compiler_probe.json')
+
+# options printing the command line of an MPI compiler wrapper
+_wrapper_options = ('-show', '--showme')
+
+# family by a pattern of the --version output, first match wins
+_family_patterns = (('intel', re.compile(r'\bIntel\b|\bicc\b|\bifort\b')),
+                    ('sw', re.compile(r'\bsw\w*(gcc|g\+\+|gfortran)|Sunway')),
+                    ('clang', re.compile(r'clang', re.I)),
+                    ('gcc', re.compile(r'\bGCC\b|GNU|Free Software')))
+
+_version_re = re.compile(r'(\d+\.\d+(?:\.\d+)?)')
+
+# diagnostics of a flag that was accepted but ignored
+_ignored_re = re.compile(r'unrecogni[sz]ed|unknown|ignoring|not supported|'
+                         r'unused', re.I)
+
+_test_sources = {
+    'c': ('conftest.c', 'int main(void) { return 0; }\n'),
+    'cxx': ('conftest.cpp', 'int main() { return 0; }\n'),
+    'fortran': ('conftest.f90', 'program conftest\nend program conftest\n'),
+}
+
+_probe = dict(cache=None, dirty=False)
+
+
+def _load():
+    if _probe['cache'] is None:
+        try:
+            with open(PROBE_FILE) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            cache = {}
+        if cache.get('version') != PROBE_VERSION:
+            cache = dict(version=PROBE_VERSION, compilers={})
+        _probe['cache'] = cache
+    return _probe['cache']['compilers']
+
+
+def _save():
+    if not _probe['dirty']:
+        return
+    tmp = '%s.%d' % (PROBE_FILE, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(PROBE_FILE)):
+            os.makedirs(os.path.dirname(PROBE_FILE))
+        with open(tmp, 'w') as f:
+            json.dump(_probe['cache'], f, indent=1, sort_keys=True)
+        os.replace(tmp, PROBE_FILE)
+        _probe['dirty'] = False
+    except (IOError, OSError):
+        pass
+
+
+def _run(command, cwd=None):
+    """Return code and output of command, None if it cannot be run"""
+    try:
+        proc = subprocess.Popen(command, cwd=cwd, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        out = proc.communicate(timeout=60)[0]
+    except (OSError, subprocess.TimeoutExpired):
+        return None, ''
+    return proc.returncode, out.decode('utf-8', 'replace')
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _real_compiler(binary):
+    """Compiler called by an MPI wrapper, binary itself for compilers"""
+    for option in _wrapper_options:
+        code, out = _run([binary, option])
+        if code != 0 or not out.strip():
+            continue
+        real = shutil.which(out.split()[0])
+        if real and os.path.realpath(real) != os.path.realpath(binary):
+            return real
+    return binary
+
+
+def _identify(binary):
+    real = _real_compiler(binary)
+    code, out = _run([real, '--version'])
+    if code != 0:
+        code, out = _run([real, '-V'])
+    family = None
+    for name, pattern in _family_patterns:
+        if pattern.search(out) or pattern.search(os.path.basename(real)):
+            family = name
+            break
+    version = _version_re.search(out)
+    return dict(real=real,
+                real_stamp=_stamp(real),
+                family=family,
+                version=version.group(1) if version else None,
+                flags={})
+
+
+def compiler_info(prog, env=None):
+    """Family, version and real binary of a compiler
+
+    Args:
+        prog (str): compiler command, e.g. mpicxx or gcc-11
+        env (Environment): environment whose PATH is searched
+
+    Returns:
+        dict: 'family' (gcc, clang, intel, sw or None), 'version',
+            'real' (compiler behind a wrapper) and the try-compiled 'flags';
+            None if the compiler is not found
+    """
+    name = str(prog).split()[0] if prog else ''
+    binary = env.WhereIs(name) if env is not None else shutil.which(name)
+    if not binary:
+        return None
+    compilers = _load()
+    entry = compilers.get(binary)
+    if entry is None or entry['stamp'] != _stamp(binary) or \
+            entry['real_stamp'] != _stamp(entry['real']):
+        entry = _identify(binary)
+        entry['stamp'] = _stamp(binary)
+        compilers[binary] = entry
+        _probe['dirty'] = True
+        _save()
+    return entry
+
+
+def _try_compile(prog, flags, language, link):
+    source, text = _test_sources[language]
+    tmp = tempfile.mkdtemp(prefix='amd_scons_probe_')
+    try:
+        with open(os.path.join(tmp, source), 'w') as f:
+            f.write(text)
+        command = prog.split() + flags.split()
+        command += [source] if link else ['-c', source]
+        code, out = _run(command + ['-o', 'conftest.out'], cwd=tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return code == 0 and not _ignored_re.search(out)
+
+
+def check_flags(env, flags, link=False,
+                compilers=(('CC', 'c'), ('CXX', 'cxx'), ('F90', 'fortran'))):
+    """True if all compilers of env accept flags
+
+    The flags go to CCFLAGS, which the Fortran compiles use as well, so
+    each of CC, CXX and F90 try-compiles a small program with them.
+
+    Args:
+        env (Environment): program SCons build environment
+        flags (str): flags to check
+        link (bool): also link the program, e.g. for OpenMP and LTO
+        compilers (list): (variable, language) of the compilers to check
+    """
+    key = ('link ' if link else 'compile ') + flags
+    for var, language in compilers:
+        prog = env.get(var)
+        info = compiler_info(prog, env)
+        if info is None:
+            continue
+        if key not in info['flags']:
+            info['flags'][key] = _try_compile(str(prog), flags, language,
+                                              link)
+            _probe['dirty'] = True
+        if not info['flags'][key]:
+            _save()
+            return False
+    _save()
+    return True
+
+
+def host_cpu_flags():
+    """CPU feature flags of the build host, empty if unknown"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except (IOError, OSError):
+        pass
+    return set()
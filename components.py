@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""\
+Components
+----------
+
+Splits the sources of a library into named components.  Each component
+is a sub-directory with its own SConscript, its own object set and
+optionally its own library, and may depend on other components.  In the
+library SConscript::
+
+    from components import add_component, read_components, build_components
+
+    add_component('common')
+    add_component('linear_solver', depends=['common'], lib='linearSolver')
+    read_components(env)
+    build_components(env, target='utilities',
+                     program_inc=env['THIRDPARTY_INCS'],
+                     program_libs=env['THIRDPARTY_LIBS'])
+
+The component SConscripts add their files with ``add_source_files`` as
+before.  Every component gets an alias of the same name that builds its
+objects, its library and its dependencies.  ``scons component=linear_solver``
+(several names separated by commas) only reads the SConscripts of the
+named components and of the components they depend on, and builds just
+those; a name no SConscript declared fails the build with the list of the
+declared ones.  Independent components have no ordering between them, so -j
+compiles them side by side.  The SConscripts themselves are read one
+after another: SCons reads SConscripts in the main thread only, with a
+global current directory, node tree and Default list, and
+``add_source_files`` relies on the component being read.
+"""
+
+import os
+
+from build import cxx_source_files, c_source_files, fortran_source_files, \
+    chost_source_files, cslave_source_files, cxxhost_source_files, \
+    build_objects, build_lib, library_nodes
+
+# build_objects argument of each global source list
+_source_args = ((cxx_source_files, 'cxx_source'),
+                (c_source_files, 'c_source'),
+                (fortran_source_files, 'fortran_source'),
+                (chost_source_files, 'chost_source'),
+                (cslave_source_files, 'cslave_source'),
+                (cxxhost_source_files, 'cxxhost_source'))
+
+_registry = dict(components={}, order=[], current=None, selecting=False,
+                 declared=set())
+
+
+def reset_components():
+    """Forget the declared components, e.g. before the next configuration"""
+    _registry['components'] = {}
+    _registry['order'] = []
+
+
+def add_component(name, directory=None, depends=(), lib=None):
+    """Declare a component
+
+    Args:
+        name (str): component and alias name
+        directory (str): directory of the component SConscript relative to
+            the current SConscript, name by default
+        depends (list): names of the components this one needs
+        lib (str): build the component as a library of its own instead of
+            adding its objects to the library of build_components
+    """
+    from SCons.Errors import UserError
+
+    if name in _registry['components']:
+        raise UserError('component %s declared twice' % name)
+    _registry['components'][name] = dict(name=name,
+                                         directory=directory or name,
+                                         depends=list(depends),
+                                         lib=lib,
+                                         sources={},
+                                         read=False,
+                                         built=False)
+    _registry['order'].append(name)
+    _registry['declared'].add(name)
+
+
+def add_component_sources(files, all_source_files):
+    """Add files to the component being read
+
+    Returns:
+        bool: False if no component SConscript is being read
+    """
+    component = _registry['current']
+    if component is None:
+        return False
+    for source_list, arg in _source_args:
+        if source_list is all_source_files:
+            component['sources'].setdefault(arg, []).extend(files)
+            return True
+    return False
+
+
+def selected_components():
+    """Names given by component= on the command line, None for all"""
+    from SCons.Script import ARGUMENTS
+
+    names = ARGUMENTS.get('component', '').replace(',', ' ').split()
+    return set(names) or None
+
+
+def _with_dependencies(names):
+    """names and the declared components they depend on"""
+    components = _registry['components']
+    result = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in result or name not in components:
+            continue
+        result.add(name)
+        stack.extend(components[name]['depends'])
+    return result
+
+
+def _check_selected(target, source, env):
+    """Fail on component= names that no SConscript declared
+
+    Runs when the targets are built, as the components of several
+    libraries are only all declared once every SConscript was read.
+    """
+    from SCons.Errors import UserError
+
+    unknown = sorted(selected_components() - _registry['declared'])
+    if unknown:
+        raise UserError('unknown component %s, the components are: %s' %
+                        (', '.join(unknown),
+                         ', '.join(sorted(_registry['declared'])) or
+                         'none'))
+    return 0
+
+
+def read_components(env, exports=None):
+    """Read the SConscripts of the declared components
+
+    The SConscripts are read one after another, SConscript reading is not
+    thread-safe; with component= only the selected components and their
+    dependencies are read, and the build fails with a UserError if a
+    selected name was never declared.
+
+    Args:
+        env (Environment): program SCons build environment
+        exports (dict): further variables exported to the SConscripts
+    """
+    from SCons.Script import SConscript, Default
+
+    selected = selected_components()
+    wanted = None if selected is None else _with_dependencies(selected)
+    if selected is not None and not _registry['selecting']:
+        # only the selected components are default targets, and the check
+        # of their names
+        _registry['selecting'] = True
+        Default(None)
+        check = env.Alias('component-names', [],
+                          env.Action(_check_selected, None))
+        env.AlwaysBuild(check)
+        Default(check)
+    for name in _registry['order']:
+        component = _registry['components'][name]
+        if component['read'] or (wanted is not None and name not in wanted):
+            continue
+        variables = dict(env=env, component=name)
+        variables.update(exports or {})
+        _registry['current'] = component
+        try:
+            SConscript(os.path.join(component['directory'], 'SConscript'),
+                       exports=variables)
+        finally:
+            _registry['current'] = None
+        component['read'] = True
+
+
+def build_components(env, target, program_inc, program_libs, pch=None):
+    """Compile the components read by read_components
+
+    The objects of components without a library of their own go into the
+    target library.  With component= the target library is not built,
+    as it would miss the components that were not read.
+
+    Args:
+        env (Environment): program SCons build environment
+        target (str): name of the library of the components
+        program_inc (list): List of program include paths
+        program_libs (list): List of libraries to be linked
+        pch (str): precompiled header passed to build_objects
+
+    Returns:
+        list: objects of the target library
+    """
+    from SCons.Script import Default
+
+    selected = selected_components()
+    objs_all = []
+    for name in _registry['order']:
+        component = _registry['components'][name]
+        if not component['read'] or component['built']:
+            continue
+        component['built'] = True
+        objs = build_objects(env, pch=pch, **component['sources'])
+        nodes = list(objs)
+        if component['lib']:
+            build_lib(env,
+                      target=component['lib'],
+                      sources=objs,
+                      program_inc=program_inc,
+                      program_libs=program_libs)
+            nodes += library_nodes(env, component['lib'])
+        else:
+            objs_all += objs
+        alias = env.Alias(name, nodes)
+        for dep in component['depends']:
+            env.Depends(alias, env.Alias(dep))
+        if selected is not None and name in selected:
+            Default(alias)
+
+    if selected is None:
+        build_lib(env,
+                  target=target,
+                  sources=objs_all,
+                  program_inc=program_inc,
+                  program_libs=program_libs)
+    return objs_all
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""\
+Configuration cache
+-------------------
+
+SCons' ``default`` tool probes PATH for every compiler, linker, archiver
+and helper tool it knows about, which takes seconds on NFS-mounted
+toolchains.  ``configure_environment`` runs that detection once and keeps
+the resulting tool list in ``build/.config_cache.json``.  The entry is
+reused as long as PATH, the contents of the PATH directories, the
+compiler binaries and the ``site_scons/build_config.py`` values are
+unchanged.
+
+With ``FAST_NOOP=1`` the run stops here when nothing changed since the
+last build, see fast_noop.py.
+
+With ``STARTUP_REPORT=1`` the time spent before the first build task is
+printed at the end of the build, to keep an eye on no-op build times.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import hashlib
+from fast_noop import fast_noop_requested, check_noop_manifest
+
+CACHE_VERSION = 1
+CACHE_FILE = os.path.join('build', '.config_cache.json')
+CONFIG_FILE = os.path.join('site_scons', 'build_config.py')
+
+# variables naming the compilers and linkers whose binaries are checked
+compiler_vars = ('CC', 'CXX', 'F90', 'CXX_LINKER', 'F_LINKER', 'CC_HOST',
+                 'CC_SLAVE', 'CXX_HOST')
+
+_build_config = {}
+_startup = dict(configure=0.0, tools_cached=False, first_task=None)
+
+
+def read_build_config(path=CONFIG_FILE):
+    """Return the values set in the build configuration file"""
+    if path not in _build_config:
+        values = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                exec(compile(f.read(), path, 'exec'), {}, values)
+        _build_config[path] = values
+    return _build_config[path]
+
+
+def config_value(key, default=None, arguments=None):
+    """Value of a build variable without creating an Environment
+
+    Command line arguments take precedence over build_config.py, as in
+    SCons Variables.
+
+    Args:
+        key (str): variable name
+        default: value if the variable is not set
+        arguments (dict): command line arguments, SCons ARGUMENTS by default
+    """
+    if arguments is None:
+        from SCons.Script import ARGUMENTS as arguments
+    if key in arguments:
+        return arguments[key]
+    return read_build_config().get(key, default)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _which(prog, path):
+    if os.path.isabs(prog):
+        return prog
+    for d in path.split(os.pathsep):
+        candidate = os.path.join(d, prog)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def _cache_key(variables, path):
+    """Everything the tool detection result depends on"""
+    import SCons
+
+    defaults = dict((opt.key, opt.default) for opt in variables.options)
+    compilers = []
+    for var in compiler_vars:
+        prog = config_value(var, defaults.get(var))
+        if prog:
+            binary = _which(str(prog).split()[0], path)
+            compilers.append([var, binary, binary and _mtime(binary)])
+    data = dict(version=CACHE_VERSION,
+                scons=SCons.__version__,
+                python=sys.executable,
+                path=path,
+                path_dirs=[_mtime(d) for d in path.split(os.pathsep)],
+                compilers=compilers,
+                build_config=read_build_config())
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_cache(data):
+    tmp = '%s.%d' % (CACHE_FILE, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(CACHE_FILE)):
+            os.makedirs(os.path.dirname(CACHE_FILE))
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(tmp, CACHE_FILE)
+    except (IOError, OSError):
+        pass
+
+
+def _env_path(env_vars):
+    return env_vars.get('ENV', os.environ).get('PATH', '')
+
+
+def default_tools(variables, env_vars, key=None):
+    """Names of the tools the SCons 'default' tool would load
+
+    Args:
+        variables (Variables): program build variables
+        env_vars (dict): keyword arguments of the Environment, ENV is used
+            for the PATH searched by the tool detection
+        key (str): _cache_key of variables, computed if not given
+    """
+    from SCons.Environment import Environment
+    from SCons.Tool import tool_list
+
+    if key is None:
+        key = _cache_key(variables, _env_path(env_vars))
+    cache = _load_cache()
+    if cache.get('key') == key:
+        _startup['tools_cached'] = True
+        return cache['tools']
+
+    # an Environment without tools is cheap, only the detection is not
+    probe = Environment(variables=variables, tools=[], **env_vars)
+    tools = [str(t) for t in tool_list(probe['PLATFORM'], probe)]
+    _save_cache(dict(key=key, tools=tools))
+    return tools
+
+
+def configure_environment(variables, tools=None, **kw):
+    """Create the program environment using the cached tool detection
+
+    Args:
+        variables (Variables): program build variables
+        tools (list): tools, 'default' is replaced by the cached list
+        kw: other Environment arguments, e.g. ENV=os.environ
+
+    Returns:
+        Environment: the program SCons build environment
+    """
+    from SCons.Environment import Environment
+
+    start = time.time()
+    key = _cache_key(variables, _env_path(kw))
+    if fast_noop_requested():
+        # stops here if nothing changed since the last build
+        check_noop_manifest(key)
+    tools = ['default'] if tools is None else list(tools)
+    if 'default' in tools:
+        i = tools.index('default')
+        tools[i:i + 1] = default_tools(variables, kw, key)
+    env = Environment(variables=variables, tools=tools, **kw)
+    _startup['configure'] = time.time() - start
+    if env['STARTUP_REPORT']:
+        report_startup()
+    return env
+
+
+def _first_task(node):
+    if _startup['first_task'] is None:
+        _startup['first_task'] = time.time()
+
+
+def _print_startup():
+    import SCons.Script
+
+    now = time.time()
+    first = _startup['first_task'] or now
+    print('Startup: environment %.3f s (%s tool detection), '
+          'first task after %.3f s, total %.3f s' %
+          (_startup['configure'],
+           'cached' if _startup['tools_cached'] else 'full',
+           first - SCons.Script.start_time, now - SCons.Script.start_time))
+
+
+def report_startup():
+    """Print the time to the first build task at the end of the build"""
+    from SCons.Script import Progress
+
+    Progress(_first_task)
+    atexit.register(_print_startup)
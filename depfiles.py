@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""\
+Compiler depfiles
+-----------------
+
+With ``DEPFILES=1`` the C and C++ compiles of ``build_object`` write a
+make-style dependency file next to each object (``-MMD -MF $TARGET.d``)
+and SCons takes the header dependencies from it instead of running its
+C scanner over the long CPPPATH.  The dependencies end up in the
+signature database like scanned ones.
+
+Objects without a depfile (the first build) are scanned as usual.  After
+each compile the object's implicit dependencies are replaced by the new
+depfile, so adding an ``#include`` does not cause a second rebuild on the
+next run.  Fortran sources keep the SCons scanner, which also tracks
+module dependencies.
+"""
+
+import os
+import re
+
+_c_suffixes = frozenset(['.c', '.C', '.cc', '.cpp', '.cxx', '.c++', '.CPP',
+                         '.cp', '.i', '.ii'])
+
+_scanners = {}
+
+
+def read_depfile(path):
+    """Return the prerequisites of the first rule of a depfile
+
+    Returns:
+        list or None: paths, None if the file does not exist
+    """
+    try:
+        with open(path) as f:
+            text = f.read()
+    except (IOError, OSError):
+        return None
+    text = text.replace('\\\r\n', ' ').replace('\\\n', ' ')
+    rule = text.split('\n', 1)[0]
+    # the target may contain a drive letter, the separator is ': '
+    _, sep, deps = rule.partition(': ')
+    if not sep:
+        return []
+    deps = re.split(r'(?<!\\)\s+', deps.strip())
+    return [d.replace('\\ ', ' ').replace('$$', '$') for d in deps if d]
+
+
+def _depfile_nodes(target, env):
+    paths = read_depfile(target.get_abspath() + '.d')
+    if paths is None:
+        return None
+    top = env.Dir('#').abspath
+    sources = set(s.get_abspath() for s in target.sources)
+    nodes = []
+    for p in paths:
+        p = os.path.join(top, p)
+        if p in sources:
+            continue
+        node = env.File(p)
+        # headers removed since the last compile must not stop the build
+        if node.has_builder() or node.exists():
+            nodes.append(node)
+    return nodes
+
+
+def _scan_target(node, env, path):
+    deps = _depfile_nodes(node, env)
+    if deps is not None:
+        return deps
+
+    # no depfile yet, scan the C/C++ sources like SCons would
+    from SCons.Tool import SourceFileScanner
+
+    path_func = node.get_executor().get_build_scanner_path
+    deps = []
+    for src in node.sources:
+        if os.path.splitext(str(src))[1] in _c_suffixes:
+            deps.extend(src.get_implicit_deps(env, SourceFileScanner,
+                                              path_func))
+    return deps
+
+
+def _update_implicit(target, source, env):
+    """Take the implicit dependencies of the targets from the new depfiles"""
+    for t in target:
+        deps = _depfile_nodes(t, env)
+        if deps is None:
+            continue
+        for d in deps:
+            d.get_ninfo().update(d)
+        # same order as a scan: command dependencies, then the target scanner
+        t.implicit = None
+        t.add_to_implicit(t.get_executor().get_implicit_deps())
+        t.add_to_implicit(deps)
+    return 0
+
+
+def _object_builder(env):
+    """Copy of the Object builder using depfiles for C/C++ sources"""
+    import copy
+    from SCons.Builder import CompositeBuilder
+    from SCons.Scanner import Base, Selector
+    from SCons.Tool import SourceFileScanner
+
+    builder = env['BUILDERS']['Object']
+    if id(builder) not in _scanners:
+        # Fortran and other sources keep the scanners of the builder
+        scanner = builder.builder.source_scanner or SourceFileScanner
+        scanners = getattr(scanner, 'mapping', None) or scanner.function
+        source_scanner = Selector(
+            dict((k, v) for k, v in scanners.items()
+                 if k not in _c_suffixes))
+        target_scanner = Base(_scan_target, 'DepfileScanner')
+        base = copy.copy(builder.builder)
+        base.source_scanner = source_scanner
+        base.target_scanner = target_scanner
+        new = CompositeBuilder(base, builder.cmdgen)
+        _scanners[id(builder)] = (builder, new)
+    return _scanners[id(builder)][1]
+
+
+def use_depfiles(env):
+    """Write depfiles for the C/C++ compiles of env and track them
+
+    Args:
+        env (Environment): environment used for the compile actions
+
+    Returns:
+        Builder: Object builder taking the dependencies from the depfiles,
+            called as builder(env, source=...)
+    """
+    for com in ('CCCOM', 'CXXCOM'):
+        value = env.get(com)
+        if value and '$DEPFLAGS' not in str(value):
+            env[com] = value + ' $DEPFLAGS'
+    return _object_builder(env)
+
+
+def track_depfiles(env, objs):
+    """Refresh the implicit dependencies of objs after they are compiled"""
+    from SCons.Action import Action
+
+    c_objs = [o for o in objs
+              if os.path.splitext(str(o.sources[0]))[1] in _c_suffixes]
+    if c_objs:
+        env.AddPostAction(c_objs, Action(_update_implicit, None))
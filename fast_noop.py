@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""\
+Fast no-op builds
+-----------------
+
+``FAST_NOOP=1`` makes builds without changes cheap:
+
+* the signature database is split by BUILD_OPTION into
+  ``build/.sconsign/<BUILD_OPTION>.dblite`` (sources and other
+  directories in ``common.dblite``), a build only loads the shards of its
+  configurations; the entries of an existing ``.sconsign.dblite`` are
+  moved over on first use;
+* files are decided by timestamp first, their content is only hashed when
+  the timestamp changed (the ``MD5-timestamp`` decider), or when it is in
+  the second the target was built;
+* after a successful build the files it used are written with their
+  timestamps and sizes to ``build/.noop_manifest.json``: the SConscripts,
+  ``build_config.py``, the build scripts, every source, header and target,
+  and the directories searched for them, also those outside the project
+  such as ``MPI_INC_PATH``.  The next run with the same command line,
+  environment variables and compilers stats these files in
+  ``configure_environment`` and stops right away if none changed, without
+  reading the SConscripts.  The time saved against the last full no-op run
+  is printed.
+
+Builds whose results do not only depend on files, e.g. with
+``AlwaysBuild`` targets such as ``check`` or ``Value`` nodes such as the
+PGO profiles, never take the shortcut.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import hashlib
+
+MANIFEST_VERSION = 2
+MANIFEST_FILE = os.path.join('build', '.noop_manifest.json')
+SCONSIGN_DIR = os.path.join('build', '.sconsign')
+# manifests kept, one per command line
+MAX_ENTRIES = 8
+# files younger than this are also compared by content
+RACY_NS = 1000000000
+
+# directories of derived files, their changes are checked file by file
+_derived_dirs = ('build', 'install')
+# environment variables that change between shells without any effect
+_volatile_env = ('_', 'PWD', 'OLDPWD', 'SHLVL', 'TERM', 'COLUMNS', 'LINES',
+                 'DISPLAY', 'WINDOWID', 'SSH_CLIENT', 'SSH_CONNECTION',
+                 'SSH_TTY', 'TMUX_PANE', 'STY')
+_true_values = ('y', 'yes', 't', 'true', '1', 'on', 'all')
+
+_noop = dict(key=None, start=None, watched=set(), registered=False)
+
+
+def fast_noop_requested():
+    """FAST_NOOP from the command line or build_config.py"""
+    from config_cache import config_value
+
+    return str(config_value('FAST_NOOP', False)).lower() in _true_values
+
+
+class _ShardedSConsign(object):
+    """dbm-like signature database with one dblite file per BUILD_OPTION
+
+    The keys are directory paths relative to the project root; those under
+    build/<BUILD_OPTION> and install/<BUILD_OPTION> go to the shard of that
+    BUILD_OPTION.  Shards are opened on first access.
+    """
+
+    def __init__(self, directory, mode):
+        from SCons import dblite
+
+        self.dblite = dblite
+        self.directory = directory
+        self.mode = mode
+        self.shards = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            self._migrate()
+
+    def _migrate(self):
+        """Move the entries of the single .sconsign database"""
+        import SCons.SConsign
+
+        name = getattr(SCons.SConsign, 'current_sconsign_filename',
+                       lambda: '.sconsign')() + '.dblite'
+        if not os.path.exists(name):
+            return
+        try:
+            legacy = self.dblite.open(name, 'r')
+        except (IOError, OSError, ValueError):
+            return
+        for key in legacy.keys():
+            self[key] = legacy[key]
+        self.sync()
+
+    def _open(self, name):
+        if name not in self.shards:
+            self.shards[name] = self.dblite.open(
+                os.path.join(self.directory, name), self.mode)
+        return self.shards[name]
+
+    def _shard(self, key):
+        parts = re.split(r'[\\/]', key)
+        if len(parts) > 1 and parts[0] in _derived_dirs and \
+                not parts[1].startswith('.'):
+            return self._open(parts[1])
+        return self._open('common')
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __setitem__(self, key, value):
+        self._shard(key)[key] = value
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def keys(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.dblite'):
+                self._open(name[:-len('.dblite')])
+        return [k for shard in self.shards.values() for k in shard.keys()]
+
+    def sync(self):
+        for shard in self.shards.values():
+            shard.sync()
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+
+
+class _ShardedDBModule(object):
+    """dbm_module argument of SConsignFile"""
+
+    def open(self, directory, mode='c'):
+        return _ShardedSConsign(directory, mode)
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _dir_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _environment():
+    values = sorted((k, v) for k, v in os.environ.items()
+                    if k not in _volatile_env)
+    return hashlib.sha256(json.dumps(values).encode('utf-8')).hexdigest()
+
+
+def _command_line():
+    return json.dumps(sys.argv[1:])
+
+
+def _load_manifest():
+    try:
+        with open(MANIFEST_FILE) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data
+
+
+def _save_manifest(data):
+    data['version'] = MANIFEST_VERSION
+    tmp = '%s.%d' % (MANIFEST_FILE, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(MANIFEST_FILE)):
+            os.makedirs(os.path.dirname(MANIFEST_FILE))
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, MANIFEST_FILE)
+    except (IOError, OSError):
+        pass
+
+
+def _digest(path):
+    h = hashlib.md5()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    except (IOError, OSError):
+        return None
+    return h.hexdigest()
+
+
+def _file_record(path, root, now_ns):
+    """[path, stamp] or, if written in the last second, [path, stamp, md5]
+
+    A file changed again within the timestamp resolution of the file
+    system keeps its stamp, recent files are also compared by content.
+    """
+    stamp = _stamp(path)
+    record = [_relative(path, root), stamp]
+    if stamp is not None and stamp[0] >= now_ns - RACY_NS:
+        record.append(_digest(path))
+    return record
+
+
+def _unchanged(entry):
+    """Compare the files and directories of a manifest entry
+
+    Returns:
+        bool: None if something changed, else True if content checks were
+            dropped from the entry
+    """
+    settled = False
+    now_ns = int(time.time() * 1e9)
+    for record in entry['files']:
+        if _stamp(record[0]) != record[1]:
+            return None
+        if len(record) > 2:
+            if _digest(record[0]) != record[2]:
+                return None
+            if record[1][0] < now_ns - RACY_NS:
+                # old enough now, the stamp alone will do next time
+                del record[2:]
+                settled = True
+    for path, stamp in entry['dirs']:
+        if _dir_stamp(path) != stamp:
+            return None
+    return settled
+
+
+def check_noop_manifest(config_key):
+    """Stop the run if the last build with this command line is current
+
+    Called by configure_environment before the SConscripts are read.
+
+    Args:
+        config_key (str): key of the tool detection, covering PATH, the
+            compilers and build_config.py
+    """
+    import SCons
+    import SCons.Script
+    from SCons.Script import GetOption, Exit
+
+    _noop['key'] = config_key
+    _noop['start'] = time.time()
+    if GetOption('clean') or GetOption('no_exec') or GetOption('help') or \
+            GetOption('question') or GetOption('interactive'):
+        return
+    data = _load_manifest()
+    entry = data.get('entries', {}).get(_command_line())
+    # only the SConscripts validate FAST_NOOP, the entry was written by a
+    # run that did
+    if entry is None or entry.get('fast_noop') is not True or \
+            entry['config'] != config_key or \
+            entry['scons'] != SCons.__version__ or \
+            entry['environment'] != _environment():
+        return
+    settled = _unchanged(entry)
+    if settled is None:
+        return
+    elapsed = time.time() - _noop['start']
+    saved = None
+    if entry.get('noop_seconds') is not None:
+        total = time.time() - SCons.Script.start_time
+        saved = max(entry['noop_seconds'] - total, 0.0)
+        entry['saved_total'] = entry.get('saved_total', 0.0) + saved
+    if saved is not None or settled:
+        _save_manifest(data)
+    print('scons: up to date, %d files checked in %.3f s%s' %
+          (len(entry['files']), elapsed,
+           '' if saved is None else ', %.2f s saved (%.1f s in total)' %
+           (saved, entry['saved_total'])))
+    Exit(0)
+
+
+def watch_file(path):
+    """Record a file read while the SConscripts are read
+
+    Files that change the build graph without being a node of it, e.g.
+    sw_tuning.json, are added to the manifest.
+    """
+    _noop['watched'].add(os.path.abspath(path))
+
+
+def _timestamp_then_content(dependency, target, prev_ni, repo_node=None):
+    """Decide by timestamp, by content if the timestamp changed
+
+    The timestamps have whole seconds: a dependency recorded in the second
+    its target was built may have changed again in that second, its
+    content is compared as by the default decider.
+    """
+    try:
+        racy = prev_ni.timestamp >= target.get_timestamp()
+    except AttributeError:
+        racy = True
+    if racy:
+        return dependency.changed_content(target, prev_ni, repo_node)
+    return dependency.changed_timestamp_then_content(target, prev_ni,
+                                                     repo_node)
+
+
+def setup_fast_noop(env):
+    """Shard the signature database, decide by timestamp and record runs
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    root = env.Dir('#').abspath
+    env.SConsignFile(os.path.join(root, SCONSIGN_DIR),
+                     dbm_module=_ShardedDBModule())
+    env.Decider(_timestamp_then_content)
+    if _noop['key'] is not None and not _noop['registered']:
+        _noop['registered'] = True
+        atexit.register(_write_manifest, root)
+
+
+def _relative(path, root):
+    if path.startswith(root + os.sep):
+        return path[len(root) + 1:]
+    return path
+
+
+def _searched(directory):
+    """Whether the entries of a directory were listed by a lookup"""
+    try:
+        directory.on_disk_entries
+    except AttributeError:
+        return False
+    return True
+
+
+def _evaluated_nodes(root):
+    """Files evaluated by this run and the directories to watch"""
+    from SCons.Node import up_to_date, executed
+    from SCons.Node.FS import File, Dir, get_default_fs
+    from SCons.Node.Python import Value
+    from SCons.Node.Alias import default_ans
+
+    derived = tuple(os.path.join(root, d) + os.sep for d in _derived_dirs)
+    files, dirs = [], []
+    built = 0
+    stack = [get_default_fs().Top.root]
+    while stack:
+        directory = stack.pop()
+        path = directory.get_abspath()
+        under_root = path == root or path.startswith(root + os.sep)
+        used = False
+        for name, node in directory.entries.items():
+            if name in ('.', '..'):
+                continue
+            if isinstance(node, Dir):
+                stack.append(node)
+                continue
+            if not isinstance(node, File) or \
+                    node.get_state() not in (up_to_date, executed):
+                continue
+            if node.always_build or any(
+                    isinstance(n, Value)
+                    for n in (node.depends or []) + (node.sources or [])):
+                return None
+            used = True
+            files.append(node.get_abspath())
+            if node.get_state() == executed and node.has_builder():
+                built += 1
+        # new files in source directories, or in any directory a scanner
+        # searched (e.g. MPI_INC_PATH), may change what the scanners find
+        if ((under_root or _searched(directory)) and
+                not (path + os.sep).startswith(derived)) or used:
+            dirs.append(path)
+    for alias in default_ans.values():
+        if alias.get_state() in (up_to_date, executed) and \
+                alias.always_build:
+            return None
+    return files, dirs, built
+
+
+def _write_manifest(root):
+    """Write the manifest of a successful build"""
+    import SCons
+    import SCons.Script
+    import SCons.Script.Main
+    from SCons.Node import SConscriptNodes
+    from SCons.Script import GetOption, GetBuildFailures
+    from config_cache import CONFIG_FILE
+
+    if SCons.Script.Main.exit_status != 0 or GetBuildFailures() or \
+            GetOption('clean') or GetOption('no_exec') or \
+            GetOption('help') or GetOption('question') or \
+            GetOption('interactive'):
+        return
+    evaluated = _evaluated_nodes(root)
+    if evaluated is None:
+        return
+    files, dirs, built = evaluated
+    prefixes = tuple(set(os.path.abspath(p) + os.sep for p in
+                         (sys.prefix, sys.base_prefix, sys.exec_prefix)))
+    scripts = [getattr(m, '__file__', None)
+               for m in list(sys.modules.values())]
+    scripts = [s for s in scripts if s and not
+               os.path.abspath(s).startswith(prefixes)]
+    files = set(files) | set(os.path.abspath(s) for s in scripts) | \
+        set(n.get_abspath() for n in SConscriptNodes) | _noop['watched'] | \
+        set([os.path.abspath(CONFIG_FILE)])
+
+    now_ns = int(time.time() * 1e9)
+    data = _load_manifest()
+    entries = data.setdefault('entries', {})
+    key = _command_line()
+    previous = entries.get(key, {})
+    noop_seconds = previous.get('noop_seconds')
+    if not built:
+        noop_seconds = time.time() - SCons.Script.start_time
+    entries[key] = dict(
+        config=_noop['key'],
+        fast_noop=True,
+        scons=SCons.__version__,
+        environment=_environment(),
+        files=sorted(_file_record(f, root, now_ns) for f in files),
+        dirs=sorted([_relative(d, root), _dir_stamp(d)] for d in dirs),
+        noop_seconds=noop_seconds,
+        saved_total=previous.get('saved_total', 0.0),
+        written=time.time())
+    for old in sorted(entries, key=lambda k: entries[k]['written'])[
+            :-MAX_ENTRIES]:
+        del entries[old]
+    _save_manifest(data)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""\
+Fortran module dependencies
+---------------------------
+
+Replaces the regular expression based Fortran emitter and scanner of the
+Object builder.  Sources are read through a small C preprocessor that
+follows ``#include`` and Fortran ``include`` files and the
+``#if``/``#ifdef`` branches selected by the ``-D`` flags of the compile,
+as gfortran sees them with ``-cpp``.  From the active lines
+
+* ``module m`` adds ``m.mod`` in ``FORTRANMODDIR`` to the targets of the
+  object, and ``submodule (p) s`` adds ``p@s.smod``;
+* ``use m`` makes the object depend on ``m.mod``, ``submodule (p) s`` on
+  ``p.mod`` and ``submodule (p:q) s`` on ``p@q.smod``.
+
+SCons therefore knows every producer and consumer of a module and can
+compile all other Fortran sources in parallel.  Module files are always
+compared by content, whatever the decider of the build, so a change that
+keeps a module interface does not recompile the users of the module.
+``#if`` expressions the preprocessor cannot evaluate count as true.
+"""
+
+import os
+import re
+import warnings
+
+_fortran_suffixes = ('.f', '.F', '.for', '.FOR', '.ftn', '.FTN', '.fpp',
+                     '.FPP', '.f77', '.F77', '.f90', '.F90', '.f95', '.F95',
+                     '.f03', '.F03', '.f08', '.F08')
+_module_suffixes = ('.mod', '.smod')
+
+_directive_re = re.compile(r'^\s*#\s*(\w+)\s*(.*?)\s*$')
+_define_re = re.compile(r'(\w+)(?:\(.*?\))?\s*(.*)$')
+_defined_re = re.compile(r'\bdefined\s*(?:\(\s*(\w+)\s*\)|(\w+))')
+_identifier_re = re.compile(r'\b[A-Za-z_]\w*\b')
+_cpp_include_re = re.compile(r'^\s*#\s*include\s*["<]([^">]+)[">]')
+_include_re = re.compile(r'''^\s*include\s*['"]([^'"]+)['"]''', re.I)
+_module_re = re.compile(r'^\s*module\s+(\w+)\s*(?:!.*)?$', re.I)
+_submodule_re = re.compile(
+    r'^\s*submodule\s*\(\s*(\w+)\s*(?::\s*(\w+)\s*)?\)\s*(\w+)', re.I)
+_use_re = re.compile(
+    r'^\s*use\b\s*(,\s*(\w+)\s*::|::)?\s*(\w+)', re.I)
+
+# parsed sources by path, defines and path
+_parsed = {}
+
+
+def _eval_condition(expr, macros):
+    """Value of an #if expression, True if it cannot be evaluated"""
+    expr = _defined_re.sub(
+        lambda m: '1' if (m.group(1) or m.group(2)) in macros else '0', expr)
+
+    def value(m):
+        v = macros.get(m.group(0), '0')
+        return v if re.match(r'^-?\d+$', v) else '0'
+
+    expr = _identifier_re.sub(value, expr)
+    expr = re.sub(r'(\d+)[uUlL]+\b', r'\1', expr)
+    expr = expr.replace('&&', ' and ').replace('||', ' or ')
+    expr = re.sub(r'!(?!=)', ' not ', expr)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return bool(eval(expr, {'__builtins__': {}}, {}))
+    except Exception:
+        return True
+
+
+def _find_include(name, current_dir, path):
+    for d in [current_dir] + list(path):
+        candidate = os.path.join(str(d), name)
+        if os.path.isfile(candidate):
+            return os.path.normpath(candidate)
+    return None
+
+
+def parse_source(filename, macros, path=()):
+    """Modules defined and used by a Fortran source
+
+    Args:
+        filename (str): source path
+        macros (dict): preprocessor macros defined on the command line
+        path (list): include directories
+
+    Returns:
+        dict: 'modules', 'submodules' (parent, ancestor, name), 'uses'
+            and 'includes' (paths of the included files)
+    """
+    result = dict(modules=[], submodules=[], uses=[], includes=[])
+    macros = dict(macros)
+    # each entry: (parent active, a branch was taken, this branch active)
+    stack = []
+
+    def read(name, depth):
+        try:
+            with open(name, 'rb') as f:
+                lines = f.read().decode('utf-8', 'replace').splitlines()
+        except (IOError, OSError):
+            return
+        current_dir = os.path.dirname(name)
+        for line in lines:
+            active = not stack or stack[-1][2]
+            directive = _directive_re.match(line)
+            if directive:
+                keyword, rest = directive.groups()
+                if keyword in ('if', 'ifdef', 'ifndef'):
+                    if keyword == 'if':
+                        cond = _eval_condition(rest, macros)
+                    else:
+                        cond = (rest.split()[0] in macros if rest else False)
+                        if keyword == 'ifndef':
+                            cond = not cond
+                    stack.append((active, active and cond, active and cond))
+                elif keyword == 'elif' and stack:
+                    parent, taken, _ = stack[-1]
+                    cond = parent and not taken and \
+                        _eval_condition(rest, macros)
+                    stack[-1] = (parent, taken or cond, cond)
+                elif keyword == 'else' and stack:
+                    parent, taken, _ = stack[-1]
+                    stack[-1] = (parent, True, parent and not taken)
+                elif keyword == 'endif' and stack:
+                    stack.pop()
+                elif not active:
+                    continue
+                elif keyword == 'define':
+                    m = _define_re.match(rest)
+                    if m:
+                        macros[m.group(1)] = m.group(2) or '1'
+                elif keyword == 'undef':
+                    macros.pop(rest.split()[0] if rest else '', None)
+                elif keyword == 'include':
+                    m = _cpp_include_re.match(line)
+                    if m:
+                        include(m.group(1), current_dir, depth)
+                continue
+            if not active:
+                continue
+            m = _include_re.match(line)
+            if m:
+                include(m.group(1), current_dir, depth)
+                continue
+            m = _use_re.match(line)
+            if m:
+                if (m.group(2) or '').lower() != 'intrinsic':
+                    result['uses'].append(m.group(3).lower())
+                continue
+            m = _submodule_re.match(line)
+            if m:
+                parent, ancestor, name_ = m.groups()
+                result['submodules'].append(
+                    (parent.lower(), ancestor and ancestor.lower(),
+                     name_.lower()))
+                continue
+            m = _module_re.match(line)
+            if m and m.group(1).lower() != 'procedure':
+                result['modules'].append(m.group(1).lower())
+
+    def include(name, current_dir, depth):
+        found = _find_include(name, current_dir, path)
+        if found is not None and depth < 32:
+            result['includes'].append(found)
+            read(found, depth + 1)
+
+    read(filename, 0)
+    return result
+
+
+def command_macros(env, target=None, source=None):
+    """Macros defined by the -D flags and CPPDEFINES of a Fortran compile"""
+    flags = env.subst('$F90FLAGS $_CPPDEFFLAGS', target=target,
+                      source=source).split()
+    macros = {}
+    for flag in flags:
+        if flag.startswith('-D') and len(flag) > 2:
+            name, _, value = flag[2:].partition('=')
+            macros[name] = value or '1'
+    return macros
+
+
+def is_module_file(node):
+    """True for the .mod and .smod targets of Fortran compiles"""
+    return str(node).endswith(_module_suffixes)
+
+
+def _parse_node(node, env, path, target=None):
+    # the variant directory copy may not exist yet, read the source
+    source = node.srcnode().rfile()
+    macros = command_macros(env, target=target, source=node)
+    path = tuple(p.get_abspath() for p in path)
+    key = (source.get_abspath(), tuple(sorted(macros.items())), path)
+    if key not in _parsed:
+        _parsed[key] = parse_source(source.get_abspath(), macros, path)
+    return _parsed[key]
+
+
+def _module_dir(env, target=None, source=None):
+    return env.Dir(env.subst('$FORTRANMODDIR', target=target,
+                             source=source) or '.')
+
+
+def _emitter(target, source, env):
+    """Add the module files written by the compile to the targets"""
+    from SCons.Scanner import FindPathDirs
+
+    node = source[0]
+    if not node.rexists() and not node.is_derived():
+        return target, source
+    parsed = _parse_node(node, env, FindPathDirs('F90PATH')(env), target)
+    moddir = _module_dir(env, target, source)
+    suffix = env.subst('$FORTRANMODSUFFIX') or '.mod'
+    for module in parsed['modules']:
+        target.append(moddir.File(module + suffix))
+    for parent, ancestor, name in parsed['submodules']:
+        target.append(moddir.File('%s@%s.smod' % (parent, name)))
+    return target, source
+
+
+def _scan(node, env, path):
+    """Include files and module files a Fortran source needs"""
+    from SCons.Node.FS import find_file
+
+    parsed = _parse_node(node, env, path)
+    # includes next to the source are used from the variant directory
+    src_dir = node.srcnode().dir.get_abspath()
+    deps = []
+    for p in parsed['includes']:
+        rel = os.path.relpath(p, src_dir)
+        deps.append(env.File(p) if rel.startswith(os.pardir)
+                    else node.dir.File(rel))
+    moddir = _module_dir(env)
+    suffix = env.subst('$FORTRANMODSUFFIX') or '.mod'
+    needed = [m + suffix for m in parsed['uses']
+              if m not in parsed['modules']]
+    for parent, ancestor, name in parsed['submodules']:
+        if ancestor:
+            needed.append('%s@%s.smod' % (parent, ancestor))
+        else:
+            needed.append(parent + suffix)
+    for name in needed:
+        module = moddir.File(name)
+        if not (module.has_builder() or module.exists()):
+            # modules of other projects, e.g. mpi.mod
+            module = find_file(name, tuple(path))
+        if module is not None:
+            deps.append(module)
+    return deps
+
+
+def _module_decider(default_source, default_target):
+    """Decider comparing module files by content and others as before"""
+
+    def decide(dependency, target, prev_ni, repo_node=None):
+        if is_module_file(dependency):
+            return dependency.changed_content(target, prev_ni, repo_node)
+        if dependency.has_builder():
+            return default_target(dependency, target, prev_ni, repo_node)
+        return default_source(dependency, target, prev_ni, repo_node)
+
+    return decide
+
+
+def setup_fortran_modules(env):
+    """Use the module scanner and emitter for the Fortran objects of env
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    import copy
+    from SCons.Builder import CompositeBuilder
+    from SCons.Scanner import Base, FindPathDirs, Selector
+
+    scanner = Base(_scan, 'FortranModuleScanner',
+                   path_function=FindPathDirs('F90PATH'))
+    for name in ('StaticObject', 'SharedObject'):
+        builder = env['BUILDERS'].get(name)
+        if builder is None:
+            continue
+        base = copy.copy(builder.builder)
+        base.emitter = copy.copy(base.emitter)
+        scanners = base.source_scanner
+        skeys = dict(getattr(scanners, 'mapping', None) or scanners.function)
+        for suffix in _fortran_suffixes:
+            if suffix in base.emitter:
+                base.emitter[suffix] = _emitter
+                skeys[suffix] = scanner
+        base.source_scanner = Selector(skeys)
+        new = CompositeBuilder(base, builder.cmdgen)
+        for key, value in list(env['BUILDERS'].items()):
+            if value is builder:
+                env['BUILDERS'][key] = new
+
+    env.Decider(_module_decider(env.decide_source, env.decide_target))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""\
+Persistent header index
+-----------------------
+
+Keeps the list of headers below ``LIB_SRC`` in a small JSON index so that
+``build_lninclude`` does not have to walk the whole source tree on every
+SCons invocation.  Each directory is stored with its modification time;
+a directory is only listed again when its mtime changed, i.e. when
+entries were added, removed or renamed in it.  Within one SCons process
+the tree is walked once for all configurations.
+"""
+
+import os
+import json
+import time
+
+INDEX_VERSION = 2
+INDEX_NAME = '.lnInclude_index.json'
+
+include_suffixes = frozenset([".hpp", ".H", ".hxx", ".h", ".hh"])
+
+# scans of this process by source tree, shared by all configurations
+_scanned = {}
+
+
+def _load_index(index_file):
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('dirs', {})
+
+
+def _save_index(index_file, dirs):
+    tmp = '%s.%d' % (index_file, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(index_file)):
+            os.makedirs(os.path.dirname(index_file))
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=INDEX_VERSION, dirs=dirs), f)
+        os.rename(tmp, index_file)
+    except (IOError, OSError):
+        pass
+
+
+def _list_dir(path, suffixes):
+    headers = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # like os.walk, do not descend into directory symlinks, they
+            # may form loops
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != "lnInclude":
+                    subdirs.append(entry.name)
+            elif entry.is_dir():
+                continue
+            elif os.path.splitext(entry.name)[1] in suffixes:
+                headers.append(entry.name)
+    headers.sort()
+    subdirs.sort()
+    return headers, subdirs
+
+
+def scan_headers(src_dir, index_file, ostype, suffixes=include_suffixes):
+    """Collect the headers below src_dir using the persistent index
+
+    Args:
+        src_dir (str): root of the source tree
+        index_file (str): path of the JSON index
+        ostype (str): "windows" or "posix", selects OSspecific subdirectories
+        suffixes (set): header file suffixes
+
+    Returns:
+        (headers, collisions, stats): list of header paths with unique
+        basenames, dict of basename to all conflicting paths, and a dict
+        with the scan statistics
+    """
+    start = time.time()
+    key = (src_dir, ostype, frozenset(suffixes))
+    if key in _scanned:
+        headers, collisions, stats, dirs = _scanned[key]
+        if _load_index(index_file) != dirs:
+            _save_index(index_file, dirs)
+        stats = dict(stats, rescanned=0, seconds=time.time() - start)
+        return list(headers), dict(collisions), stats
+
+    old_dirs = _load_index(index_file)
+    new_dirs = {}
+    rescanned = 0
+
+    headers = []
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(src_dir, rel) if rel else src_dir
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        entry = old_dirs.get(rel)
+        if entry is not None and entry[0] == mtime:
+            dir_headers, subdirs = entry[1], entry[2]
+        else:
+            dir_headers, subdirs = _list_dir(path, suffixes)
+            rescanned += 1
+        new_dirs[rel] = [mtime, dir_headers, subdirs]
+
+        headers.extend(os.path.join(path, f) for f in dir_headers)
+        if "OSspecific" in os.path.basename(path):
+            subdirs = [d for d in subdirs if d == ostype]
+        stack.extend(os.path.join(rel, d) for d in reversed(subdirs))
+
+    if rescanned or len(new_dirs) != len(old_dirs):
+        _save_index(index_file, new_dirs)
+
+    unique = {}
+    collisions = {}
+    for h in headers:
+        name = os.path.basename(h)
+        if name in unique:
+            collisions.setdefault(name, [unique[name]]).append(h)
+        else:
+            unique[name] = h
+
+    stats = dict(headers=len(unique),
+                 dirs=len(new_dirs),
+                 rescanned=rescanned,
+                 seconds=time.time() - start)
+    _scanned[key] = (list(unique.values()), collisions, stats, new_dirs)
+    return list(unique.values()), collisions, stats
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""\
+Install modes
+-------------
+
+``INSTALL_MODE`` selects how ``build_lninclude``, ``build_lib`` and
+``build_app`` put headers, libraries and executables into
+``install/<BUILD_OPTION>``:
+
+* ``copy``: plain copies (default);
+* ``hardlink``: hard links to the files in the build directory;
+* ``symlink``: symbolic links to the files in the build directory;
+* ``reflink``: copy-on-write clones (btrfs, xfs), no data is copied.
+
+When the filesystem rejects a mode (different devices, no link or clone
+support) the files are copied and a warning is printed once.  Files whose
+installed content is already identical are left alone, so their
+timestamps do not change.  Installed files are hard links or symbolic
+links to the build tree in the link modes, so they must not be edited in
+place.
+"""
+
+import os
+import stat
+import shutil
+import filecmp
+
+INSTALL_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+# ioctl number of FICLONE on Linux
+_FICLONE = 0x40049409
+
+# (mode, source device, destination device) the mode failed for
+_unsupported = {}
+
+
+def same_content(dest, source):
+    """True if both files exist and have the same content"""
+    try:
+        if os.path.samefile(dest, source):
+            return True
+        if os.path.getsize(dest) != os.path.getsize(source):
+            return False
+    except OSError:
+        return False
+    return filecmp.cmp(dest, source, shallow=False)
+
+
+def _reflink(source, dest):
+    import fcntl
+
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    shutil.copymode(source, dest)
+
+
+def _copy(source, dest):
+    shutil.copy2(source, dest)
+    mode = os.stat(dest).st_mode
+    os.chmod(dest, stat.S_IMODE(mode) | stat.S_IWRITE)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _link(source, tmp, mode):
+    """Create tmp as a link or clone of source
+
+    Returns:
+        bool: False if the filesystem does not support the mode
+    """
+    key = (mode, os.stat(source).st_dev,
+           os.stat(os.path.dirname(tmp) or '.').st_dev)
+    if key in _unsupported:
+        return False
+    try:
+        if mode == 'hardlink':
+            os.link(source, tmp)
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(source), tmp)
+        else:
+            _reflink(source, tmp)
+    except (OSError, IOError, ImportError) as e:
+        _remove(tmp)
+        _unsupported[key] = e
+        print('Warning: %s install not possible in %s (%s), copying files '
+              'instead' % (mode, os.path.dirname(tmp), e))
+        return False
+    return True
+
+
+def install_file(dest, source, env):
+    """Install source as dest according to INSTALL_MODE
+
+    Used as the SCons INSTALL function.
+
+    Returns:
+        int: 0 on success
+    """
+    from SCons.Tool.install import copyFunc
+
+    if os.path.isdir(source):
+        return copyFunc(dest, source, env)
+
+    mode = env.get('INSTALL_MODE', 'copy')
+    if os.path.islink(dest) == (mode == 'symlink') and \
+            same_content(dest, source):
+        return 0
+
+    parent = os.path.dirname(dest)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    # the new file replaces the old one atomically, even when the old one
+    # is a link to the source
+    tmp = '%s.install.%d' % (dest, os.getpid())
+    if mode == 'copy' or not _link(source, tmp, mode):
+        _copy(source, tmp)
+    os.replace(tmp, dest)
+    return 0
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""\
+History-aware job scheduling
+----------------------------
+
+Keeps a small database of past action durations per ``BUILD_OPTION``
+(``build/<BUILD_OPTION>/.job_history.json``) and uses it to hand the
+longest actions, and the actions on the critical path, to the SCons job
+scheduler first.  SCons visits the order-only prerequisites of a target
+before its sources, so ``build_lib`` and ``build_app`` make their objects
+prerequisites sorted by the expected time from the start of the action to
+the end of the build.  The archive and link commands keep the declared
+order of the objects, a changed history does not rebuild anything.
+
+Also chooses a default ``-j`` from the core count and the available
+memory when none was given on the command line.
+"""
+
+import os
+import sys
+import json
+import time
+
+from build_trace import enable_recording, add_listener, target_durations
+
+HISTORY_VERSION = 1
+
+_history = dict(path=None, root='', entries={})
+
+
+def _key(node):
+    """Target path relative to the project directory"""
+    try:
+        path = node.get_abspath()
+    except AttributeError:
+        return str(node)
+    return os.path.relpath(path, _history['root'])
+
+
+def history_file(env):
+    return os.path.join(env.Dir('#').abspath, 'build', env['BUILD_OPTION'],
+                        '.job_history.json')
+
+
+def load_history(path):
+    """Return the entries of a history file
+
+    Each entry maps a target path to [duration, tail, last_seen] where
+    tail is the time from the start of the target to the end of the build
+    along the longest dependency chain.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != HISTORY_VERSION:
+        return {}
+    return data.get('entries', {})
+
+
+def _tails(durations):
+    """Longest remaining chain from every target to the end of the build
+
+    Args:
+        durations (dict): node to seconds of all targets with a known
+            duration, whether or not they were rebuilt in this run
+    """
+    from SCons.Node import Node
+
+    durations = dict((node, seconds) for node, seconds in durations.items()
+                     if isinstance(node, Node))
+    parents = dict((node, []) for node in durations)
+    for node in durations:
+        seen = set()
+        stack = list(node.children())
+        while stack:
+            child = stack.pop()
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            if child in durations:
+                parents[child].append(node)
+            else:
+                stack.extend(child.children())
+
+    tails = {}
+
+    def tail(node, active):
+        if node in tails:
+            return tails[node]
+        if node in active:
+            return 0.0
+        active.add(node)
+        up = max([tail(p, active) for p in parents[node]] or [0.0])
+        active.discard(node)
+        tails[node] = durations[node] + up
+        return tails[node]
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    try:
+        for node in durations:
+            tail(node, set())
+    finally:
+        sys.setrecursionlimit(limit)
+    return tails
+
+
+def _save_history(records, path, max_age_days):
+    from SCons.Node import Node
+    from SCons.Node.FS import get_default_fs
+
+    entries = _history['entries']
+    durations = {}
+    for node, seconds in target_durations(records).items():
+        # the dependency chains need nodes, plain paths are left out
+        if not isinstance(node, Node):
+            continue
+        key = _key(node)
+        old = entries.get(key)
+        if old is not None:
+            # exponential moving average smooths out noisy runs
+            seconds = 0.5 * seconds + 0.5 * old[0]
+        durations[node] = seconds
+        entries[key] = [round(seconds, 4), 0.0, int(time.time())]
+
+    # targets that were up to date still lengthen the chains through them
+    fs = get_default_fs()
+    recorded = set(_key(node) for node in durations)
+    for key, entry in entries.items():
+        if key not in recorded:
+            node = fs.Entry(os.path.join(_history['root'], key))
+            if node.has_builder():
+                durations[node] = entry[0]
+
+    for node, tail in _tails(durations).items():
+        entries[_key(node)][1] = round(tail, 4)
+
+    now = time.time()
+
+    limit = now - max_age_days * 86400
+    entries = dict((k, v) for k, v in entries.items() if v[2] >= limit)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=HISTORY_VERSION, entries=entries), f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def expected_priority(node):
+    """Expected time from starting node to the end of the build"""
+    entry = _history['entries'].get(_key(node))
+    if entry is None:
+        return 0.0
+    return entry[1]
+
+
+def order_by_history(nodes):
+    """Sort nodes so that the longest expected chains come first
+
+    Targets without history keep their relative order after the known
+    ones, which is the order SCons would have used anyway.
+    """
+    if not _history['entries']:
+        return nodes
+    return sorted(nodes, key=lambda n: -expected_priority(n))
+
+
+def schedule_by_history(env, targets, nodes):
+    """Start the jobs of nodes in the order of order_by_history
+
+    The nodes become order-only prerequisites of targets, which changes
+    when SCons starts them but not the command lines of targets.
+
+    Args:
+        env (Environment): program SCons build environment
+        targets (list): targets built from nodes
+        nodes (list): sources of targets, in their declared order
+    """
+    if _history['entries'] and targets:
+        env.Requires(targets, order_by_history(env.Flatten([nodes])))
+
+
+def _available_memory():
+    """Available memory in bytes, None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _jobs_given():
+    flags = sys.argv[1:] + os.environ.get('SCONSFLAGS', '').split()
+    return any(a.startswith(('-j', '--jobs')) for a in flags)
+
+
+def default_num_jobs(job_memory):
+    """Number of jobs fitting both the cores and the available memory
+
+    Args:
+        job_memory (int): expected peak memory of one compile in bytes
+    """
+    cpus = os.cpu_count() or 1
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    jobs = cpus
+    mem = _available_memory()
+    if mem is not None and job_memory > 0:
+        jobs = min(jobs, int(mem // job_memory))
+    return max(jobs, 1)
+
+
+def enable_job_history(env, job_memory):
+    """Record action durations and order jobs by them
+
+    Args:
+        env (Environment): program SCons build environment
+        job_memory (int): expected peak memory of one compile in bytes
+    """
+    from SCons.Script import GetOption, SetOption
+
+    path = history_file(env)
+    if _history['path'] != path:
+        _history['path'] = path
+        _history['root'] = env.Dir('#').abspath
+        _history['entries'] = load_history(path)
+        enable_recording(env)
+        max_age = float(env['JOB_HISTORY_DAYS'])
+        add_listener(lambda records: _save_history(records, path, max_age))
+    else:
+        enable_recording(env)
+
+    if GetOption('num_jobs') == 1 and not _jobs_given():
+        jobs = default_num_jobs(job_memory)
+        if jobs > 1:
+            SetOption('num_jobs', jobs)
+            print('Using -j %d (cores and %.1f GiB per job)' %
+                  (jobs, job_memory / float(1 << 30)))
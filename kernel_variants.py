@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""\
+Sunway slave kernel variants
+----------------------------
+
+The Sunway slave kernels (``cslave_source_files``) are compiled with the
+``SW_SLAVE_FLAGS`` of the build type.  ``add_kernel_variants`` declares
+other flag sets of a kernel and a timing harness::
+
+    from kernel_variants import add_kernel_variants
+
+    add_kernel_variants(env, ['spmv_slave.c'],
+                        [('o3', '-msimd -O3'),
+                         ('unroll', '-msimd -O3 -funroll-loops'),
+                         ('align', '-msimd -O3 -faddress_align=64')],
+                        harness=['spmv_bench.c'], args=['case/A.mtx'])
+
+Each variant is compiled into its own object, ``spmv_<variant>_slave.o``
+next to ``spmv_slave.o`` (the ``default`` variant).  The harness sources
+are host C files with a ``main`` calling the kernel; they are linked with
+every variant into ``build/<BUILD_OPTION>/tune``.  ``scons tune`` runs each
+harness ``TUNE_REPEAT`` times with ``TUNE_LAUNCHER`` and takes the best
+time, from a ``time: <seconds>`` line of the output or the wall time.  A
+harness that exits with an error, e.g. on wrong results, removes the
+variant.  The fastest variant wins if it beats ``default`` by
+``TUNE_MARGIN``.
+
+The winners are kept by BUILD_OPTION in ``SW_TUNING_FILE`` (default
+``sw_tuning.json`` in the project root, meant to be committed), as the
+kernels of other INT_TYPE, FLOAT_TYPE or PRECISION differ, and later
+builds of the same BUILD_OPTION compile the kernels with them.  Only the winners are built by
+default, the other variants and the harnesses only for ``tune``.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import subprocess
+
+# declared kernels by (BUILD_OPTION, source path)
+_kernels = {}
+# kernels and tune target of each BUILD_OPTION
+_tunings = {}
+# tuning files read by this run
+_tuning_files = {}
+# the configurations share the machine and the tuning file
+_tuning_lock = threading.Lock()
+
+_time_re = re.compile(r'^\s*time\s*[:=]\s*([0-9.eE+-]+)', re.M | re.I)
+_name_re = re.compile(r'^\w+$')
+
+
+def _source_path(env, path):
+    """Path of a kernel in the source tree"""
+    return env.File(path).srcnode().abspath
+
+
+def add_kernel_variants(env, sources, variants, harness=(), args=(),
+                        libs=(), timeout=600):
+    """Declare flag variants of slave kernels and their timing harness
+
+    The kernels must also be added to cslave_source_files.  Only used
+    with PLATFORM=sw and ATHREAD.
+
+    Args:
+        env (Environment): program SCons build environment
+        sources (list): slave kernel files relative to the SConscript
+        variants (list): (name, flags) pairs replacing SW_SLAVE_FLAGS;
+            'default' uses SW_SLAVE_FLAGS and is always tried first
+        harness (list): host C files of the timing program, relative to the
+            SConscript, without them the kernels are not tuned
+        args (list): command line arguments of the harness
+        libs (list): libraries linked to the harness
+        timeout (float): seconds before a harness run is killed
+
+    Returns:
+        Node: the tune-<BUILD_OPTION> alias, None without ATHREAD
+
+    Raises:
+        UserError: on invalid or duplicate variant names or kernels
+    """
+    from SCons.Errors import UserError
+
+    if env['PLATFORM'] != 'sw' or not env.get('ATHREAD'):
+        return None
+    declared = [('default', None)]
+    for name, flags in variants:
+        if not _name_re.match(name):
+            raise UserError('kernel variant name %r is not a word' % name)
+        if name in dict(declared):
+            raise UserError('kernel variant %s declared twice' % name)
+        declared.append((name, flags))
+
+    option = env['BUILD_OPTION']
+    tuning = _tunings.get(option)
+    if tuning is None:
+        tuning = _tunings[option] = dict(kernels=[], node=None)
+        node = env.Alias('tune-%s' % option, [],
+                         env.Action(_tune_action(tuning),
+                                    'Timing kernel variants of %s' % option))
+        env.AlwaysBuild(node)
+        env.Alias('tune', node)
+        tuning['node'] = node
+
+    here = env.Dir('.').srcnode()
+    root = env.Dir('#').abspath
+    cwd = os.getcwd()
+    for src in sources:
+        path = _source_path(env, os.path.join(cwd, src))
+        if (option, path) in _kernels:
+            raise UserError('kernel variants of %s declared twice' % src)
+        rel = os.path.relpath(path, root).replace(os.sep, '/')
+        kernel = dict(key=rel, variants=declared,
+                      harness=[env.File(h) for h in harness],
+                      args=[str(a) for a in args], libs=list(libs),
+                      timeout=float(timeout), workdir=here.abspath,
+                      tune_dir=os.path.join(root, 'build', option, 'tune',
+                                            os.path.splitext(rel)[0]),
+                      programs={})
+        _kernels[(option, path)] = kernel
+        tuning['kernels'].append(kernel)
+    return tuning['node']
+
+
+def _load_tuning(path):
+    from fast_noop import watch_file
+
+    if path not in _tuning_files:
+        watch_file(path)
+        try:
+            with open(path) as f:
+                _tuning_files[path] = json.load(f)
+        except (IOError, OSError, ValueError):
+            _tuning_files[path] = {}
+    return _tuning_files[path]
+
+
+def _tuning_path(env):
+    return os.path.join(env.Dir('#').abspath, env['SW_TUNING_FILE'])
+
+
+def selected_variant(env, kernel):
+    """Variant of a kernel chosen by the tuning file, 'default' if none
+
+    Args:
+        env (Environment): slave kernel build environment
+        kernel (dict): kernel declared with add_kernel_variants
+
+    Returns:
+        str: the variant name
+    """
+    entry = _load_tuning(_tuning_path(env)).get(
+        env['BUILD_OPTION'], {}).get(kernel['key'])
+    if entry is None or entry.get('variant') == 'default':
+        return 'default'
+    declared = dict(kernel['variants'])
+    name = entry.get('variant')
+    if declared.get(name) != entry.get('flags'):
+        print('Warning: tuned variant %s of %s is no longer declared with '
+              'the same flags, using default until the next tune' %
+              (name, kernel['key']))
+        return 'default'
+    return name
+
+
+def kernel_builder(builder):
+    """Object builder compiling declared kernels with their variants
+
+    Args:
+        builder (Builder): Object builder of the slave sources
+
+    Returns:
+        function: builder called as builder(env, source=...), returning
+            the objects of the selected variants
+    """
+    def build(env, source, **kw):
+        objs = []
+        plain = []
+        for src in env.Flatten([source]):
+            kernel = _kernels.get((env['BUILD_OPTION'],
+                                   _source_path(env, str(src))))
+            if kernel is None:
+                plain.append(src)
+            else:
+                objs += _kernel_objects(env, builder, src, kernel, kw)
+        if plain:
+            objs = builder(env, source=plain, **kw) + objs
+        return objs
+    return build
+
+
+def _exclude_from_default(env, nodes):
+    # still built for tune, but not by the directory they are in
+    for node in nodes:
+        env.Ignore(node.dir, node)
+
+
+def _kernel_objects(env, builder, src, kernel, kw):
+    default = builder(env, source=src, **kw)
+    stem = os.path.splitext(os.path.basename(str(src)))[0]
+    objs = dict(default=default)
+    for name, flags in kernel['variants'][1:]:
+        varenv = env.Override(dict(SW_SLAVE_FLAGS=flags))
+        objs[name] = builder(varenv, source=src, target=os.path.join(
+            default[0].dir.abspath, '%s_%s' % (stem, name)), **kw)
+    selected = selected_variant(env, kernel)
+    for name in objs:
+        if name != selected:
+            _exclude_from_default(env, objs[name])
+    if kernel['harness'] and not kernel['programs']:
+        kernel['programs'] = _harness_programs(env, kernel, objs)
+        env.Depends(_tunings[env['BUILD_OPTION']]['node'],
+                    list(kernel['programs'].values()))
+    return objs[selected]
+
+
+def _harness_programs(env, kernel, objs):
+    """Harness program of each variant"""
+    from build import SW_HOST_CCCOM
+
+    hostenv = env.Override(dict(CCCOM=SW_HOST_CCCOM, OBJSUFFIX='_host.o'))
+    harness = hostenv.Object(kernel['harness'])
+    _exclude_from_default(env, harness)
+    progenv = env.Override(dict(LINK='$CC_HOST',
+                                LINKFLAGS=['$TUNE_LINKFLAGS'],
+                                LIBS=kernel['libs'],
+                                LIBPATH=env['LIBPATH_COMMON']))
+    programs = {}
+    for name, _ in kernel['variants']:
+        program = progenv.Program(
+            target=os.path.join(kernel['tune_dir'], name, 'harness'),
+            source=harness + objs[name])
+        _exclude_from_default(env, program)
+        programs[name] = program[0]
+    return programs
+
+
+def pick_variant(times, order, margin=0.0):
+    """Fastest variant, 'default' unless another one is clearly faster
+
+    Args:
+        times (dict): best time of each variant, None if it failed
+        order (list): variant names in declaration order, ties go to the
+            first
+        margin (float): fraction of the default time another variant must
+            save
+
+    Returns:
+        str: the winning variant, None if all failed
+    """
+    timed = [name for name in order if times.get(name) is not None]
+    if not timed:
+        return None
+    best = min(timed, key=lambda name: times[name])
+    default = times.get('default')
+    if best != 'default' and default is not None and \
+            times[best] > default * (1.0 - margin):
+        return 'default'
+    return best
+
+
+def _time_variant(env, kernel, program, log_path):
+    """Best time of TUNE_REPEAT harness runs, None if a run failed"""
+    command = env['TUNE_LAUNCHER'].split() + [program.abspath] + \
+        kernel['args']
+    best = None
+    with open(log_path, 'w') as log:
+        for _ in range(max(int(env['TUNE_REPEAT']), 1)):
+            start = time.time()
+            try:
+                proc = subprocess.run(
+                    command, cwd=kernel['workdir'], stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    timeout=kernel['timeout'])
+            except subprocess.TimeoutExpired:
+                log.write('killed after %.0f s\n' % kernel['timeout'])
+                return None
+            elapsed = time.time() - start
+            output = proc.stdout.decode('utf-8', 'replace')
+            log.write(output)
+            if proc.returncode != 0:
+                log.write('exit code %d\n' % proc.returncode)
+                return None
+            found = _time_re.findall(output)
+            elapsed = float(found[-1]) if found else elapsed
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _save_tuning(path, build_option, entries):
+    """Merge the entries of build_option into the tuning file"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        data = {}
+    data.setdefault(build_option, {}).update(entries)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _tune_action(tuning):
+    def tune(target, source, env):
+        with _tuning_lock:
+            return _tune(env)
+
+    def _tune(env):
+        margin = float(env['TUNE_MARGIN'])
+        entries = {}
+        failed = 0
+        for kernel in tuning['kernels']:
+            if not kernel['programs']:
+                print('tune: %s has no harness, skipped' % kernel['key'])
+                continue
+            if not os.path.isdir(kernel['tune_dir']):
+                os.makedirs(kernel['tune_dir'])
+            order = [name for name, _ in kernel['variants']]
+            times = {}
+            for name in order:
+                times[name] = _time_variant(
+                    env, kernel, kernel['programs'][name],
+                    os.path.join(kernel['tune_dir'], name + '.log'))
+            winner = pick_variant(times, order, margin)
+            print('tune: %s: %s -> %s' % (
+                kernel['key'],
+                ', '.join('%s %s' % (name, 'failed' if times[name] is None
+                                     else '%.4g s' % times[name])
+                          for name in order),
+                winner or 'all failed, see %s' % kernel['tune_dir']))
+            if winner is None:
+                failed += 1
+                continue
+            entries[kernel['key']] = dict(
+                variant=winner,
+                flags=dict(kernel['variants'])[winner] or
+                env['SW_SLAVE_FLAGS'],
+                times=times,
+                date=time.strftime('%Y-%m-%d %H:%M:%S'))
+        if entries:
+            path = _tuning_path(env)
+            _save_tuning(path, env['BUILD_OPTION'], entries)
+            print('tune: %d kernels written to %s, used from the next build'
+                  % (len(entries), path))
+        return 1 if failed else 0
+
+    return tune
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""\
+Multi-configuration builds
+--------------------------
+
+``CONFIGS=Int32DP,Int64DP,Int32SP`` builds several configurations in one
+SCons process.  A configuration name is a sequence of
+
+* ``Int32``/``Int64`` (INT_TYPE), ``Float32``/``Float64`` (FLOAT_TYPE),
+* ``DP``/``SP`` (PRECISION),
+* ``Opt``/``Debug``/``Prof``/``Perf``/``PGO`` (BUILD_TYPE),
+
+and each configuration gets its own ``BUILD_OPTION`` tree.  Tool detection
+and the lnInclude header index are done once, and all configurations end
+up in one dependency graph, so ``-j`` spans all of them.
+
+Compiles are shared through the object cache: the compile of a source in
+the first configuration runs before the same compile in the others, and
+those take the object from the cache when the preprocessed source and
+the remaining options are identical, e.g. for sources that do not use the
+LABEL/SCALAR macros.  Without ``OBJ_CACHE`` a cache in
+``build/.objcache`` is used for this.
+"""
+
+import os
+import re
+
+_config_tokens = ((re.compile(r'Int(32|64)'), 'INT_TYPE'),
+                  (re.compile(r'Float(32|64)'), 'FLOAT_TYPE'),
+                  (re.compile(r'(DP|SP)'), 'PRECISION'),
+                  (re.compile(r'(Opt|Debug|Prof|Perf|PGO)'), 'BUILD_TYPE'))
+
+# first object of each compile by source and object name
+_first_objects = {}
+
+
+def parse_config(name):
+    """Variables set by a configuration name such as Int64SP
+
+    Raises:
+        UserError: if the name contains anything else
+    """
+    from SCons.Errors import UserError
+
+    values = {}
+    pos = 0
+    while pos < len(name):
+        for regex, key in _config_tokens:
+            m = regex.match(name, pos)
+            if m and key not in values:
+                values[key] = m.group(1)
+                pos = m.end()
+                break
+        else:
+            raise UserError('invalid configuration %s at "%s", expected '
+                            'Int32/Int64, Float32/Float64, DP/SP and '
+                            'Opt/Debug/Prof/Perf/PGO' % (name, name[pos:]))
+    return values
+
+
+def build_configurations(env):
+    """Environments of the configurations listed in CONFIGS
+
+    Yields env itself when CONFIGS is empty.  The SConstruct runs
+    init_dependent_vars, update_compiler_settings and the SConscripts for
+    each of them; the global source lists and components are reset
+    between configurations.
+
+    Args:
+        env (Environment): environment from configure_environment
+    """
+    from build import reset_source_files
+    from components import reset_components
+
+    names = env['CONFIGS'].replace(',', ' ').split()
+    if not names:
+        yield env
+        return
+
+    shared = {}
+    if len(names) > 1 and not env['OBJ_CACHE']:
+        shared = dict(OBJ_CACHE=True,
+                      OBJ_CACHE_DIR=os.path.join(env.Dir('#').abspath,
+                                                 'build', '.objcache'))
+    for name in names:
+        reset_source_files()
+        reset_components()
+        config_env = env.Clone(**parse_config(name))
+        config_env.Replace(CONFIG_NAME=name, **shared)
+        yield config_env
+
+
+def share_objects(env, objs):
+    """Compile objs after the same objects of the first configuration
+
+    The later compiles then find the object in the cache if it is the same
+    in both configurations.
+
+    Args:
+        env (Environment): environment of the compile actions
+        objs (list): object nodes of build_object
+    """
+    if not env.get('CONFIG_NAME') or not env.get('OBJ_CACHE'):
+        return
+    option = env['BUILD_OPTION']
+    for obj in objs:
+        if not obj.sources:
+            continue
+        key = (obj.sources[0].srcnode().get_abspath().replace(option, '@'),
+               obj.get_abspath().replace(option, '@'))
+        first = _first_objects.setdefault(key, obj)
+        if first is not obj:
+            env.Requires(obj, first)
@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""\
+Compile object cache
+--------------------
+
+A content-addressed cache for the objects produced by ``build_object``.
+Compile commands are prefixed with ``$OBJCACHE_LAUNCHER``, which runs this
+module as a compiler launcher: the source is preprocessed with the same
+command line, and the object is looked up by a hash of the preprocessed
+text plus the remaining (non-preprocessor) arguments and the compiler
+binary; precompiled headers given with ``-include-pch``/``-pch-use``,
+the ``.mod``/``.smod`` files of the Fortran modules a source uses and,
+with ``-march=native``/``-xHost``, the host CPU are hashed as well.  The
+cache directory may be shared between ``BUILD_OPTION`` trees and between
+users on the same filesystem.  Every compile writes its statistics to
+its own file in ``stats.d``, so compiles never wait for each other; at
+the end of the build they are merged into ``stats.json`` and the cache is
+trimmed by least recently used entries once it grows beyond
+``OBJ_CACHE_SIZE``.
+
+Usage as a launcher::
+
+    python objcache.py --dir CACHE_DIR -- g++ -c -o a.o a.cpp
+    python objcache.py --dir CACHE_DIR --max-size 5G --stats
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import subprocess
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_VERSION = '1'
+
+_source_suffixes = ('.c', '.cc', '.cpp', '.cxx', '.C', '.f', '.F', '.f90',
+                    '.F90', '.f95', '.F95', '.f03', '.F03', '.f08', '.F08')
+_fortran_suffixes = ('.f', '.F', '.f90', '.F90', '.f95', '.F95', '.f03',
+                     '.F03', '.f08', '.F08')
+
+# Options that only influence preprocessing; their effect is already
+# contained in the preprocessed text, so they are left out of the key.
+_cpp_only_options = ('-D', '-U', '-I', '-J', '-include', '-isystem',
+                     '-iquote', '-idirafter')
+# Options reading a precompiled header (clang, Intel), whose declarations
+# are not in the preprocessed text; the file content goes into the key.
+_pch_options = ('-include-pch', '-pch-use')
+# Compiles that read profile data the key does not cover, or write
+# side outputs (.dwo) the cache cannot restore.
+_uncacheable_options = ('-fprofile-use', '-prof-use', '-gsplit-dwarf')
+# Options tuning the code for the CPU of the compiling host; their
+# objects are keyed by the host CPU as well.
+_native_options = ('-march=native', '-mcpu=native', '-mtune=native',
+                   '-xHost', '-xhost')
+_cpu_fields = ('vendor_id', 'cpu family', 'model', 'model name', 'flags',
+               'CPU implementer', 'CPU architecture', 'CPU variant',
+               'CPU part', 'Features')
+# Dependency-file options, dropped from the preprocessing command.
+_dep_options = ('-MF', '-MT', '-MQ')
+_dep_flags = ('-MD', '-MMD', '-MP')
+# Fortran use statements and the options of the .mod search path; the
+# used .mod files are not in the preprocessed text either.
+_use_re = re.compile(br'(?im)^\s*use(\s*,\s*\w+\s*::|\s*::|\s+)\s*(\w+)')
+_module_dir_options = ('-J', '-I', '-module')
+
+_report_registered = []
+
+
+def parse_size(value):
+    """Convert '500M', '5G', ... into bytes"""
+    value = str(value).strip().upper()
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def _format_size(nbytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if nbytes < 1024.0 or unit == 'GiB':
+            return '%.1f %s' % (nbytes, unit)
+        nbytes /= 1024.0
+
+
+class _Lock(object):
+    """Exclusive lock on the cache bookkeeping (no-op without fcntl)"""
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, 'lock')
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+def _pending_stats(cache_dir):
+    """Paths of the statistics not yet merged into stats.json"""
+    pending_dir = os.path.join(cache_dir, 'stats.d')
+    try:
+        names = os.listdir(pending_dir)
+    except OSError:
+        return []
+    return [os.path.join(pending_dir, name) for name in names
+            if name.endswith('.json')]
+
+
+def _add_stats(stats, path):
+    try:
+        with open(path) as f:
+            delta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+    for k, v in delta.items():
+        stats[k] = stats.get(k, 0) + v
+    return True
+
+
+def read_stats(cache_dir):
+    """Return the statistics dictionary of a cache directory"""
+    stats = dict(hits=0, misses=0, uncacheable=0, size=0)
+    try:
+        with open(os.path.join(cache_dir, 'stats.json')) as f:
+            stats.update(json.load(f))
+    except (IOError, OSError, ValueError):
+        pass
+    for path in _pending_stats(cache_dir):
+        _add_stats(stats, path)
+    return stats
+
+
+def _update_stats(cache_dir, **delta):
+    """Write the statistics of one compile next to the others
+
+    Each compile writes its own file, so the compiles sharing a cache do
+    not wait for each other; merge_stats adds them up at the end of the
+    build.
+    """
+    pending_dir = os.path.join(cache_dir, 'stats.d')
+    try:
+        if not os.path.isdir(pending_dir):
+            os.makedirs(pending_dir)
+        path = os.path.join(pending_dir, '%s.%d.%d' % (
+            socket.gethostname(), os.getpid(), int(time.time() * 1e6)))
+        with open(path, 'w') as f:
+            json.dump(delta, f)
+        os.rename(path, path + '.json')
+    except (IOError, OSError):
+        pass
+
+
+def merge_stats(cache_dir, max_size=None):
+    """Merge the statistics of the compiles and trim the cache
+
+    Args:
+        cache_dir (str): cache directory
+        max_size (int): maximum cache size in bytes, None to not trim
+
+    Returns:
+        dict: the merged statistics
+    """
+    with _Lock(cache_dir):
+        stats = dict(hits=0, misses=0, uncacheable=0, size=0)
+        try:
+            with open(os.path.join(cache_dir, 'stats.json')) as f:
+                stats.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+        merged = [path for path in _pending_stats(cache_dir)
+                  if _add_stats(stats, path)]
+        if max_size is not None and stats['size'] > max_size:
+            stats['size'] = _evict(cache_dir, int(max_size * 0.9))
+        tmp = os.path.join(cache_dir, 'stats.json.%d' % os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(stats, f)
+        os.rename(tmp, os.path.join(cache_dir, 'stats.json'))
+        for path in merged:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return stats
+
+
+def _evict(cache_dir, limit):
+    """Remove least recently used entries until the cache fits in limit"""
+    entries = []
+    for sub in os.listdir(cache_dir):
+        subdir = os.path.join(cache_dir, sub)
+        if len(sub) != 2 or not os.path.isdir(subdir):
+            continue
+        for name in os.listdir(subdir):
+            path = os.path.join(subdir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+def _split_command(args):
+    """Find the output and source of a single-source compile command
+
+    Returns:
+        (output, source) or None if the command is not cacheable
+    """
+    if '-c' not in args:
+        return None
+    output = None
+    sources = []
+    i = 1
+    while i < len(args):
+        a = args[i]
+        if a == '-o' and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+            continue
+        if a.startswith('-o') and len(a) > 2:
+            output = a[2:]
+        elif a in _dep_options or a in _cpp_only_options or \
+                a in _pch_options:
+            i += 2
+            continue
+        elif not a.startswith('-') and a.endswith(_source_suffixes):
+            sources.append(a)
+        i += 1
+    if output is None or len(sources) != 1:
+        return None
+    return output, sources[0]
+
+
+def _preprocess_command(args, output):
+    cmd = []
+    skip = False
+    for a in args:
+        if skip:
+            skip = False
+            continue
+        if a == '-o' or a in _dep_options:
+            skip = True
+            continue
+        if a == '-c' or a in _dep_flags or a == '-o' + output:
+            continue
+        cmd.append(a)
+    return cmd + ['-E']
+
+
+def _key_arguments(args, output, source):
+    key = []
+    skip = False
+    for a in args[1:]:
+        if skip:
+            skip = False
+            continue
+        if a in _cpp_only_options or a in _dep_options or \
+                a in _pch_options or a == '-o':
+            skip = True
+            continue
+        if a.startswith(_cpp_only_options) or a in _dep_flags or \
+                a.startswith(_pch_options):
+            continue
+        if a in (source, '-o' + output):
+            continue
+        key.append(a)
+    return key
+
+
+def _compiler_identity(compiler):
+    path = shutil.which(compiler) or compiler
+    try:
+        st = os.stat(path)
+        return '%s:%d:%d' % (os.path.realpath(path), st.st_size,
+                             int(st.st_mtime))
+    except OSError:
+        return compiler
+
+
+def _defines_fortran_module(text):
+    return re.search(br'(?im)^\s*(module\s+(?!procedure\b)\w+|submodule\s*\()',
+                     text) is not None
+
+
+def _used_fortran_modules(text):
+    """Names of the non-intrinsic modules used by a Fortran source"""
+    names = set()
+    for nature, name in _use_re.findall(text):
+        nature = nature.lower()
+        if b'intrinsic' in nature and b'non_intrinsic' not in nature:
+            continue
+        names.add(name.decode('ascii', 'replace').lower())
+    return sorted(names)
+
+
+def _module_dirs(args):
+    """Directories searched for .mod files, in the compiler's order"""
+    dirs = {'-I': [], '-J': [], '-module': []}
+    for i, a in enumerate(args):
+        if a in _module_dir_options and i + 1 < len(args):
+            dirs[a].append(args[i + 1])
+        elif a.startswith(('-I', '-J')) and len(a) > 2:
+            dirs[a[:2]].append(a[2:])
+    return ['.'] + dirs['-I'] + dirs['-J'] + dirs['-module']
+
+
+def _fortran_module_files(args, text):
+    """(module, files) of the modules used by a Fortran source
+
+    The files are the .mod and .smod files found first on the module
+    search path, none for the modules of the compiler (e.g. omp_lib),
+    which are covered by the compiler identity.
+    """
+    modules = []
+    dirs = _module_dirs(args)
+    for name in _used_fortran_modules(text):
+        files = []
+        for d in dirs:
+            files = [os.path.join(d, name + ext) for ext in ('.mod', '.smod')
+                     if os.path.exists(os.path.join(d, name + ext))]
+            if files:
+                break
+        modules.append((name, files))
+    return modules
+
+
+def _host_cpu():
+    """Model and features of the host CPU, None if unknown"""
+    fields = {}
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                name = name.strip()
+                if name in _cpu_fields and name not in fields:
+                    fields[name] = value.strip()
+    except (IOError, OSError):
+        return None
+    if 'flags' not in fields and 'Features' not in fields:
+        return None
+    return '\n'.join('%s: %s' % item for item in sorted(fields.items()))
+
+
+def _tunes_for_host(args):
+    return any(a in _native_options for a in args)
+
+
+def _pch_files(args):
+    """Precompiled headers read by a compile command"""
+    files = []
+    for i, a in enumerate(args):
+        if a in _pch_options and i + 1 < len(args):
+            files.append(args[i + 1])
+        elif a.startswith(tuple(o + '=' for o in _pch_options)):
+            files.append(a.split('=', 1)[1])
+    return files
+
+
+def cache_key(args, output, source, preprocessed, aliases=()):
+    """Compute the cache key of a compile command
+
+    Compiles tuned for the host CPU (-march=native, -xHost) are keyed by
+    its model and features, so that hosts sharing the cache only get the
+    objects built for their own kind of CPU.
+
+    Raises:
+        IOError: if a precompiled header or a module file of the command
+            cannot be read, or the host CPU of a native compile is unknown
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_VERSION.encode())
+    h.update(_compiler_identity(args[0]).encode())
+    for a in _key_arguments(args, output, source):
+        h.update(b'\0' + a.encode())
+    h.update(b'\0\0')
+    for path in _pch_files(args):
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    if _tunes_for_host(args):
+        cpu = _host_cpu()
+        if cpu is None:
+            raise IOError('CPU of the host unknown')
+        h.update(b'\0' + cpu.encode())
+    if source.endswith(_fortran_suffixes):
+        for name, files in _fortran_module_files(args, preprocessed):
+            h.update(b'\0' + name.encode())
+            for path in files:
+                with open(path, 'rb') as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+    for alias in aliases:
+        if alias:
+            preprocessed = preprocessed.replace(alias.encode(), b'@')
+    h.update(preprocessed)
+    return h.hexdigest()
+
+
+def _depfile(args):
+    """Path given to -MF, None if the compile writes no depfile"""
+    for i, a in enumerate(args):
+        if a == '-MF' and i + 1 < len(args):
+            return args[i + 1]
+        if a.startswith('-MF') and len(a) > 3:
+            return a[3:]
+    return None
+
+
+def _store_depfile(depfile, entry, output, aliases):
+    """Save a depfile with the object path and aliases made generic"""
+    with open(depfile) as f:
+        text = f.read()
+    text = text.replace(output, '@@OUTPUT@@')
+    for i, alias in enumerate(aliases):
+        if alias:
+            text = text.replace(alias, '@@ALIAS%d@@' % i)
+    tmp = '%s.tmp%d' % (entry, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, entry)
+
+
+def _restore_depfile(entry, depfile, output, aliases):
+    with open(entry) as f:
+        text = f.read()
+    text = text.replace('@@OUTPUT@@', output)
+    for i, alias in enumerate(aliases):
+        if alias:
+            text = text.replace('@@ALIAS%d@@' % i, alias)
+    tmp = '%s.tmp%d' % (depfile, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, depfile)
+
+
+def _copy_atomic(src, dest):
+    tmp = '%s.tmp%d' % (dest, os.getpid())
+    shutil.copyfile(src, tmp)
+    os.rename(tmp, dest)
+
+
+def run_cached(cache_dir, args, aliases=()):
+    """Run a compile command through the cache
+
+    Args:
+        cache_dir (str): cache directory
+        args (list): compiler command line
+        aliases (list): strings masked out of the preprocessed text, so
+            that otherwise identical build trees share entries
+
+    Returns:
+        int: exit status of the compile
+    """
+    # a nested launcher (e.g. remote_exec) ends with '--' and only
+    # runs the real compile, preprocessing is always done here
+    launcher = []
+    if '--' in args:
+        sep = args.index('--')
+        launcher, args = args[:sep + 1], args[sep + 1:]
+
+    split = _split_command(args)
+    if split is None:
+        return subprocess.call(launcher + args)
+    output, source = split
+    if any(a.startswith(_uncacheable_options) for a in args):
+        status = subprocess.call(launcher + args)
+        _update_stats(cache_dir, uncacheable=1)
+        return status
+
+    pp = subprocess.Popen(_preprocess_command(args, output),
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+    preprocessed, _ = pp.communicate()
+    if pp.returncode != 0:
+        # let the real compile report the error
+        return subprocess.call(launcher + args)
+    if source.endswith(_fortran_suffixes) and \
+            _defines_fortran_module(preprocessed):
+        # .mod files are a side effect the cache cannot restore
+        status = subprocess.call(launcher + args)
+        _update_stats(cache_dir, uncacheable=1)
+        return status
+
+    try:
+        key = cache_key(args, output, source, preprocessed, aliases)
+    except (IOError, OSError):
+        # a precompiled header or module file is missing or being
+        # rewritten, let the compile report it; or the CPU a native
+        # compile tunes for is unknown
+        status = subprocess.call(launcher + args)
+        _update_stats(cache_dir, uncacheable=1)
+        return status
+    entry = os.path.join(cache_dir, key[:2], key + '.o')
+    # the depfile is an output as well, entries without one are misses
+    depfile = _depfile(args)
+    dep_entry = entry[:-2] + '.d'
+    if os.path.exists(entry) and \
+            (depfile is None or os.path.exists(dep_entry)):
+        try:
+            _copy_atomic(entry, output)
+            os.utime(entry, None)
+            if depfile is not None:
+                _restore_depfile(dep_entry, depfile, output, aliases)
+                os.utime(dep_entry, None)
+            _update_stats(cache_dir, hits=1)
+            return 0
+        except (IOError, OSError):
+            pass
+
+    status = subprocess.call(launcher + args)
+    if status != 0:
+        return status
+    try:
+        entry_dir = os.path.dirname(entry)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir)
+        _copy_atomic(output, entry)
+        size = os.path.getsize(entry)
+        if depfile is not None:
+            _store_depfile(depfile, dep_entry, output, aliases)
+            size += os.path.getsize(dep_entry)
+    except (IOError, OSError):
+        size = 0
+    _update_stats(cache_dir, misses=1, size=size)
+    return status
+
+
+def use_object_cache(env):
+    """Route the compile commands of env through the object cache
+
+    Args:
+        env (Environment): environment used for the compile actions
+    """
+    for com in ('CCCOM', 'CXXCOM', 'F90COM'):
+        value = env.get(com)
+        if value and not str(value).startswith('$OBJCACHE_LAUNCHER'):
+            env[com] = '$OBJCACHE_LAUNCHER ' + value
+
+
+def setup_object_cache(env):
+    """Configure the object cache launcher and end-of-build report
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    import atexit
+    cache_dir = os.path.abspath(os.path.expanduser(env['OBJ_CACHE_DIR']))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    aliases = ''
+    if env.get('OBJ_CACHE_SHARE_VARIANTS', True):
+        aliases = '--alias "%s"' % env['BUILD_OPTION']
+    env['OBJCACHE_LAUNCHER'] = '"%s" "%s" --dir "%s" %s --' % (
+        sys.executable, os.path.abspath(__file__).replace('.pyc', '.py'),
+        cache_dir, aliases)
+
+    if cache_dir not in _report_registered:
+        _report_registered.append(cache_dir)
+        atexit.register(_report, cache_dir, read_stats(cache_dir),
+                        parse_size(env['OBJ_CACHE_SIZE']))
+
+
+def _report(cache_dir, before, max_size):
+    after = merge_stats(cache_dir, max_size)
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    uncacheable = after['uncacheable'] - before['uncacheable']
+    if hits + misses + uncacheable == 0:
+        return
+    ratio = 100.0 * hits / max(hits + misses, 1)
+    print('Object cache: %d hits, %d misses (%.1f%% hit rate), '
+          '%d uncacheable, size %s / %s' %
+          (hits, misses, ratio, uncacheable, _format_size(after['size']),
+           _format_size(max_size)))
+
+
+def main(argv=None):
+    import argparse
+    argv = sys.argv[1:] if argv is None else argv
+    if '--' in argv:
+        sep = argv.index('--')
+        opts, command = argv[:sep], argv[sep + 1:]
+    else:
+        opts, command = argv, []
+    parser = argparse.ArgumentParser(description='Compile object cache')
+    parser.add_argument('--dir', required=True, help='cache directory')
+    parser.add_argument('--max-size', default='5G', help='cache size limit')
+    parser.add_argument('--alias', action='append', default=[],
+                        help='path component masked out of the key')
+    parser.add_argument('--stats', action='store_true',
+                        help='merge and print cache statistics, trim the '
+                             'cache to --max-size')
+    parser.add_argument('--clear', action='store_true',
+                        help='remove all cache entries')
+    args = parser.parse_args(opts)
+
+    # group-writable entries so that the cache can be shared
+    os.umask(0o002)
+    if not os.path.isdir(args.dir):
+        os.makedirs(args.dir)
+    if args.clear:
+        with _Lock(args.dir):
+            _evict(args.dir, 0)
+            for path in _pending_stats(args.dir) + \
+                    [os.path.join(args.dir, 'stats.json')]:
+                if os.path.exists(path):
+                    os.remove(path)
+        return 0
+    if args.stats or not command:
+        stats = merge_stats(args.dir, parse_size(args.max_size))
+        print(json.dumps(stats, indent=2))
+        return 0
+    return run_cached(args.dir, command, args.alias)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
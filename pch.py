@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""\
+Precompiled headers
+-------------------
+
+A precompiled header is built once per ``BUILD_OPTION`` and source type
+(normal C++ or Sunway ``cxxhost``) and shared by every ``build_object``
+call that asks for it.  The compiler specific flags come from the
+``pch_*`` entries of the flag tables in ``compiler.py``.
+"""
+
+import os
+
+_pch_nodes = {}
+
+
+def find_header(env, header):
+    """Locate a header given by name
+
+    Absolute paths are used as given, otherwise the header is searched in
+    the THIRDPARTY_INCS directories below LIB_SRC and in PROJECT_INC_DIR.
+
+    Args:
+        env (Environment): program SCons build environment
+        header (str): header name or path
+
+    Returns:
+        str: path of the header
+    """
+    if os.path.isabs(header):
+        return header
+    candidates = [os.path.join(env['LIB_SRC'], d, header)
+                  for d in env['THIRDPARTY_INCS']]
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return os.path.join(env['PROJECT_INC_DIR'], header)
+
+
+def precompiled_header(env, header, sources_type='none'):
+    """Return the precompiled header node, creating it on first use
+
+    Args:
+        env (Environment): environment whose PCHCOM builds the header
+        header (str): path of the header
+        sources_type (str): 'none' for C++ or 'cxxhost' for Sunway host C++
+
+    Returns:
+        Node: the precompiled header file
+    """
+    from SCons.Builder import Builder
+    from SCons.Action import Action
+    from SCons.Tool import SourceFileScanner
+
+    header = env.File(header)
+    key = (env['BUILD_OPTION'], header.abspath, sources_type)
+    if key not in _pch_nodes:
+        pch_dir = os.path.join(env.Dir('#').abspath, 'build',
+                               env['BUILD_OPTION'], 'pch', sources_type)
+        # The header is precompiled through a forwarding header next to
+        # the PCH, so that "-include $PCH_DIR/$PCH_NAME" finds the PCH
+        # while plain preprocessing still reaches the real header.
+        stub = env.Textfile(target=os.path.join(pch_dir, header.name),
+                            source=['#include "%s"' % header.abspath, ''])
+        env.Depends(stub, header)
+        target = os.path.join(pch_dir, header.name + env['PCH_SUFFIX'])
+        builder = Builder(action=Action('$PCHCOM', '$PCHCOMSTR'),
+                          source_scanner=SourceFileScanner)
+        _pch_nodes[key] = builder(env, target=target, source=stub,
+                                  PCHFLAGS='')[0]
+    return _pch_nodes[key]
+
+
+def use_precompiled_header(env, objs, header, sources_type='none'):
+    """Compile objs with a precompiled header
+
+    Args:
+        env (Environment): environment of the compile actions
+        objs (list): object nodes to be compiled with the header
+        header (str): header name or path
+        sources_type (str): 'none' for C++ or 'cxxhost' for Sunway host C++
+    """
+    header = find_header(env, header)
+    node = precompiled_header(env, header, sources_type)
+    env['PCH_FILE'] = node.abspath
+    env['PCH_DIR'] = os.path.dirname(node.abspath)
+    env['PCH_NAME'] = os.path.basename(header)
+    env['PCHFLAGS'] = '$PCH_USE_FLAGS'
+    env.Depends(objs, node)
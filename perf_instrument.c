@@ -0,0 +1,272 @@
+/*
+ * Function timing collector of PERF_INSTRUMENT, see perf_instrument.py
+ *
+ * Code compiled with -finstrument-functions calls __cyg_profile_func_enter
+ * and __cyg_profile_func_exit around every function.  The collector counts
+ * the calls of each function and sums the time spent in it (total) and in
+ * it without its callees (self), with one table per thread.  At exit the
+ * tables are merged and written to $AMD_PROF_DIR/amd_prof.<rank>.txt
+ * (current directory by default), sorted by self time.  The rank is taken
+ * from the environment of the MPI launcher, the process id is used when
+ * there is none.
+ *
+ * Symbols are resolved with dladdr, which needs -rdynamic; for functions
+ * without a dynamic symbol use "addr2line -f -e <object> <offset>".
+ * total includes recursive calls more than once.
+ */
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#define NOINST __attribute__((no_instrument_function))
+#define MAX_DEPTH 4096
+#define INITIAL_SIZE 1024
+
+struct entry {
+    void *fn;
+    unsigned long long calls;
+    double total;
+    double self;
+};
+
+struct frame {
+    void *fn;
+    double start;
+    double children;
+};
+
+struct table {
+    struct entry *entries;
+    size_t size;
+    size_t used;
+    int depth;
+    struct frame stack[MAX_DEPTH];
+    struct table *next;
+};
+
+static struct table *tables;
+static __thread struct table *current;
+static __thread int disabled;
+static double start_time;
+
+static const char *rank_vars[] = {"PMI_RANK", "OMPI_COMM_WORLD_RANK",
+                                  "PMIX_RANK", "MV2_COMM_WORLD_RANK",
+                                  "SLURM_PROCID", NULL};
+
+NOINST static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + 1e-9 * ts.tv_nsec;
+}
+
+NOINST static size_t slot(void *fn, size_t size)
+{
+    unsigned long long h = (unsigned long long)(size_t)fn >> 4;
+    return (size_t)(h * 11400714819323198485ull >> 17) & (size - 1);
+}
+
+NOINST static struct entry *lookup(struct table *t, void *fn)
+{
+    size_t i;
+
+    if (10 * (t->used + 1) > 7 * t->size) {
+        struct entry *old = t->entries;
+        size_t old_size = t->size, j;
+        struct entry *grown = calloc(2 * old_size, sizeof(struct entry));
+        if (grown == NULL)
+            return NULL;
+        t->entries = grown;
+        t->size = 2 * old_size;
+        for (j = 0; j < old_size; j++) {
+            if (old[j].fn == NULL)
+                continue;
+            i = slot(old[j].fn, t->size);
+            while (t->entries[i].fn != NULL)
+                i = (i + 1) & (t->size - 1);
+            t->entries[i] = old[j];
+        }
+        free(old);
+    }
+    i = slot(fn, t->size);
+    while (t->entries[i].fn != NULL && t->entries[i].fn != fn)
+        i = (i + 1) & (t->size - 1);
+    if (t->entries[i].fn == NULL) {
+        t->entries[i].fn = fn;
+        t->used++;
+    }
+    return &t->entries[i];
+}
+
+NOINST static struct table *new_table(void)
+{
+    struct table *t = calloc(1, sizeof(struct table));
+
+    if (t != NULL) {
+        t->size = INITIAL_SIZE;
+        t->entries = calloc(t->size, sizeof(struct entry));
+    }
+    if (t == NULL || t->entries == NULL) {
+        free(t);
+        disabled = 1;
+        return NULL;
+    }
+    if (start_time == 0.0)
+        start_time = now();
+    t->next = __atomic_load_n(&tables, __ATOMIC_ACQUIRE);
+    while (!__atomic_compare_exchange_n(&tables, &t->next, t, 1,
+                                        __ATOMIC_RELEASE, __ATOMIC_ACQUIRE))
+        ;
+    current = t;
+    return t;
+}
+
+NOINST void __cyg_profile_func_enter(void *fn, void *site)
+{
+    struct table *t = current;
+    (void)site;
+
+    if (t == NULL) {
+        if (disabled || (t = new_table()) == NULL)
+            return;
+    }
+    if (t->depth < MAX_DEPTH) {
+        struct frame *f = &t->stack[t->depth];
+        f->fn = fn;
+        f->children = 0.0;
+        f->start = now();
+    }
+    t->depth++;
+}
+
+NOINST static void leave(struct table *t, double end)
+{
+    struct frame *f;
+    struct entry *e;
+    double elapsed;
+
+    t->depth--;
+    if (t->depth >= MAX_DEPTH)
+        return;
+    f = &t->stack[t->depth];
+    elapsed = end - f->start;
+    e = lookup(t, f->fn);
+    if (e != NULL) {
+        e->calls++;
+        e->total += elapsed;
+        e->self += elapsed - f->children;
+    }
+    if (t->depth > 0 && t->depth <= MAX_DEPTH)
+        t->stack[t->depth - 1].children += elapsed;
+}
+
+NOINST void __cyg_profile_func_exit(void *fn, void *site)
+{
+    struct table *t = current;
+    double end = now();
+    (void)fn;
+    (void)site;
+
+    if (t != NULL && t->depth > 0)
+        leave(t, end);
+}
+
+NOINST static int by_self(const void *a, const void *b)
+{
+    const struct entry *x = a, *y = b;
+    return (x->self < y->self) - (x->self > y->self);
+}
+
+NOINST static void report_name(char *name, size_t size)
+{
+    const char *dir = getenv("AMD_PROF_DIR");
+    const char *rank = NULL;
+    int i;
+
+    for (i = 0; rank_vars[i] != NULL && rank == NULL; i++)
+        rank = getenv(rank_vars[i]);
+    if (dir == NULL || *dir == '\0')
+        dir = ".";
+    if (rank != NULL)
+        snprintf(name, size, "%s/amd_prof.%s.txt", dir, rank);
+    else
+        snprintf(name, size, "%s/amd_prof.pid%ld.txt", dir, (long)getpid());
+}
+
+NOINST static void write_report(void)
+{
+    struct table merged, *t;
+    struct entry *entries;
+    double end = now();
+    char name[4096];
+    size_t i, n = 0;
+    FILE *out;
+
+    /* functions still running, e.g. main when exit is called */
+    if (current != NULL) {
+        while (current->depth > 0)
+            leave(current, end);
+    }
+    memset(&merged, 0, sizeof(merged));
+    merged.size = INITIAL_SIZE;
+    merged.entries = calloc(merged.size, sizeof(struct entry));
+    if (merged.entries == NULL)
+        return;
+    for (t = __atomic_load_n(&tables, __ATOMIC_ACQUIRE); t; t = t->next) {
+        for (i = 0; i < t->size; i++) {
+            struct entry *e;
+            if (t->entries[i].fn == NULL)
+                continue;
+            e = lookup(&merged, t->entries[i].fn);
+            if (e == NULL)
+                continue;
+            e->calls += t->entries[i].calls;
+            e->total += t->entries[i].total;
+            e->self += t->entries[i].self;
+        }
+    }
+    entries = merged.entries;
+    for (i = 0; i < merged.size; i++) {
+        if (merged.entries[i].fn != NULL)
+            entries[n++] = merged.entries[i];
+    }
+    qsort(entries, n, sizeof(struct entry), by_self);
+
+    report_name(name, sizeof(name));
+    out = fopen(name, "w");
+    if (out == NULL) {
+        free(merged.entries);
+        return;
+    }
+    fprintf(out, "# pid %ld, %.6f s from start to exit\n", (long)getpid(),
+            end - start_time);
+    fprintf(out, "# %14s %14s %14s  %s\n", "calls", "total (s)", "self (s)",
+            "function  object+offset");
+    for (i = 0; i < n; i++) {
+        Dl_info info;
+        const char *symbol = "?", *object = "?";
+        unsigned long offset = (unsigned long)(size_t)entries[i].fn;
+        if (dladdr(entries[i].fn, &info)) {
+            if (info.dli_sname != NULL)
+                symbol = info.dli_sname;
+            if (info.dli_fname != NULL)
+                object = info.dli_fname;
+            offset -= (unsigned long)(size_t)info.dli_fbase;
+        }
+        fprintf(out, "%16llu %14.6f %14.6f  %s  %s+0x%lx\n", entries[i].calls,
+                entries[i].total, entries[i].self, symbol, object, offset);
+    }
+    fclose(out);
+    free(merged.entries);
+}
+
+NOINST __attribute__((constructor)) static void start_collector(void)
+{
+    if (start_time == 0.0)
+        start_time = now();
+    atexit(write_report);
+}
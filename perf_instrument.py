@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""\
+Function instrumentation
+------------------------
+
+``PERF_INSTRUMENT=1`` compiles the C, C++ and Fortran sources with
+``-finstrument-functions`` and links every application built by
+``build_app`` with ``libamd_prof.a``.  The library is compiled from
+``perf_instrument.c`` into ``build/<BUILD_OPTION>/amd_prof`` and installed
+next to the project libraries.  Each process writes the call count,
+total and self time of every instrumented function to
+``amd_prof.<rank>.txt`` at exit, in the directory given by the
+``AMD_PROF_DIR`` environment variable of the run.
+
+Meant for ``BUILD_TYPE=Perf``, where no sampling profiler is available
+(Sunway).  The Sunway slave and host kernels are not instrumented.
+"""
+
+import os
+
+COLLECTOR_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'perf_instrument.c')
+
+# collector library of each BUILD_OPTION
+_collectors = {}
+
+
+def setup_perf_instrument(env, cflags):
+    """Add the instrumentation flags to env
+
+    Args:
+        env (Environment): program SCons build environment
+        cflags (dict): flag table of the compiler
+
+    Raises:
+        UserError: if the compiler or platform cannot instrument functions
+    """
+    from SCons.Errors import UserError
+
+    if cflags['instrument'] is None or env['PLATFORM'] == 'windows':
+        raise UserError('%s cannot instrument functions, build with '
+                        'PERF_INSTRUMENT=0' % env['CXX'])
+    # dladdr of the collector only finds exported symbols
+    env.Replace(PERF_INSTRUMENT_FLAGS=cflags['instrument'].split(),
+                PERF_INSTRUMENT_LIBS=['dl'])
+    env.Append(CCFLAGS=env['PERF_INSTRUMENT_FLAGS'],
+               LINKFLAGS=['-rdynamic'])
+
+
+def collector_library(env):
+    """Library node of the collector, built and installed on first use
+
+    Args:
+        env (Environment): program SCons build environment
+
+    Returns:
+        list: the library to add to LIBS, empty without PERF_INSTRUMENT
+    """
+    from build import _install
+
+    if not env.get('PERF_INSTRUMENT'):
+        return []
+    key = env['BUILD_OPTION']
+    if key not in _collectors:
+        flags = env['PERF_INSTRUMENT_FLAGS']
+        # the collector itself must not call the hooks
+        colenv = env.Override(dict(
+            CCFLAGS=[f for f in env['CCFLAGS'] if f not in flags]))
+        build_dir = os.path.join(env.Dir('#').abspath, 'build', key,
+                                 'amd_prof')
+        obj = colenv.StaticObject(
+            target=os.path.join(build_dir, 'perf_instrument'),
+            source=COLLECTOR_SOURCE)
+        lib = colenv.StaticLibrary(target=os.path.join(build_dir, 'amd_prof'),
+                                   source=obj)
+        colenv.Alias('install', env['LIB_PLATFORM_INSTALL'])
+        _install(colenv, env['LIB_PLATFORM_INSTALL'], lib)
+        _collectors[key] = lib
+    return _collectors[key]
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""\
+Profile-guided optimisation
+---------------------------
+
+``BUILD_TYPE=PGO`` builds in two phases selected by ``PGO_PHASE``:
+
+* ``generate`` builds instrumented objects and binaries, and the
+  ``pgo-train`` alias clears old profiles and runs ``PGO_TRAIN_CMD``
+  (for example ``mpirun -np 4 install/.../bin/solver case``), for each
+  configuration of ``CONFIGS`` (``pgo-train-<BUILD_OPTION>`` for one);
+* ``use`` rebuilds the same targets with the collected profiles.
+
+Both phases share ``BUILD_OPTION`` and profiles are kept in
+``build/<BUILD_OPTION>/pgo``, the state of each configuration is kept
+apart.  Profiles written by several MPI ranks are
+merged by the compiler runtime (gcc), by ``llvm-profdata`` (clang) or by
+``profmerge`` (intel) before the ``use`` phase compiles.  Sources whose
+content changed since the instrumented build are compiled without the
+profile, and all objects are rebuilt when the profiles change.
+
+Run the whole pipeline in the project directory with::
+
+    python /path/to/amd_scons/pgo.py [scons options and variables]
+"""
+
+import os
+import sys
+import json
+import atexit
+import fnmatch
+import hashlib
+import subprocess
+
+MANIFEST_NAME = 'manifest.json'
+
+# profile node, trained and built sources of each BUILD_OPTION
+_pgo = {}
+
+
+def _state(env):
+    option = env['BUILD_OPTION']
+    if option not in _pgo:
+        _pgo[option] = dict(profile=None, trained=None, built={})
+    return _pgo[option]
+
+
+def _source_key(env, source):
+    """Path relative to the project and content hash of a source
+
+    Returns (None, None) for generated sources.
+    """
+    node = env.File(source).srcnode()
+    try:
+        with open(node.abspath, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None, None
+    return os.path.relpath(node.abspath, env.Dir('#').abspath), digest
+
+
+def _profile_files(profile_dir, pattern):
+    found = []
+    for root, dirs, files in os.walk(profile_dir):
+        found.extend(os.path.join(root, f)
+                     for f in fnmatch.filter(files, pattern))
+    return sorted(found)
+
+
+def _clear_profiles(target, source, env):
+    """Remove the profiles of a previous training run"""
+    for pattern in (env['PGO_RAW'], env['PGO_DATA']):
+        if pattern:
+            for path in _profile_files(env['PGO_PROFILE_DIR'], pattern):
+                os.remove(path)
+    return 0
+
+
+def _train(target, source, env):
+    command = env.subst('$PGO_TRAIN_CMD')
+    if not command:
+        print('Error: set PGO_TRAIN_CMD to the training command')
+        return 1
+    print(command)
+    return subprocess.call(command, shell=True, env=env['ENV'],
+                           cwd=env.Dir('#').abspath)
+
+
+def _save_manifest(path, state):
+    from SCons.Script import GetBuildFailures
+
+    if GetBuildFailures() or not state['built']:
+        return
+    try:
+        with open(path) as f:
+            sources = json.load(f)
+    except (IOError, OSError, ValueError):
+        sources = {}
+    sources.update(state['built'])
+    with open(path, 'w') as f:
+        json.dump(sources, f, indent=1, sort_keys=True)
+
+
+def _use_flags(env, cflags):
+    """Flags of the use phase, with pgo_quiet if the compilers accept it"""
+    from compiler_probe import check_flags
+
+    flags = cflags['pgo_use']
+    quiet = cflags.get('pgo_quiet')
+    # gcc ignores an unknown -Wno- option unless it warns about something
+    # else, which -Werror turns into an error; the -W form is rejected
+    if quiet and env['COMPILER_PROBE'] and \
+            check_flags(env, quiet.replace('-Wno-', '-W')):
+        flags += ' ' + quiet
+    return flags
+
+
+def setup_pgo(env, cflags):
+    """Add the flags of the current PGO phase
+
+    Args:
+        env (Environment): program SCons build environment
+        cflags (dict): flag table of the compiler family
+    """
+    from SCons.Action import Action
+
+    state = _state(env)
+    profile_dir = os.path.join(env.Dir('#').abspath, 'build',
+                               env['BUILD_OPTION'], 'pgo')
+    manifest = os.path.join(profile_dir, MANIFEST_NAME)
+    env.Replace(PGO_PROFILE_DIR=profile_dir,
+                PGO_RAW=cflags['pgo_raw'],
+                PGO_DATA=cflags['pgo_data'],
+                PGO_MERGE=cflags['pgo_merge'],
+                PGOFLAGS='')
+    env.Append(CCFLAGS=['$PGOFLAGS'])
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+
+    if env['PGO_PHASE'] == 'generate':
+        env['PGOFLAGS'] = cflags['pgo_gen']
+        env.Append(LINKFLAGS=['$PGOFLAGS'])
+        train = env.Alias('pgo-train-%s' % env['BUILD_OPTION'], [], [
+            Action(_clear_profiles, 'Clearing profiles in $PGO_PROFILE_DIR'),
+            Action(_train, None)
+        ])
+        env.AlwaysBuild(train)
+        env.Alias('pgo-train', train)
+        atexit.register(_save_manifest, manifest, state)
+        return
+
+    raw = _profile_files(profile_dir, cflags['pgo_raw'])
+    if not raw:
+        print('Warning: no profiles in %s, building without PGO. '
+              'Run the generate phase and pgo-train first.' % profile_dir)
+        return
+    try:
+        with open(manifest) as f:
+            state['trained'] = json.load(f)
+    except (IOError, OSError, ValueError):
+        state['trained'] = {}
+
+    env['PGOFLAGS'] = _use_flags(env, cflags)
+    if cflags['pgo_data']:
+        state['profile'] = env.Command(
+            os.path.join(profile_dir, cflags['pgo_data']), raw,
+            Action('$PGO_MERGE', 'Merging profiles into $TARGET'))
+    else:
+        # profiles are used in place, rebuild when any of them changes
+        signature = ['%s %d %d' % (p, os.path.getsize(p),
+                                   os.path.getmtime(p)) for p in raw]
+        state['profile'] = env.Value('\n'.join(signature))
+
+
+def pgo_objects(env, builder, sources):
+    """Compile sources according to the PGO phase of env
+
+    Args:
+        env (Environment): environment of the compile actions
+        builder (Builder): Object builder used by build_object
+        sources (list): sources passed to build_object
+
+    Returns:
+        list: object nodes
+    """
+    state = _state(env)
+    if env['PGO_PHASE'] == 'generate':
+        for src in sources:
+            key, digest = _source_key(env, src)
+            if key is not None:
+                state['built'][key] = digest
+        return builder(env, source=sources)
+
+    if state['profile'] is None:
+        return builder(env, source=sources)
+
+    objs = []
+    for src in sources:
+        key, digest = _source_key(env, src)
+        if key is not None and state['trained'].get(key) != digest:
+            print('Warning: %s changed since the PGO training, '
+                  'compiled without profile' % key)
+            objs += builder(env, source=src, PGOFLAGS='')
+        else:
+            objs += builder(env, source=src)
+    env.Depends(objs, state['profile'])
+    return objs
+
+
+def main(argv=None):
+    """Build instrumented, train and rebuild with the profiles"""
+    argv = sys.argv[1:] if argv is None else argv
+    scons = [os.environ.get('SCONS', 'scons'), 'BUILD_TYPE=PGO']
+    steps = (['PGO_PHASE=generate'],
+             ['PGO_PHASE=generate', 'pgo-train'],
+             ['PGO_PHASE=use'])
+    for step in steps:
+        command = scons + argv + step
+        print(' '.join(command))
+        sys.stdout.flush()
+        status = subprocess.call(command)
+        if status != 0:
+            return status
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""\
+Distributed compilation
+-----------------------
+
+Sends the compile actions of ``build_object`` to a pool of worker
+processes on other build nodes.  Workers and clients must see the same
+filesystem paths and the same toolchain; a worker only runs the command
+line in the given directory and returns its output.  Compiles fall back
+to local execution when no worker is reachable, or when all are still
+busy after ``REMOTE_BUSY_WAIT`` seconds.  Linking always stays local, and
+so do the source types listed in ``REMOTE_LOCAL`` (by default the Sunway
+``cslave`` sources).
+
+Start a worker on each compute node (or several on localhost to test)::
+
+    export REMOTE_TOKEN=<secret>
+    python remote_exec.py worker --host 0.0.0.0 --port 7100 --jobs 32
+
+and build with ``scons REMOTE_WORKERS=node1:7100,node2:7100 -j 256`` and
+the same ``REMOTE_TOKEN`` in the environment.
+
+The protocol is a 4-byte big-endian length followed by a JSON document in
+each direction.  Workers execute arbitrary commands; bind them to a
+trusted network.  A worker without ``REMOTE_TOKEN`` only listens on the
+loopback interface.  The token is only passed through the environment,
+never on a command line.
+"""
+
+import os
+import sys
+import hmac
+import json
+import random
+import socket
+import struct
+import subprocess
+import threading
+import time
+import ipaddress
+
+PROTOCOL_VERSION = 1
+
+
+def _send(sock, data):
+    payload = json.dumps(data).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise IOError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    size = struct.unpack('>I', _recv_exact(sock, 4))[0]
+    return json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+
+def _is_loopback(host):
+    """Whether all addresses of host are loopback addresses"""
+    try:
+        infos = socket.getaddrinfo(host or None, 0, 0, socket.SOCK_STREAM,
+                                   0, socket.AI_PASSIVE)
+    except socket.gaierror:
+        return False
+    for info in infos:
+        address = info[4][0].split('%', 1)[0]
+        if not ipaddress.ip_address(address).is_loopback:
+            return False
+    return bool(infos)
+
+
+def _token_matches(sent, token):
+    return hmac.compare_digest(str(sent).encode('utf-8'),
+                               token.encode('utf-8'))
+
+
+def serve(host, port, jobs, token=''):
+    """Run a compile worker until interrupted
+
+    Args:
+        host (str): address to bind
+        port (int): port to listen on
+        jobs (int): number of commands run at the same time
+        token (str): shared secret clients must send
+
+    Raises:
+        ValueError: if host is not a loopback address and token is empty
+    """
+    try:
+        import socketserver
+    except ImportError:
+        import SocketServer as socketserver
+
+    if not token and not _is_loopback(host):
+        raise ValueError('refusing to run commands from %s without '
+                         'REMOTE_TOKEN, set it or bind to 127.0.0.1' %
+                         (host or 'all interfaces'))
+    slots = threading.Semaphore(jobs)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                request = _recv(self.request)
+            except (IOError, ValueError, struct.error):
+                return
+            if request.get('version') != PROTOCOL_VERSION or \
+                    not _token_matches(request.get('token', ''), token):
+                _send(self.request, dict(status='refused'))
+                return
+            if not slots.acquire(False):
+                _send(self.request, dict(status='busy'))
+                return
+            try:
+                _send(self.request, dict(status='accepted'))
+                proc = subprocess.Popen(request['args'],
+                                        cwd=request['cwd'],
+                                        env=request.get('env') or None,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+                out, err = proc.communicate()
+                _send(self.request,
+                      dict(status='done',
+                           returncode=proc.returncode,
+                           stdout=out.decode('utf-8', 'replace'),
+                           stderr=err.decode('utf-8', 'replace')))
+            except (IOError, OSError) as e:
+                try:
+                    _send(self.request, dict(status='error', message=str(e)))
+                except (IOError, OSError):
+                    pass
+            finally:
+                slots.release()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server((host, port), Handler)
+    # port 0 binds a free port, print the one actually used
+    print('compile worker on %s:%d with %d slots' %
+          (host, server.server_address[1], jobs))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _parse_workers(workers):
+    result = []
+    for w in workers.replace(';', ',').split(','):
+        w = w.strip()
+        if not w:
+            continue
+        host, _, port = w.rpartition(':')
+        result.append((host or 'localhost', int(port)))
+    return result
+
+
+def run_remote(workers, args, token='', timeout=5.0, busy_wait=5.0):
+    """Run a command on the first worker with a free slot
+
+    Waits up to busy_wait seconds while all reachable workers are busy.
+
+    Args:
+        workers (list): (host, port) tuples
+        args (list): command line
+        token (str): shared secret
+        timeout (float): connect timeout in seconds
+        busy_wait (float): seconds to wait for a free slot
+
+    Returns:
+        int or None: exit status, None if no worker could be reached or
+            none had a free slot in time
+    """
+    env = dict(os.environ)
+    env.pop('REMOTE_TOKEN', None)
+    request = dict(version=PROTOCOL_VERSION,
+                   token=token,
+                   cwd=os.getcwd(),
+                   args=args,
+                   env=env)
+    workers = list(workers)
+    deadline = time.time() + busy_wait
+    delay = 0.05
+    while workers:
+        random.shuffle(workers)
+        reachable = []
+        for host, port in workers:
+            try:
+                sock = socket.create_connection((host, port), timeout)
+            except (IOError, OSError):
+                continue
+            try:
+                _send(sock, request)
+                reply = _recv(sock)
+                if reply.get('status') == 'busy':
+                    reachable.append((host, port))
+                if reply.get('status') != 'accepted':
+                    continue
+                # compiles may take long, wait without timeout
+                sock.settimeout(None)
+                reply = _recv(sock)
+            except (IOError, OSError, ValueError, struct.error):
+                continue
+            finally:
+                sock.close()
+            if reply.get('status') != 'done':
+                continue
+            sys.stdout.write(reply['stdout'])
+            sys.stderr.write(reply['stderr'])
+            return reply['returncode']
+        workers = reachable
+        if not workers or time.time() + delay > deadline:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+    return None
+
+
+def use_remote_exec(env, sources_type='none'):
+    """Route the compile commands of env through the remote launcher
+
+    Args:
+        env (Environment): environment used for the compile actions
+        sources_type (str): build_object source type, types listed in
+            REMOTE_LOCAL stay local
+    """
+    if sources_type in env['REMOTE_LOCAL'].replace(',', ' ').split():
+        return
+    for com in ('CCCOM', 'CXXCOM', 'F90COM'):
+        value = env.get(com)
+        if value and '$REMOTE_LAUNCHER' not in str(value):
+            env[com] = '$REMOTE_LAUNCHER ' + value
+
+
+def setup_remote_exec(env):
+    """Configure the remote compile launcher
+
+    Args:
+        env (Environment): program SCons build environment
+    """
+    env['REMOTE_LAUNCHER'] = \
+        '"%s" "%s" submit --workers "%s" --busy-wait %s --' % (
+            sys.executable, os.path.abspath(__file__).replace('.pyc', '.py'),
+            env['REMOTE_WORKERS'], float(env['REMOTE_BUSY_WAIT']))
+    if env['REMOTE_TOKEN']:
+        # through the environment, so that it stays out of the build log,
+        # ps, the trace and the object cache key
+        env['ENV'] = dict(env['ENV'], REMOTE_TOKEN=env['REMOTE_TOKEN'])
+
+
+def main(argv=None):
+    import argparse
+    argv = sys.argv[1:] if argv is None else argv
+    command = []
+    if '--' in argv:
+        sep = argv.index('--')
+        argv, command = argv[:sep], argv[sep + 1:]
+
+    parser = argparse.ArgumentParser(description='Distributed compilation')
+    sub = parser.add_subparsers(dest='mode')
+    worker = sub.add_parser('worker', help='run a compile worker')
+    worker.add_argument('--host', default='127.0.0.1')
+    worker.add_argument('--port', type=int, default=7100)
+    worker.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    submit = sub.add_parser('submit', help='run a command on a worker')
+    submit.add_argument('--workers', required=True,
+                        help='comma separated host:port list')
+    submit.add_argument('--timeout', type=float, default=5.0)
+    submit.add_argument('--busy-wait', type=float, default=5.0,
+                        help='seconds to wait for a free worker')
+    args = parser.parse_args(argv)
+    token = os.environ.get('REMOTE_TOKEN', '')
+
+    if args.mode == 'worker':
+        try:
+            serve(args.host, args.port, args.jobs, token)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    if args.mode != 'submit' or not command:
+        parser.print_help()
+        return 2
+    status = run_remote(_parse_workers(args.workers), command, token,
+                        args.timeout, args.busy_wait)
+    if status is None:
+        # no worker available, compile here
+        status = subprocess.call(command)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
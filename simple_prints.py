@@ -21,12 +21,15 @@ def simple_prints(env):
 
     #If the output is not a terminal, remove the colors
     if not sys.stdout.isatty():
-        for key, value in colors.iteritems():
+        for key, value in colors.items():
             colors[key] = ''
 
     compile_source_message = '%sCompiling %s==> %s$SOURCE%s' % \
       (colors['blue'], colors['purple'], colors['yellow'], colors['end'])
 
+    precompile_header_message = '%sPrecompiling %s==> %s$SOURCE%s' % \
+      (colors['blue'], colors['purple'], colors['yellow'], colors['end'])
+
     compile_shared_source_message = '%sCompiling shared %s==> %s$SOURCE%s' % \
       (colors['blue'], colors['purple'], colors['yellow'], colors['end'])
 
@@ -51,6 +54,7 @@ def simple_prints(env):
     env.Append(CXXCOMSTR=compile_source_message,
                CCCOMSTR=compile_source_message,
                F90COMSTR=compile_source_message,
+               PCHCOMSTR=precompile_header_message,
                SHCCCOMSTR=compile_shared_source_message,
                SHCXXCOMSTR=compile_shared_source_message,
                SHF90COMSTR=compile_shared_source_message,
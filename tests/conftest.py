@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""\
+Test helpers
+------------
+
+The modules are imported from the amd_scons directory, the build tests
+generate a small project with ``benchmarks/build_suite.py`` and build it
+with the fake toolchain of ``benchmarks/fake_compiler.py``.
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+AMD_SCONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(AMD_SCONS_DIR, 'benchmarks')
+for _path in (AMD_SCONS_DIR, BENCHMARKS_DIR):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+
+def _scons_available():
+    try:
+        import SCons.Script  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Project(object):
+    """Generated project built with the fake toolchain"""
+
+    def __init__(self, root, bin_dir):
+        self.root = root
+        self.env = dict(os.environ, AMD_SCONS_DIR=AMD_SCONS_DIR,
+                        PATH=bin_dir + os.pathsep + os.environ.get('PATH',
+                                                                   ''))
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def scons(self, *args, **kw):
+        """Run SCons in the project, returns the completed process"""
+        command = [sys.executable, '-c',
+                   'import sys, SCons.Script; sys.argv[0] = "scons"; '
+                   'SCons.Script.main()'] + list(args)
+        proc = subprocess.run(command, cwd=self.root,
+                              env=dict(self.env, **kw.pop('env', {})),
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, **kw)
+        proc.output = proc.stdout.decode('utf-8', 'replace')
+        return proc
+
+
+@pytest.fixture
+def project(tmp_path):
+    """Small generated project, see build_suite.generate_project"""
+    if not _scons_available():
+        pytest.skip('SCons is not importable')
+    from build_suite import generate_project
+    from fake_compiler import install_fake_toolchain
+
+    bin_dir = str(tmp_path / 'bin')
+    install_fake_toolchain(bin_dir)
+    root = str(tmp_path / 'project')
+    generate_project(root, components=2, sources=2, fanout=2, depth=1,
+                     modules=1, apps=1)
+    return Project(root, bin_dir)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+def test_returned_environment_is_a_clone(project):
+    path = project.path('src', 'SConscript')
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace('build_lib(env,', 'libenv = build_lib(env,') +
+                "libenv['CCFLAGS'].append('-DLEAKED_IN_PLACE')\n"
+                "libenv.Append(CCFLAGS=['-DLEAKED'], LIBS=['leaked'])\n")
+    proc = project.scons()
+    assert proc.returncode == 0, proc.output
+    app = [line for line in proc.output.splitlines()
+           if re.match(r'g\+\+ -o \S*/app00(\.o)? ', line)]
+    assert len(app) == 2, proc.output
+    assert not any('LEAKED' in line or 'leaked' in line for line in app)
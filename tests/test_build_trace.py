@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import json
+
+
+def _events(project, *args):
+    proc = project.scons('-j2', 'BUILD_TRACE=trace.json', *args)
+    assert proc.returncode == 0, proc.output
+    with open(project.path('trace.json')) as f:
+        return json.load(f)['traceEvents']
+
+
+def _by_kind(events):
+    kinds = {}
+    for event in events:
+        kinds.setdefault(event['cat'], []).append(event['args']['target'])
+    return kinds
+
+
+def test_silent_build_records_every_action(project):
+    kinds = _by_kind(_events(project, '-s'))
+    assert set(kinds) >= set(['compile', 'archive', 'link', 'install'])
+    assert all(target.endswith('.o') for target in kinds['compile'])
+    assert all(target.endswith('.a') for target in kinds['archive'])
+    assert all('/bin/' in target or '/lib/' in target or
+               '/include/' in target for target in kinds['install'])
+    assert 'None' not in sum(kinds.values(), [])
+
+
+def test_records_match_printed_build(project):
+    silent = _by_kind(_events(project, '-s'))
+    project.scons('-c')
+    printed = _by_kind(_events(project))
+    assert dict((k, sorted(v)) for k, v in silent.items()) == \
+        dict((k, sorted(v)) for k, v in printed.items())
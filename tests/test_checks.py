@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+import pytest
+
+import checks
+
+
+class FakeRun(object):
+    """Test that ends after a given number of polls"""
+
+    def __init__(self, log, test):
+        self.log = log
+        self.test = test
+        self.polls = test['polls']
+        log.append(('start', test['name']))
+
+    def poll(self):
+        self.polls -= 1
+        if self.polls > 0:
+            return None
+        self.log.append(('end', self.test['name']))
+        return dict(status='passed', message='', duration=0.0)
+
+
+def _schedule(tests, slots, previous=None):
+    log = []
+    running = {}
+    busy = []
+    finished = []
+
+    def run(test):
+        running[test['name']] = test['need']
+        busy.append(sum(running.values()))
+        return FakeRun(log, test)
+
+    def done(name, result):
+        del running[name]
+        finished.append(name)
+
+    results = checks.schedule(tests, slots, run, previous, done,
+                              poll_interval=0)
+    assert sorted(results) == sorted(finished) == \
+        sorted(t['name'] for t in tests)
+    return log, max(busy)
+
+
+def test_schedule_fills_the_slots():
+    tests = [dict(name='serial_%d' % i, need=1, polls=1) for i in range(3)]
+    tests.append(dict(name='mpi_8', need=8, polls=3))
+    tests.append(dict(name='mpi_6', need=6, polls=2))
+    log, busy = _schedule(tests, 8)
+    assert busy == 8
+    # the largest test first, the small ones fill the slots it left
+    assert log[0] == ('start', 'mpi_8')
+    assert log.index(('end', 'mpi_8')) < log.index(('start', 'mpi_6'))
+    starts = [name for event, name in log if event == 'start']
+    assert starts[1:3] == ['mpi_6', 'serial_0']
+    assert log.index(('start', 'serial_1')) < log.index(('end', 'mpi_6'))
+
+
+def test_schedule_longest_first():
+    tests = [dict(name=name, need=2, polls=1) for name in 'abc']
+    log, busy = _schedule(tests, 2, previous=dict(a=1.0, b=5.0, c=0.1))
+    starts = [name for event, name in log if event == 'start']
+    assert starts == ['b', 'a', 'c']
+    assert busy == 2
+
+
+def test_add_test_defaults(monkeypatch):
+    pytest.importorskip('SCons')
+    from SCons.Environment import Environment
+
+    monkeypatch.setattr(checks, '_checks', {})
+    monkeypatch.setattr(checks, '_cpu_count', lambda: 12)
+    env = Environment(tools=[], BUILD_OPTION='linuxg++', CHECK_TIMEOUT='600',
+                      CHECK_SLOTS='', CHECK_LAUNCHER='',
+                      BIN_PLATFORM_INSTALL='bin')
+    checks.add_test(env, 'default', 'app')
+    checks.add_test(env, 'short', 'app', ranks=4, threads=2, timeout=30)
+    default, short = checks._checks['linuxg++']['tests']
+    assert default['timeout'] == 600.0 and short['timeout'] == 30.0
+    assert default['slots'] == short['slots'] == 12
+
+    env['CHECK_SLOTS'] = '4'
+    env['CHECK_TIMEOUT'] = '5'
+    checks.add_test(env, 'small', 'app')
+    small = checks._checks['linuxg++']['tests'][-1]
+    assert small['slots'] == 4 and small['timeout'] == 5.0
+
+
+def test_timed_out_test_is_killed(tmp_path):
+    sleep = shutil.which('sleep')
+    if not sleep:
+        pytest.skip('sleep is not installed')
+
+    class Binary(object):
+        abspath = sleep
+
+    test = dict(name='hang', binary=Binary(), args=['60'], ranks=2,
+                threads=1, timeout=0.2, workdir=str(tmp_path), launcher='')
+    results = checks.schedule([dict(test, need=2)], 2,
+                              lambda t: checks._Run(t, str(tmp_path / 'log')))
+    assert results['hang']['status'] == 'timeout'
+    assert 0.2 <= results['hang']['duration'] < 10
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+pytest.importorskip('SCons')
+
+import compiler  # noqa: E402
+import compiler_probe  # noqa: E402
+
+
+def _script(path, text):
+    path.write_text('#!/bin/sh\n' + text)
+    path.chmod(0o755)
+
+
+@pytest.mark.parametrize('name, table', [
+    ('mpicc', 'gcc_flags'),
+    ('mpif90', 'gcc_flags'),
+    ('gcc-11', 'gcc_flags'),
+    ('x86_64-linux-gnu-g++-12', 'gcc_flags'),
+    ('clang-15', 'clang_flags'),
+    ('mpiicc', 'intel_flags'),
+    ('sw5gcc', 'sw_flags'),
+])
+def test_flags_by_name(name, table):
+    assert compiler._flags_by_name(name) is getattr(compiler, table)
+
+
+def test_unknown_family_uses_the_wrapped_compiler(tmp_path, monkeypatch):
+    from SCons.Environment import Environment
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    # --version names no family, the Intel-named wrapper calls gcc
+    _script(bin_dir / 'mpiicc',
+            'if [ "$1" = -show ]; then echo "gcc -I/mpi"; fi\n')
+    _script(bin_dir / 'gcc', 'echo "compiler 1.0"\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PATH', str(bin_dir))
+    monkeypatch.setattr(compiler_probe, '_probe',
+                        dict(cache=None, dirty=False))
+
+    env = Environment(tools=[], CC='mpiicc', COMPILER_PROBE=True,
+                      ENV=dict(PATH=str(bin_dir)))
+    info = compiler_probe.compiler_info('mpiicc', env)
+    assert info['family'] is None
+    assert os.path.basename(info['real']) == 'gcc'
+    assert compiler.compiler_flags(env) is compiler.gcc_flags
+
+    env['COMPILER_PROBE'] = False
+    assert compiler.compiler_flags(env) is compiler.intel_flags
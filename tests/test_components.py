@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+SRC_SCONSCRIPT = """\
+from build import build_lninclude
+from components import add_component, read_components, build_components
+
+Import('env')
+
+src_include = list(build_lninclude(env))
+add_component('comp00')
+add_component('comp01', depends=['comp00'])
+read_components(env, exports=dict(src_include=src_include))
+build_components(env, target='bench',
+                 program_inc=env['THIRDPARTY_INCS'],
+                 program_libs=env['THIRDPARTY_LIBS'])
+"""
+
+
+def test_unknown_component_fails(project):
+    with open(project.path('src', 'SConscript'), 'w') as f:
+        f.write(SRC_SCONSCRIPT)
+
+    proc = project.scons('component=comp00')
+    assert proc.returncode == 0, proc.output
+    assert 'comp00_s00.cpp' in proc.output
+    assert 'comp01_s00.cpp' not in proc.output
+
+    proc = project.scons('component=comp00,nope')
+    assert proc.returncode == 2, proc.output
+    assert 'unknown component nope, the components are: comp00, comp01' \
+        in proc.output
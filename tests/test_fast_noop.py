@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import json
+
+
+def _add_include_dirs(project, dirs):
+    with open(project.path('SConstruct')) as f:
+        text = f.read()
+    text = text.replace('    update_compiler_settings(env)\n',
+                        '    update_compiler_settings(env)\n'
+                        '    env.Append(CPPPATH=%r)\n' % dirs)
+    with open(project.path('SConstruct'), 'w') as f:
+        f.write(text)
+
+
+def test_header_earlier_on_an_outside_path(project, tmp_path):
+    first = tmp_path / 'inc_a'
+    second = tmp_path / 'inc_b'
+    first.mkdir()
+    second.mkdir()
+    (second / 'probe.h').write_text('#define PROBE 2\n')
+    _add_include_dirs(project, [str(first), str(second)])
+    source = project.path('src', 'comp00', 'comp00_s00.cpp')
+    with open(source) as f:
+        text = f.read()
+    with open(source, 'w') as f:
+        f.write('#include "probe.h"\n' + text)
+
+    for _ in range(2):
+        proc = project.scons('FAST_NOOP=1')
+        assert proc.returncode == 0, proc.output
+    assert 'scons: up to date' in proc.output
+
+    (first / 'probe.h').write_text('#define PROBE 1\n')
+    proc = project.scons('FAST_NOOP=1')
+    assert proc.returncode == 0, proc.output
+    assert 'scons: up to date' not in proc.output
+    assert 'comp00_s00.cpp' in proc.output
+
+
+def test_entry_written_with_fast_noop(project):
+    for _ in range(2):
+        proc = project.scons('FAST_NOOP=1')
+        assert proc.returncode == 0, proc.output
+    assert 'scons: up to date' in proc.output
+    path = project.path('build', '.noop_manifest.json')
+    with open(path) as f:
+        data = json.load(f)
+    for entry in data['entries'].values():
+        assert entry['fast_noop'] is True
+        entry['fast_noop'] = False
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    proc = project.scons('FAST_NOOP=1')
+    assert proc.returncode == 0, proc.output
+    assert 'scons: up to date' not in proc.output
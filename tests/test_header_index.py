@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import header_index
+
+
+@pytest.fixture
+def scan(tmp_path, monkeypatch):
+    """scan_headers of tmp_path/src as a new SCons process would run it"""
+    src = tmp_path / 'src'
+    (src / 'a').mkdir(parents=True)
+    (src / 'b').mkdir()
+    (src / 'a' / 'x.H').write_text('')
+    (src / 'b' / 'y.hpp').write_text('')
+    (src / 'b' / 'y.cpp').write_text('')
+    index = str(tmp_path / 'build' / 'index.json')
+
+    def run():
+        monkeypatch.setattr(header_index, '_scanned', {})
+        headers, collisions, stats = header_index.scan_headers(
+            str(src), index, 'posix')
+        return sorted(os.path.relpath(h, str(src)) for h in headers), stats
+    run.src = src
+    return run
+
+
+def test_unchanged_directories_are_not_listed(scan):
+    headers, stats = scan()
+    assert headers == ['a/x.H', 'b/y.hpp']
+    assert stats['rescanned'] == stats['dirs'] == 3
+
+    headers, stats = scan()
+    assert headers == ['a/x.H', 'b/y.hpp']
+    assert stats['rescanned'] == 0
+
+
+def test_changed_directory_is_listed_again(scan):
+    scan()
+    (scan.src / 'b' / 'z.h').write_text('')
+    headers, stats = scan()
+    assert headers == ['a/x.H', 'b/y.hpp', 'b/z.h']
+    assert stats['rescanned'] == 1
+
+    (scan.src / 'a' / 'x.H').unlink()
+    (scan.src / 'a' / 'c').mkdir()
+    (scan.src / 'a' / 'c' / 'w.h').write_text('')
+    headers, stats = scan()
+    assert headers == ['a/c/w.h', 'b/y.hpp', 'b/z.h']
+    assert stats['rescanned'] == 2
+
+
+def test_symlinked_directories_not_followed(scan):
+    os.symlink('..', str(scan.src / 'a' / 'loop'))
+    os.symlink(os.path.join('..', 'b'), str(scan.src / 'a' / 'b_link'))
+    os.symlink('x.H', str(scan.src / 'a' / 'x_link.h'))
+    headers, stats = scan()
+    assert headers == ['a/x.H', 'a/x_link.h', 'b/y.hpp']
+    assert stats['dirs'] == 3
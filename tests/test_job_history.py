@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from job_history import _tails  # noqa: E402
+
+
+def test_tails_skip_plain_paths():
+    assert _tails({'install/bin/app': 1.0}) == {}
+
+
+def test_silent_traced_build_writes_history(project):
+    proc = project.scons('-s', '-j2', 'JOB_HISTORY=1',
+                         'BUILD_TRACE=trace.json')
+    assert proc.returncode == 0, proc.output
+    assert 'Traceback' not in proc.output
+    files = glob.glob(project.path('build', '*', '.job_history.json'))
+    assert len(files) == 1
+    with open(files[0]) as f:
+        entries = json.load(f)['entries']
+    assert any(key.endswith('.o') for key in entries)
+    assert any(key.startswith('install') for key in entries)
+
+
+def test_history_does_not_rebuild(project):
+    for run in range(3):
+        proc = project.scons('-j2', 'JOB_HISTORY=1')
+        assert proc.returncode == 0, proc.output
+        if run:
+            commands = [line for line in proc.output.splitlines()
+                        if line.startswith(('ar ', 'ranlib ', 'g++ '))]
+            assert commands == [], proc.output
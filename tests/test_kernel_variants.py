@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+
+import pytest
+
+from conftest import Project
+from kernel_variants import pick_variant
+
+# drops the Sunway-only flags and compiles with the host toolchain
+MOCK_COMPILER = """\
+#!/bin/sh
+args=""
+for a in "$@"; do
+  case "$a" in
+    -mslave|-mhost|-mieee|-msimd|-mhybrid|-faddress_align=*) ;;
+    *) args="$args '$a'" ;;
+  esac
+done
+eval exec %s $args
+"""
+
+SRC_SCONSCRIPT = """\
+from build import add_source_files, build_objects, build_lib, \\
+    cslave_source_files, chost_source_files
+from kernel_variants import add_kernel_variants
+Import('env')
+add_source_files(['axpy_slave.c'], cslave_source_files)
+add_source_files(['axpy_host.c'], chost_source_files)
+add_kernel_variants(env, ['axpy_slave.c'],
+                    [('o3', '-O3 -msimd -DMOCK_COST=3'),
+                     ('unroll', '-O3 -msimd -funroll-loops -DMOCK_COST=1')],
+                    harness=['axpy_bench.c'])
+objs = build_objects(env, chost_source=chost_source_files,
+                     cslave_source=cslave_source_files)
+build_lib(env, target='axpy', sources=objs,
+          program_inc=env['THIRDPARTY_INCS'],
+          program_libs=env['THIRDPARTY_LIBS'])
+"""
+
+SOURCES = {
+    'axpy_slave.c': '#ifndef MOCK_COST\n#define MOCK_COST 5\n#endif\n'
+                    'double axpy_cost(void) { return MOCK_COST; }\n',
+    'axpy_host.c': 'double axpy_cost(void);\n'
+                   'double host_axpy(void) { return axpy_cost(); }\n',
+    'axpy_bench.c': '#include <stdio.h>\ndouble axpy_cost(void);\n'
+                    'int main(void) {\n'
+                    '    printf("time: %g\\n", axpy_cost() * 0.01);\n'
+                    '    return 0;\n}\n',
+}
+
+
+@pytest.mark.parametrize('times, winner', [
+    (dict(default=5.0, o3=3.0, unroll=1.0), 'unroll'),
+    (dict(default=1.0, o3=0.995, unroll=None), 'default'),
+    (dict(default=None, o3=None, unroll=None), None),
+    (dict(default=None, o3=2.0, unroll=2.0), 'o3'),
+])
+def test_pick_variant(times, winner):
+    assert pick_variant(times, ['default', 'o3', 'unroll'], 0.02) == winner
+
+
+@pytest.fixture
+def sw_project(tmp_path):
+    """Sunway project with one tuned slave kernel and mock compilers"""
+    pytest.importorskip('SCons')
+    if not shutil.which('gcc'):
+        pytest.skip('gcc is not installed')
+    from project_templates import SCONSTRUCT, BUILD_CONFIG
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, real in [('sw5gcc', 'gcc'), ('sw5g++', 'g++'),
+                       ('sw5gfortran', 'gfortran'), ('mpicxx', 'g++'),
+                       ('mpif90', 'gfortran')]:
+        path = bin_dir / name
+        path.write_text(MOCK_COMPILER % real)
+        path.chmod(0o755)
+
+    root = tmp_path / 'project'
+    for d in ('site_scons', 'src', 'test', 'mpi/include', 'mpi/lib'):
+        (root / d).mkdir(parents=True)
+    (root / 'SConstruct').write_text(SCONSTRUCT)
+    config = BUILD_CONFIG % (str(root / 'mpi/include'),
+                             str(root / 'mpi/lib'))
+    config = config.replace("'linux'", "'sw'")
+    config = '\n'.join(line for line in config.splitlines()
+                       if not line.startswith(('CC ', 'CXX ', 'F90 ',
+                                               'CXX_LINKER', 'F_LINKER')))
+    (root / 'site_scons' / 'build_config.py').write_text(config + '\n')
+    (root / 'src' / 'SConscript').write_text(SRC_SCONSCRIPT)
+    (root / 'test' / 'SConscript').write_text("Import('env')\n")
+    for name, text in SOURCES.items():
+        (root / 'src' / name).write_text(text)
+    return Project(str(root), str(bin_dir))
+
+
+def test_tune_selects_the_fastest_variant(sw_project):
+    args = ['ATHREAD=1', 'TUNE_REPEAT=1']
+    proc = sw_project.scons(*args + ['tune'])
+    assert proc.returncode == 0, proc.output
+    assert 'tune: src/axpy_slave.c: default 0.05 s, o3 0.03 s, ' \
+        'unroll 0.01 s -> unroll' in proc.output
+
+    with open(sw_project.path('sw_tuning.json')) as f:
+        tuning = json.load(f)
+    assert list(tuning) == ['swsw5g++Int32Float64OptAthread']
+    entry = tuning['swsw5g++Int32Float64OptAthread']['src/axpy_slave.c']
+    assert entry['variant'] == 'unroll'
+    assert entry['flags'] == '-O3 -msimd -funroll-loops -DMOCK_COST=1'
+
+    # a clean build compiles the kernel with the winner only
+    shutil.rmtree(sw_project.path('build'))
+    proc = sw_project.scons(*args)
+    assert proc.returncode == 0, proc.output
+    slave = [line for line in proc.output.splitlines()
+             if line.endswith('axpy_slave.c')]
+    assert len(slave) == 1 and '-DMOCK_COST=1' in slave[0], proc.output
+    assert 'axpy_slave_unroll_slave.o' in slave[0]
+
+    # other configurations have kernels of their own, not tuned yet
+    proc = sw_project.scons(*args + ['INT_TYPE=64'])
+    assert proc.returncode == 0, proc.output
+    slave = [line for line in proc.output.splitlines()
+             if line.endswith('axpy_slave.c')]
+    assert len(slave) == 1 and '-DMOCK_COST' not in slave[0], proc.output
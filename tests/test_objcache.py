@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+import pytest
+
+import objcache
+
+
+def _key(args):
+    return objcache.cache_key(args, 'a.o', 'a.cpp', b'int a;\n')
+
+
+def test_precompiled_header_content_in_key(tmp_path):
+    pch = tmp_path / 'all.hpp.pch'
+    pch.write_bytes(b'one')
+    args = ['clang++', '-c', '-o', 'a.o', '-include-pch', str(pch), 'a.cpp']
+    first = _key(args)
+    pch.write_bytes(b'two')
+    assert _key(args) != first
+
+    intel = ['icpc', '-c', '-o', 'a.o', '-pch-use', str(pch), 'a.cpp']
+    assert objcache._pch_files(intel) == [str(pch)]
+    pch.unlink()
+    with pytest.raises((IOError, OSError)):
+        _key(args)
+
+
+def test_pch_path_not_in_key(tmp_path):
+    keys = []
+    for name in ('a', 'b'):
+        pch = tmp_path / name
+        pch.write_bytes(b'same')
+        keys.append(_key(['clang++', '-c', '-o', 'a.o', '-include-pch',
+                          str(pch), 'a.cpp']))
+    assert keys[0] == keys[1]
+
+
+def test_stats_merged_at_the_end(tmp_path):
+    cache_dir = str(tmp_path)
+    objcache._update_stats(cache_dir, hits=1)
+    objcache._update_stats(cache_dir, misses=1, size=10)
+    objcache._update_stats(cache_dir, uncacheable=1)
+    assert not os.path.exists(os.path.join(cache_dir, 'stats.json'))
+    stats = objcache.read_stats(cache_dir)
+    assert (stats['hits'], stats['misses'], stats['uncacheable'],
+            stats['size']) == (1, 1, 1, 10)
+
+    merged = objcache.merge_stats(cache_dir)
+    assert merged == stats
+    assert objcache._pending_stats(cache_dir) == []
+    assert objcache.read_stats(cache_dir) == stats
+
+
+def test_used_fortran_modules():
+    text = b'module x\n  use m\n  use :: n, only: k\n' \
+           b'  use, intrinsic :: iso_c_binding\n' \
+           b'  use, non_intrinsic :: P\n  user = 1\n'
+    assert objcache._used_fortran_modules(text) == ['m', 'n', 'p']
+
+
+def test_fortran_module_content_in_key(tmp_path, monkeypatch):
+    if not shutil.which('gfortran'):
+        pytest.skip('gfortran is not installed')
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    os.mkdir('mods')
+    with open('u.f90', 'w') as f:
+        f.write('subroutine u(r)\n  use m\n  integer r\n  r = n\n'
+                'end subroutine\n')
+    compile_u = ['gfortran', '-cpp', '-c', '-Jmods', '-o', 'u.o', 'u.f90']
+
+    objects = []
+    for n in (1, 2, 1):
+        with open('m.f90', 'w') as f:
+            f.write('module m\n  integer, parameter :: n = %d\nend module\n'
+                    % n)
+        assert objcache.run_cached(cache_dir, [
+            'gfortran', '-cpp', '-c', '-Jmods', '-o', 'm.o', 'm.f90']) == 0
+        assert objcache.run_cached(cache_dir, compile_u) == 0
+        with open('u.o', 'rb') as f:
+            objects.append(f.read())
+    assert objects[0] != objects[1]
+    assert objects[0] == objects[2]
+    stats = objcache.read_stats(cache_dir)
+    # m.f90 defines a module and is never cached, u.o hits the third time
+    assert (stats['hits'], stats['misses'], stats['uncacheable']) == (1, 2, 3)
+
+
+def test_native_compiles_keyed_by_host_cpu(monkeypatch):
+    native = ['g++', '-c', '-march=native', '-o', 'a.o', 'a.cpp']
+    plain = ['g++', '-c', '-O2', '-o', 'a.o', 'a.cpp']
+    monkeypatch.setattr(objcache, '_host_cpu', lambda: 'model: 1')
+    first = _key(native)
+    plain_key = _key(plain)
+    monkeypatch.setattr(objcache, '_host_cpu', lambda: 'model: 2')
+    assert _key(native) != first
+    assert _key(plain) == plain_key
+    monkeypatch.setattr(objcache, '_host_cpu', lambda: None)
+    with pytest.raises((IOError, OSError)):
+        _key(['icpc', '-c', '-xHost', '-o', 'a.o', 'a.cpp'])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import re
+
+import pytest
+
+ARGS = ['-j2', 'CONFIGS=Int32DP,Int64DP', 'BUILD_TYPE=PGO']
+
+
+def test_profiles_of_each_configuration_kept_apart(project):
+    proc = project.scons(*ARGS + ['PGO_PHASE=generate'])
+    assert proc.returncode == 0, proc.output
+    manifests = glob.glob(project.path('build', '*', 'pgo', 'manifest.json'))
+    assert len(manifests) == 2
+
+    # only the Int32 configuration was trained
+    profile_dir = glob.glob(project.path('build', '*Int32*', 'pgo'))[0]
+    open(os.path.join(profile_dir, 'x.gcda'), 'w').close()
+    proc = project.scons(*ARGS + ['PGO_PHASE=use'])
+    assert proc.returncode == 0, proc.output
+    compiles = [line for line in proc.output.splitlines()
+                if re.search(r' -c .*\.cpp$', line)]
+    int32 = [line for line in compiles if 'Int32Float64PGO/src' in line]
+    int64 = [line for line in compiles if 'Int64Float64PGO/src' in line]
+    assert int32 and int64
+    assert all('-fprofile-use=%s' % profile_dir in line for line in int32)
+    assert not any('-fprofile-use' in line for line in int64)
+
+    # a new Int32 profile does not touch the Int64 objects
+    with open(os.path.join(profile_dir, 'y.gcda'), 'w') as f:
+        f.write('more')
+    proc = project.scons(*ARGS + ['PGO_PHASE=use'])
+    assert proc.returncode == 0, proc.output
+    assert 'Int32Float64PGO/src' in proc.output
+    assert 'Int64Float64PGO/src' not in proc.output
+
+
+@pytest.mark.parametrize('rejects, quiet', [(True, False), (False, True)])
+def test_missing_profile_warning_only_when_accepted(tmp_path, monkeypatch,
+                                                    rejects, quiet):
+    pytest.importorskip('SCons')
+    from SCons.Environment import Environment
+    import compiler
+    import compiler_probe
+    import pgo
+
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    # gcc 7 rejects -Wmissing-profile, gcc 9 accepts it
+    gcc = bin_dir / 'gcc'
+    gcc.write_text('#!/bin/sh\n'
+                   'case "$*" in *--version*) echo "gcc (GCC) 9.1.0";; '
+                   '*-Wmissing-profile*) exit %d;; esac\n' % int(rejects))
+    gcc.chmod(0o755)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PATH', str(bin_dir))
+    monkeypatch.setattr(compiler_probe, '_probe',
+                        dict(cache=None, dirty=False))
+
+    env = Environment(tools=[], CC='gcc', CXX='gcc', F90='gcc',
+                      COMPILER_PROBE=True, ENV=dict(PATH=str(bin_dir)))
+    flags = pgo._use_flags(env, compiler.gcc_flags)
+    assert flags.startswith(compiler.gcc_flags['pgo_use'])
+    assert ('-Wno-missing-profile' in flags) == quiet
+    env['COMPILER_PROBE'] = False
+    assert '-Wno-missing-profile' not in pgo._use_flags(env,
+                                                         compiler.gcc_flags)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import time
+import subprocess
+
+import pytest
+
+import remote_exec
+
+TOKEN = 'sesame'
+SCRIPT = os.path.abspath(remote_exec.__file__).replace('.pyc', '.py')
+
+
+@pytest.fixture
+def worker():
+    """Worker with one slot on a free localhost port"""
+    proc = subprocess.Popen(
+        [sys.executable, SCRIPT, 'worker', '--port', '0', '--jobs', '1'],
+        env=dict(os.environ, REMOTE_TOKEN=TOKEN), stdout=subprocess.PIPE)
+    line = proc.stdout.readline().decode()
+    port = int(re.search(r':(\d+) ', line).group(1))
+    yield [('127.0.0.1', port)]
+    proc.kill()
+    proc.wait()
+
+
+def test_round_trip(worker, tmp_path, capfd):
+    out = tmp_path / 'out.txt'
+    status = remote_exec.run_remote(
+        worker, [sys.executable, '-c',
+                 'import os; open(%r, "w").write(os.getcwd()); '
+                 'print("remote")' % str(out)], TOKEN)
+    assert status == 0
+    assert out.read_text() == os.getcwd()
+    assert 'remote' in capfd.readouterr().out
+    status = remote_exec.run_remote(
+        worker, [sys.executable, '-c', 'raise SystemExit(3)'], TOKEN)
+    assert status == 3
+
+
+def test_wrong_token_refused(worker):
+    assert remote_exec.run_remote(worker, ['true'], 'other') is None
+
+
+def test_busy_worker_falls_back_after_the_wait(worker):
+    slow = subprocess.Popen(
+        [sys.executable, SCRIPT, 'submit', '--workers',
+         '%s:%d' % worker[0], '--',
+         sys.executable, '-c', 'import time; time.sleep(3)'],
+        env=dict(os.environ, REMOTE_TOKEN=TOKEN))
+    try:
+        time.sleep(1.0)
+        start = time.time()
+        status = remote_exec.run_remote(worker, ['true'], TOKEN,
+                                        busy_wait=0.5)
+        assert status is None
+        assert time.time() - start < 2.0
+    finally:
+        slow.wait()
+
+
+def test_token_not_on_the_command_line(project, worker):
+    proc = project.scons('-j2', 'REMOTE_WORKERS=127.0.0.1:%d' % worker[0][1],
+                         env=dict(REMOTE_TOKEN=TOKEN))
+    assert proc.returncode == 0, proc.output
+    assert 'submit --workers' in proc.output
+    assert TOKEN not in proc.output
+
+
+def test_no_token_only_on_loopback():
+    with pytest.raises(ValueError):
+        remote_exec.serve('0.0.0.0', 0, 1)
+    proc = subprocess.run(
+        [sys.executable, SCRIPT, 'worker', '--host', '0.0.0.0',
+         '--port', '0'], env=dict(os.environ, REMOTE_TOKEN=''),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10)
+    assert proc.returncode == 2
+    assert b'REMOTE_TOKEN' in proc.stdout
+    assert remote_exec._is_loopback('127.0.0.1')
+    assert not remote_exec._is_loopback('')
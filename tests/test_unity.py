@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+pytest.importorskip('SCons')
+
+from build import unity_batches  # noqa: E402
+
+BASE = '/project/src'
+
+
+def _files(names, d='solver'):
+    return sorted(os.path.join(BASE, d, name) for name in names)
+
+
+def _changed_window(old, new):
+    """Files of the batches in between the common first and last batches"""
+    head = 0
+    while head < min(len(old), len(new)) and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < min(len(old), len(new)) - head and \
+            old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    return sum(new[head:len(new) - tail], [])
+
+
+def test_batch_sizes_bounded():
+    files = _files(['f%03d.cpp' % i for i in range(400)])
+    batches = unity_batches(files, 8, BASE)
+    assert sum(batches, []) == files
+    assert max(len(b) for b in batches) <= 16
+    assert 25 <= len(batches) <= 100
+
+
+def test_adding_or_removing_a_file_keeps_the_other_batches():
+    names = ['f%03d.cpp' % i for i in range(200)]
+    old = unity_batches(_files(names), 8, BASE)
+    for extra in ('a.cpp', 'f050a.cpp', 'f100a.cpp', 'z.cpp'):
+        new = unity_batches(_files(names + [extra]), 8, BASE)
+        window = _changed_window(old, new)
+        assert _files([extra])[0] in window
+        assert len(window) <= 32
+    for i in (0, 73, 199):
+        new = unity_batches(_files(names[:i] + names[i + 1:]), 8, BASE)
+        window = _changed_window(old, new)
+        assert len(window) <= 32
+
+
+def test_same_name_in_other_directory_hashes_differently():
+    a = unity_batches(_files(['x%d.cpp' % i for i in range(64)], 'a'), 8,
+                      BASE)
+    b = unity_batches(_files(['x%d.cpp' % i for i in range(64)], 'b'), 8,
+                      BASE)
+    assert [[os.path.basename(f) for f in batch] for batch in a] != \
+        [[os.path.basename(f) for f in batch] for batch in b]
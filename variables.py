@@ -11,10 +11,10 @@ for program.
 import os
 import platform
 import getpass
-from SCons.Environment import Environment
 from SCons.Variables import (Variables, EnumVariable, PathVariable,
                              BoolVariable)
 from SCons.Script import ARGUMENTS
+from config_cache import config_value, CONFIG_FILE
 
 
 def ostype():
@@ -26,7 +26,7 @@ def ostype():
         return os.uname()[0].lower()
 
 
-program_vars = Variables('site_scons/build_config.py', ARGUMENTS)
+program_vars = Variables(CONFIG_FILE, ARGUMENTS)
 program_vars.AddVariables(
     # Project specific variables
     EnumVariable('PLATFORM',
@@ -36,7 +36,14 @@ program_vars.AddVariables(
     EnumVariable('BUILD_TYPE',
                  'Type of build',
                  'Opt',
-                 allowed_values=('Opt', 'Debug', 'Prof')),
+                 allowed_values=('Opt', 'Debug', 'Prof', 'Perf', 'PGO')),
+    BoolVariable('PERF_INSTRUMENT',
+                 'Time every function with -finstrument-functions', False),
+    EnumVariable('PGO_PHASE',
+                 'Phase of BUILD_TYPE=PGO',
+                 'use',
+                 allowed_values=('generate', 'use')),
+    ('PGO_TRAIN_CMD', 'Training command run by the pgo-train alias', ''),
     EnumVariable('BUILD_ARCH',
                  'Build architecture',
                  '64',
@@ -45,6 +52,7 @@ program_vars.AddVariables(
                  'Single/Double precision',
                  'DP',
                  allowed_values=('DP', 'SP')),
+    ('CONFIGS', 'Configurations built together, e.g. Int32DP,Int64DP', ''),
     EnumVariable('INT_TYPE', 'Integer size', '32',
                  allowed_values=('32', '64')),
     EnumVariable('FLOAT_TYPE', 'Float size', '64',
@@ -53,11 +61,70 @@ program_vars.AddVariables(
     EnumVariable('LIB_TYPE',
                  'library building type',
                  'static',
-                 allowed_values=('shared', 'static', 'object')),
+                 allowed_values=('shared', 'static', 'thin', 'object')),
+    EnumVariable('INSTALL_MODE',
+                 'How headers, libraries and executables are installed',
+                 'copy',
+                 allowed_values=('copy', 'hardlink', 'symlink', 'reflink')),
+    EnumVariable('LTO',
+                 'Link-time optimisation',
+                 'none',
+                 allowed_values=('none', 'full', 'thin')),
+    ('LTO_JOBS', 'Parallel jobs of thin LTO (default: cores)', ''),
+    BoolVariable('COMPILER_PROBE',
+                 'Identify the compilers and try-compile flags', True),
+    EnumVariable('HOST_TUNING',
+                 'Optimise for the build host (native) and use fast-math '
+                 '(fast)',
+                 'none',
+                 allowed_values=('none', 'native', 'fast')),
+    BoolVariable('VEC_REPORT', 'Print the vectorisation report of compiles',
+                 False),
+    EnumVariable('LINKER',
+                 'Linker used by the compiler driver',
+                 'default',
+                 allowed_values=('default', 'bfd', 'gold', 'lld', 'mold')),
+    BoolVariable('SPLIT_DWARF',
+                 'Split debug info into .dwo files (-gsplit-dwarf)', False),
+    BoolVariable('STARTUP_REPORT', 'Print the time to the first build task',
+                 False),
     BoolVariable('VERBOSE', 'Print verbosely when compiling', False),
+    BoolVariable('OBJ_CACHE', 'Cache objects keyed on preprocessed sources',
+                 False),
+    ('OBJ_CACHE_DIR', 'Object cache directory (may be shared)',
+     os.path.join(os.path.expanduser('~'), '.amd_scons', 'objcache')),
+    ('OBJ_CACHE_SIZE', 'Object cache size limit (e.g. 500M, 5G)', '5G'),
+    BoolVariable('UNITY_BUILD', 'Batch C/C++ sources into unity files',
+                 False),
+    ('UNITY_BATCH_SIZE', 'Average number of sources per unity file', '8'),
+    BoolVariable('DEPFILES',
+                 'Take header dependencies from compiler depfiles', False),
+    ('PCH_HEADER', 'Header precompiled for C++ sources', ''),
+    ('BUILD_TRACE', 'Write a Chrome trace of build actions to this file',
+     ''),
+    ('TRACE_TOP', 'Number of slowest targets in the timing summary', '10'),
+    BoolVariable('JOB_HISTORY',
+                 'Schedule longest jobs first and choose -j from history',
+                 False),
+    ('JOB_HISTORY_DAYS', 'Days before unused timing entries expire', '30'),
+    ('JOB_MEMORY', 'Memory per compile job for the default -j', ''),
+    ('REMOTE_WORKERS', 'Compile workers as host:port,host:port', ''),
+    ('REMOTE_TOKEN', 'Shared secret of the compile workers',
+     os.environ.get('REMOTE_TOKEN', '')),
+    ('REMOTE_LOCAL', 'Source types always compiled locally', 'cslave'),
+    ('REMOTE_BUSY_WAIT', 'Seconds to wait for a free worker before '
+     'compiling locally', '5'),
+    BoolVariable('FAST_NOOP',
+                 'Timestamp decider, .sconsign per BUILD_OPTION and skipping '
+                 'unchanged runs', False),
+    ('CHECK_SLOTS', 'Cores shared by the tests of check (default: all)', ''),
+    ('CHECK_LAUNCHER', 'MPI launcher of check, e.g. "mpirun -np {ranks}"',
+     ''),
+    ('CHECK_TIMEOUT', 'Default test timeout of check in seconds', '600'),
 )
 
-ostype = Environment(variables=program_vars)['PLATFORM']
+# read directly, creating an Environment here would run the tool detection
+ostype = config_value('PLATFORM', ostype())
 print('PLATFORM: ', ostype)
 
 if ostype == "windows":
@@ -105,6 +172,13 @@ elif ostype == "sw":
                      '/usr/sw-mpp/swcc/new_compiler_710/mpi_install/lib',
                      PathVariable.PathIsDir),
         BoolVariable('ATHREAD', 'Use Shenwei multi-threading', False),
+        ('SW_TUNING_FILE', 'Slave kernel variants chosen by tune',
+         'sw_tuning.json'),
+        ('TUNE_LAUNCHER', 'Launcher of the tune harnesses, e.g. "bsub -I '
+         '-b -q q_sw_expr -n 1 -cgsp 64"', ''),
+        ('TUNE_LINKFLAGS', 'Link flags of the tune harnesses', '-mhybrid'),
+        ('TUNE_REPEAT', 'Runs of each kernel variant by tune', '3'),
+        ('TUNE_MARGIN', 'Fraction a variant must beat default by', '0.02'),
     )
 else:
     print('Unknown ostype')
@@ -116,6 +190,18 @@ def init_dependent_vars(env, prj_dir):
     ostype = env['PLATFORM']
     BUILD_OPTION = (ostype + env['CXX'] + 'Int' + env['INT_TYPE'] + 'Float' +
                     env['FLOAT_TYPE'] + env['BUILD_TYPE'])
+    if env['PRECISION'] == 'SP':
+        BUILD_OPTION += 'SP'
+    if env['OMP']:
+        BUILD_OPTION += 'Omp'
+    if env.get('ATHREAD'):
+        BUILD_OPTION += 'Athread'
+    if env['LTO'] != 'none':
+        BUILD_OPTION += 'Lto' if env['LTO'] == 'full' else 'ThinLto'
+    if env['PERF_INSTRUMENT']:
+        BUILD_OPTION += 'Instr'
+    if env['HOST_TUNING'] != 'none':
+        BUILD_OPTION += env['HOST_TUNING'].capitalize()
     PLATFORM_INSTALL = os.path.join(prj_dir, 'install', BUILD_OPTION)
     BIN_PLATFORM_INSTALL = os.path.join(PLATFORM_INSTALL, 'bin')
     LIB_PLATFORM_INSTALL = os.path.join(PLATFORM_INSTALL, 'lib')